@@ -0,0 +1,41 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0002_full_text_search'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql='''
+UPDATE core_manga
+   SET last_issue_modified = (SELECT MAX(core_issue.modified)
+                                FROM core_issue
+                               WHERE core_issue.manga_id = core_manga.id);
+
+UPDATE core_subscription
+   SET last_result_modified = (SELECT MAX(core_result.modified)
+                                 FROM core_result
+                                WHERE core_result.subscription_id =
+                                      core_subscription.id);
+
+CREATE INDEX core_manga_latests_idx
+          ON core_manga (last_issue_modified DESC NULLS LAST,
+                         name ASC,
+                         url ASC);
+
+CREATE INDEX core_subscription_latests_idx
+          ON core_subscription (user_id,
+                                last_result_modified DESC NULLS LAST,
+                                id ASC)
+       WHERE deleted = false;
+''',
+            reverse_sql='''
+DROP INDEX core_subscription_latests_idx;
+
+DROP INDEX core_manga_latests_idx;
+'''
+        )
+    ]
@@ -0,0 +1,28 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_incremental_full_text_search'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql='''
+INSERT INTO core_quotaentry (result_id, user_id, subscription_id, send_date)
+     SELECT core_result.id,
+            core_subscription.user_id,
+            core_subscription.id,
+            core_result.send_date
+       FROM core_result
+ INNER JOIN core_subscription
+         ON core_result.subscription_id = core_subscription.id
+      WHERE core_result.send_date IS NOT NULL
+ON CONFLICT (result_id) DO NOTHING;
+''',
+            reverse_sql='''
+DELETE FROM core_quotaentry;
+'''
+        )
+    ]
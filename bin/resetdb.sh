@@ -14,6 +14,9 @@ rm kmanga/core/migrations/000*
 rm kmanga/registration/migrations/000*
 $PYTHON kmanga/manage.py makemigrations
 cp bin/0002_full_text_search.py kmanga/core/migrations/
+cp bin/0003_latest_activity.py kmanga/core/migrations/
+cp bin/0004_incremental_full_text_search.py kmanga/core/migrations/
+cp bin/0005_quota_ledger.py kmanga/core/migrations/
 $PYTHON kmanga/manage.py migrate
 $PYTHON kmanga/manage.py createsuperuser --username aplanas --email aplanas@gmail.com
 $PYTHON kmanga/manage.py loaddata bin/initialdata.json
@@ -0,0 +1,84 @@
+import hashlib
+import json
+import logging
+
+from django.conf import settings
+import django_rq
+from redis.exceptions import RedisError
+
+
+logger = logging.getLogger(__name__)
+
+
+class SearchCache(object):
+    """Cache for the results of the full text search.
+
+    The ranked results of a search are stored in windows of `window`
+    entries.  Every window is stored in Redis (the one used by the RQ
+    `queue`) under a key that contains the version of the cache, the
+    normalized tsquery and the number of the window.  Together with
+    the entries, every window stores the total number of results.
+
+    Bumping the version invalidates all the windows, that will
+    expire after `timeout` seconds.
+
+    """
+    prefix = 'kmanga:search'
+
+    def __init__(self, queue=None, timeout=None, window=None):
+        self.queue = queue or settings.SEARCH_CACHE_QUEUE
+        self.timeout = timeout or settings.SEARCH_CACHE_TIMEOUT
+        self.window = window or settings.SEARCH_CACHE_WINDOW
+        self._version = None
+
+    @property
+    def enabled(self):
+        return bool(self.timeout)
+
+    def _connection(self):
+        return django_rq.get_connection(self.queue)
+
+    def version(self):
+        """Return the current version of the cache."""
+        if self._version is None:
+            version = self._connection().get('%s:version' % self.prefix)
+            self._version = int(version) if version else 0
+        return self._version
+
+    def bump(self):
+        """Invalidate all the windows stored in the cache."""
+        try:
+            self._connection().incr('%s:version' % self.prefix)
+        except RedisError as e:
+            logger.warning('Search cache not invalidated: %s' % e)
+        self._version = None
+
+    def _key(self, tsquery, window):
+        digest = hashlib.md5(tsquery.encode()).hexdigest()
+        return '%s:%d:%s:%d' % (self.prefix, self.version(), digest, window)
+
+    def get(self, tsquery, window, populate):
+        """Return the count and the entries of a window.
+
+        If the window is not in the cache, `populate(offset, limit)`
+        is called to get the count and the entries.  Return None if
+        Redis is not available.
+
+        """
+        try:
+            key = self._key(tsquery, window)
+            value = self._connection().get(key)
+        except RedisError as e:
+            logger.warning('Search cache not available: %s' % e)
+            return None
+
+        if value:
+            return json.loads(value.decode())
+
+        count, entries = populate(window * self.window, self.window)
+        try:
+            self._connection().set(key, json.dumps([count, entries]),
+                                   ex=self.timeout)
+        except RedisError as e:
+            logger.warning('Search cache not updated: %s' % e)
+        return count, entries
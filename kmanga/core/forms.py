@@ -52,14 +52,9 @@ class IssueActionForm(forms.Form):
         """Mark issues with a specific status."""
         subscription = self.cleaned_data['subscription']
         action = self.cleaned_data['action']
-        for issue in self.cleaned_data['issues']:
-            result = issue.create_result_if_needed(
-                user=subscription.user,
-                status=action,
-                set_send_date=False
-            )
-            if result.status != action:
-                result.set_status(status=action)
+        Result.objects.transition(self.cleaned_data['issues'],
+                                  subscription.user, action,
+                                  set_send_date=False)
 
     def send(self):
         """Send issues to the user."""
@@ -1,10 +1,14 @@
+import collections
 import datetime
 import logging
 import os
+import time
 
 from django.conf import settings
+from django.contrib.auth.models import User
 from django.core.management.base import BaseCommand
 from django.core.management.base import CommandError
+from django.db import transaction
 from django.db.models import Max
 from django.db.models import Q
 from django.utils import timezone
@@ -13,6 +17,8 @@ from core.models import Issue
 from core.models import Manga
 from core.models import Result
 from core.models import Source
+from core.sweep import Sweep
+from mobi.cache import DB
 from mobi.cache import IssueCache
 from mobi.cache import MobiCache
 from registration.models import UserProfile
@@ -29,6 +35,7 @@ class Command(BaseCommand):
             'manga',
             'user',
             'image-cache',
+            'cache-gc',
             'issue-cache',
             'mobi-cache',
             'cover',
@@ -56,6 +63,28 @@ class Command(BaseCommand):
         parser.add_argument(
             '-f', '--force', action='store_true', dest='force', default=False,
             help='Force the deletion, otherwise exit the command.')
+        parser.add_argument(
+            '-n', '--dry-run', action='store_true', dest='dry_run',
+            default=False,
+            help='Delete the objects in a transaction that is rolled '
+                 'back, and show the stats.  The caches and the covers '
+                 'are only listed.')
+        parser.add_argument(
+            '-b', '--batch', action='store', dest='batch', default=1000,
+            help='Number of objects removed in each transaction '
+                 '(<number>).')
+        parser.add_argument(
+            '-w', '--sleep', action='store', dest='sleep', default=0,
+            help='Seconds to wait between transactions (<number>).')
+        parser.add_argument(
+            '-t', '--workers', action='store', dest='workers', default=4,
+            help='Number of threads used to sweep the image cache '
+                 '(<number>).')
+        parser.add_argument(
+            '-c', '--checkpoint', action='store', dest='checkpoint',
+            default=None,
+            help='File used to resume an interrupted sweep of the '
+                 'image cache (<file>).')
         # General parameters
         parser.add_argument(
             '--loglevel', action='store', dest='loglevel', default='WARNING',
@@ -93,7 +122,7 @@ class Command(BaseCommand):
     def handle(self, *args, **options):
         command = options['command']
 
-        actions = ('force', 'list', 'remove')
+        actions = ('force', 'list', 'remove', 'dry_run')
         if not any(options[i] for i in actions):
             msg = 'Please, provide one action: %s' % '|'.join(actions)
             raise CommandError(msg)
@@ -106,11 +135,25 @@ class Command(BaseCommand):
             hours = 24 * int(options['days'] if options['days'] else 0)
             hours += int(options['hours'] if options['hours'] else 0)
 
+        try:
+            self.batch = int(options['batch'])
+            self.sleep = float(options['sleep'])
+        except ValueError:
+            raise CommandError('Batch and sleep parameters are not numbers.')
+        if self.batch <= 0:
+            raise CommandError('Batch parameter must be positive.')
+        self.dry_run = options['dry_run']
+
         sources = self._get_sources(options['spiders'])
         remove = options['remove']
         list_ = options['list']
-        force = options['force']
+        force = options['force'] or self.dry_run
         list_ = list_ or not force
+        # Only the database and the image sweep can roll back the
+        # removal, the caches and the covers are only listed
+        if self.dry_run and command in ('issue-cache', 'mobi-cache',
+                                        'cover'):
+            list_ = True
 
         loglevel = options['loglevel']
         logger.setLevel(loglevel)
@@ -121,7 +164,15 @@ class Command(BaseCommand):
             self._clean_user(hours, remove, list_)
         elif command == 'image-cache':
             cache = os.path.join(settings.IMAGES_STORE, 'full')
-            self._clean_image_cache(hours, cache, list_)
+            self._clean_image_cache(hours, cache, list_,
+                                    int(options['workers']),
+                                    options['checkpoint'])
+        elif command == 'cache-gc':
+            issue_cache = IssueCache(settings.ISSUES_STORE,
+                                     settings.IMAGES_STORE)
+            mobi_cache = MobiCache(settings.MOBI_STORE)
+            self._clean_cache_gc(hours, issue_cache, mobi_cache, list_,
+                                 int(options['workers']))
         elif command == 'mobi-cache':
             cache = MobiCache(settings.MOBI_STORE)
             self._clean_cache(hours, cache, list_)
@@ -139,6 +190,54 @@ class Command(BaseCommand):
         else:
             raise CommandError('Not valid command value.')
 
+    def _batches(self, queryset):
+        """Iterate over a queryset in batches of objects.
+
+        The batches are read using the primary key as a cursor, so
+        the objects of a batch can be removed before reading the next
+        one.
+
+        """
+        last = None
+        while True:
+            query = queryset.order_by('pk')
+            if last is not None:
+                query = query.filter(pk__gt=last)
+            batch = list(query[:self.batch])
+            if not batch:
+                break
+            yield batch
+            last = batch[-1].pk
+
+    def _delete(self, queryset, stats, update=None):
+        """Delete (or update) a batch of objects in a transaction.
+
+        The deleted objects, including the cascades, are counted in
+        `stats`.  In dry run mode the transaction is rolled back.
+
+        """
+        with transaction.atomic():
+            if update:
+                count = queryset.update(**update)
+                stats[queryset.model._meta.label] += count
+            else:
+                _, count = queryset.delete()
+                stats.update(count)
+            if self.dry_run:
+                transaction.set_rollback(True)
+        if self.sleep:
+            time.sleep(self.sleep)
+
+    def _print_stats(self, stats):
+        """Print the number of objects removed per model."""
+        if self.dry_run:
+            title = 'Objects to remove (dry run)'
+        else:
+            title = 'Objects removed'
+        header = (('model', 40), ('count', 10))
+        body = sorted(stats.items())
+        self._print_table(title, header, body)
+
     def _fmt(self, timedelta=None, hours=None):
         """String format hours to show days and hours."""
         fmt = '%02dd %02dh'
@@ -154,25 +253,35 @@ class Command(BaseCommand):
         mangas = Manga.objects.filter(modified__lt=since)
         if sources:
             mangas = mangas.filter(source__in=sources)
+        mangas = mangas.select_related('source')
 
         if list_:
             title = 'Mangas to remove (age: %s)' % self._fmt(hours=hours)
             header = (('name', 35), ('url', 46), ('source', 11), ('age', 7))
             body = []
+        else:
+            stats = collections.Counter()
 
-        for manga in mangas:
-            old = self._fmt(timedelta=(today - manga.modified))
-            if list_:
-                body.append((manga.name, manga.url, manga.source.name, old))
-            else:
-                logger.info('Removing %s (%s) from %s [%s].' % (manga.name,
-                                                                manga.url,
-                                                                manga.source,
-                                                                old))
-                manga.delete()
+        for batch in self._batches(mangas):
+            for manga in batch:
+                old = self._fmt(timedelta=(today - manga.modified))
+                if list_:
+                    body.append((manga.name, manga.url, manga.source.name,
+                                 old))
+                else:
+                    logger.info('Removing %s (%s) from %s [%s].' % (
+                        manga.name,
+                        manga.url,
+                        manga.source,
+                        old))
+            if not list_:
+                self._delete(mangas.filter(pk__in=[m.pk for m in batch]),
+                             stats)
 
         if list_:
             self._print_table(title, header, body)
+        else:
+            self._print_stats(stats)
 
     def _clean_user(self, hours, remove, list_):
         """Remove or disable inactive user."""
@@ -186,58 +295,56 @@ class Command(BaseCommand):
             last_sent=Max('user__subscription__result__modified')
         ).filter(
             Q(last_sent__lt=since) | Q(last_sent__isnull=True)
-        )
+        ).select_related('user')
 
         if list_:
             title = 'Users to remove (age: %d)' % hours
             header = (('username', 30), ('email', 40), ('last login', 10),
                       ('last sent', 10))
             body = []
+        else:
+            stats = collections.Counter()
+
+        for batch in self._batches(userprofiles):
+            for userprofile in batch:
+                user = userprofile.user
+                last_login = self._fmt(timedelta=(today - user.last_login))
+                if userprofile.last_sent:
+                    last_sent = self._fmt(
+                        timedelta=(today - userprofile.last_sent))
+                else:
+                    last_sent = 'never'
 
-        for userprofile in userprofiles:
-            user = userprofile.user
-            last_login = self._fmt(timedelta=(today - user.last_login))
-            if userprofile.last_sent:
-                last_sent = self._fmt(
-                    timedelta=(today - userprofile.last_sent))
-            else:
-                last_sent = 'never'
-
-            if list_:
-                body.append((user.username, user.email, last_login,
-                             last_sent))
-            else:
-                if remove:
-                    logger.info(
-                        'Removing %s <%s> [login: %s] [result: %s].' % (
-                            user.username,
-                            user.email,
-                            last_login,
-                            last_sent))
-                    user.delete()
+                if list_:
+                    body.append((user.username, user.email, last_login,
+                                 last_sent))
                 else:
                     logger.info(
-                        'Disabling %s <%s> [login: %s] [result: %s].' % (
+                        '%s %s <%s> [login: %s] [result: %s].' % (
+                            'Removing' if remove else 'Disabling',
                             user.username,
                             user.email,
                             last_login,
                             last_sent))
-                    user.is_active = False
-                    user.save()
+            if not list_:
+                users = User.objects.filter(
+                    pk__in=[up.user_id for up in batch])
+                if remove:
+                    self._delete(users, stats)
+                else:
+                    self._delete(users, stats, update={'is_active': False})
 
         if list_:
             self._print_table(title, header, body)
+        else:
+            self._print_stats(stats)
 
-    def _file_date(self, file_path, tzinfo=None):
-        """Return the date of a file."""
-        mtime = datetime.datetime.fromtimestamp(os.path.getmtime(file_path))
-        if tzinfo:
-            mtime = mtime.replace(tzinfo=tzinfo)
-        return mtime
-
-    def _clean_image_cache(self, hours, cache, list_):
+    def _clean_image_cache(self, hours, cache, list_, workers=4,
+                           checkpoint=None):
         """Remove old cached images."""
         today = timezone.now()
+        # Compare directly the timestamps from the `stat` result
+        since = (today - timezone.timedelta(hours=hours)).timestamp()
 
         if list_:
             title = 'Image from the cache to remove ' \
@@ -245,20 +352,137 @@ class Command(BaseCommand):
             header = (('image', 92), ('age', 7))
             body = []
 
-        for file_ in os.listdir(cache):
-            file_ = os.path.join(cache, file_)
-            mtime = self._file_date(file_, today.tzinfo)
-            old = (today - mtime).total_seconds() // 3600
-            if old >= hours:
-                old = self._fmt(hours=old)
-                if list_:
-                    body.append((file_, old))
-                else:
-                    logger.info('Removing %s [%s].' % (file_, old))
-                    os.unlink(file_)
+        def _select(entry, stat):
+            if stat.st_mtime > since:
+                return False
+            old = self._fmt(hours=(today.timestamp() - stat.st_mtime) // 3600)
+            if list_:
+                body.append((entry.path, old))
+            else:
+                logger.info('Removing %s [%s].' % (entry.path, old))
+            return True
+
+        sweep = Sweep(cache, _select, workers=workers, batch=self.batch,
+                      checkpoint=None if list_ else checkpoint,
+                      dry_run=list_ or self.dry_run)
+        stats = sweep.run()
 
         if list_:
-            self._print_table(title, header, body)
+            self._print_table(title, header, sorted(body))
+        else:
+            self._print_sweep_stats(stats)
+
+    def _issue_images(self, issue_cache, since=None):
+        """Return the images referenced by the issue cache.
+
+        If `since` is set, only the issues stored after this (UTC)
+        date are used.
+
+        """
+        images = set()
+        # Keep the database open during the iteration
+        with DB(issue_cache.cache):
+            for value, created in issue_cache.values():
+                if since and created < since:
+                    continue
+                for i in value:
+                    images.update(os.path.basename(j['path'])
+                                  for j in i['images'])
+        return images
+
+    def _mobi_files(self, mobi_cache, since=None):
+        """Return the MOBI files referenced by the MOBI cache."""
+        mobis = set()
+        with DB(mobi_cache.cache):
+            for value, created in mobi_cache.values():
+                if since and created < since:
+                    continue
+                mobis.update(os.path.basename(j) for _, j in value)
+        return mobis
+
+    def _clean_cache_gc(self, hours, issue_cache, mobi_cache, list_,
+                        workers=4):
+        """Remove the images and MOBI files not referenced by the caches."""
+        # Mark: one pass over the caches to build the live set.
+        # Sweep: find the files that are not in the live set.  The
+        # new files (younger than `hours`) are kept, as they can be
+        # downloaded but still not stored in the cache.
+        #
+        # The images already downloaded are reused by the pipeline,
+        # so an issue stored after the mark can reference an old
+        # candidate.  Before the removal the candidates are checked
+        # again against the entries stored after the mark, with the
+        # cache locked, so no new entry can be stored meanwhile.
+        today = timezone.now()
+        since = (today - timezone.timedelta(hours=hours)).timestamp()
+        # The caches store the creation date in UTC
+        mark = datetime.datetime.utcnow()
+        images = self._issue_images(issue_cache)
+        mobis = self._mobi_files(mobi_cache)
+        logger.info('Live set: %d images, %d MOBI files.' % (
+            len(images), len(mobis)))
+
+        if list_:
+            title = 'Files not referenced by the caches'
+            header = (('file', 92), ('age', 7))
+            body = []
+
+        def _selector(live, candidates):
+            def _select(entry, stat):
+                if entry.name in live or stat.st_mtime > since:
+                    return False
+                candidates.append((entry, stat))
+                return True
+            return _select
+
+        stats = collections.Counter()
+        for path, cache, live, referenced in (
+                (os.path.join(issue_cache.images_store, 'full'),
+                 issue_cache, images, self._issue_images),
+                (mobi_cache.data, mobi_cache, mobis, self._mobi_files)):
+            if not os.path.exists(path):
+                continue
+            candidates = []
+            sweep = Sweep(path, _selector(live, candidates),
+                          workers=workers, batch=self.batch, dry_run=True)
+            sweep_stats = sweep.run()
+            stats['scanned'] += sweep_stats['scanned']
+            stats['bytes_scanned'] += sweep_stats['bytes_scanned']
+
+            with DB(cache.cache):
+                recent = referenced(cache, since=mark)
+                for entry, stat in candidates:
+                    if entry.name in recent:
+                        continue
+                    old = today.timestamp() - stat.st_mtime
+                    old = self._fmt(hours=old // 3600)
+                    if list_:
+                        body.append((entry.path, old))
+                    else:
+                        logger.info('Removing %s [%s].' % (entry.path, old))
+                        if not self.dry_run:
+                            try:
+                                os.unlink(entry.path)
+                            except FileNotFoundError:
+                                continue
+                    stats['removed'] += 1
+                    stats['bytes_removed'] += stat.st_size
+
+        if list_:
+            self._print_table(title, header, sorted(body))
+        else:
+            self._print_sweep_stats(stats)
+
+    def _print_sweep_stats(self, stats):
+        """Print the number of files and bytes removed from a sweep."""
+        if self.dry_run:
+            title = 'Files to remove (dry run)'
+        else:
+            title = 'Files removed'
+        header = (('', 20), ('files', 15), ('bytes', 15))
+        body = (('scanned', stats['scanned'], stats['bytes_scanned']),
+                ('removed', stats['removed'], stats['bytes_removed']))
+        self._print_table(title, header, body)
 
     def _clean_cache(self, hours, cache, list_):
         """Remove old cached mobi or issues."""
@@ -270,15 +494,21 @@ class Command(BaseCommand):
             header = (('manga', 54), ('issue', 23), ('source', 15), ('age', 7))
             body = []
 
+        is_mobi = isinstance(cache, MobiCache)
         tzinfo = today.tzinfo
         to_delete = ((k, today - v[-1].replace(tzinfo=tzinfo))
                      for k, v in cache.items())
+        # The MOBI documents created before the device profiles are
+        # not used anymore, and are always removed
         to_delete = ((k, o) for k, o in to_delete
-                     if o.total_seconds() // 3600 >= hours)
+                     if o.total_seconds() // 3600 >= hours or
+                     (is_mobi and MobiCache.split_key(k)[1] is None))
 
         for key, old in to_delete:
+            url = MobiCache.split_key(key)[0] if is_mobi else key
             try:
-                issue = Issue.objects.get(url=key)
+                issue = Issue.objects.select_related(
+                    'manga__source').get(url=url)
                 manga = issue.manga
                 spider = manga.source.spider
             except Exception:
@@ -312,7 +542,8 @@ class Command(BaseCommand):
                      if self._missing_pages(v[0])]
         for key in to_delete:
             try:
-                issue = Issue.objects.get(url=key)
+                issue = Issue.objects.select_related(
+                    'manga__source').get(url=key)
                 manga = issue.manga
                 spider = manga.source.spider
             except Exception:
@@ -323,7 +554,7 @@ class Command(BaseCommand):
                 body.append((manga, issue, spider))
             else:
                 logger.info('Removing %s %s - %s.' % (manga, issue, spider))
-                del mobi_cache[key]
+                mobi_cache.remove(key)
                 del issue_cache[key]
 
         if list_:
@@ -363,29 +594,38 @@ class Command(BaseCommand):
         """Remove old results in a bad state."""
         today = timezone.now()
         since = today - timezone.timedelta(hours=hours)
-        results = Result.objects.filter(modified__lt=since, status=status)
+        results = Result.objects.filter(
+            modified__lt=since, status=status
+        ).select_related('issue__manga__source', 'subscription__user')
 
         if list_:
             title = 'Results to remove (age: %s)' % self._fmt(hours=hours)
             header = (('manga', 50), ('issue', 21), ('source', 13),
                       ('user', 8), ('age', 7))
             body = []
+        else:
+            stats = collections.Counter()
 
-        for result in results:
-            old = self._fmt(timedelta=(today - result.modified))
-            if list_:
-                body.append((result.issue.manga.name,
-                             result.issue.number,
-                             result.issue.manga.source.name,
-                             result.subscription.user,
-                             old))
-            else:
-                logger.info('Removing %s (%s) for user %s [%s].' % (
-                    result.issue,
-                    result.status,
-                    result.subscription.user,
-                    old))
-                result.delete()
+        for batch in self._batches(results):
+            for result in batch:
+                old = self._fmt(timedelta=(today - result.modified))
+                if list_:
+                    body.append((result.issue.manga.name,
+                                 result.issue.number,
+                                 result.issue.manga.source.name,
+                                 result.subscription.user,
+                                 old))
+                else:
+                    logger.info('Removing %s (%s) for user %s [%s].' % (
+                        result.issue,
+                        result.status,
+                        result.subscription.user,
+                        old))
+            if not list_:
+                self._delete(results.filter(pk__in=[r.pk for r in batch]),
+                             stats)
 
         if list_:
             self._print_table(title, header, body)
+        else:
+            self._print_stats(stats)
@@ -0,0 +1,62 @@
+import logging
+
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+from django.db import transaction
+
+from core.models import Manga
+from core.models import Source
+
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full text search index of the mangas.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '-s', '--spiders', action='store', dest='spiders', default='all',
+            help='List of spiders (<list_of_spiders|all>).')
+        parser.add_argument(
+            '-c', '--chunk', action='store', dest='chunk', default=1000,
+            help='Number of mangas updated in each transaction (<number>).')
+        # General parameters
+        parser.add_argument(
+            '--loglevel', action='store', dest='loglevel', default='WARNING',
+            help='Log level (<CRITICAL|ERROR|WARNING|INFO|DEBUG>).')
+
+    def _get_sources(self, spiders):
+        """Parse the `spiders` option and return a valid list of Sources."""
+        spiders = spiders.split(',')
+        if 'all' in spiders:
+            sources = Source.objects.all()
+        else:
+            sources = Source.objects.filter(spider__in=spiders)
+        return sources
+
+    def handle(self, *args, **options):
+        try:
+            chunk = int(options['chunk'])
+        except ValueError:
+            raise CommandError('Chunk parameter is not a number.')
+        if chunk <= 0:
+            raise CommandError('Chunk parameter must be positive.')
+
+        loglevel = options['loglevel']
+        logger.setLevel(loglevel)
+
+        sources = self._get_sources(options['spiders'])
+        manga_ids = Manga.objects.filter(
+            source__in=sources).order_by('id').values_list('id', flat=True)
+        manga_ids = list(manga_ids)
+
+        # Small transactions keep the rows of the index locked only
+        # for a short time
+        for i in range(0, len(manga_ids), chunk):
+            with transaction.atomic():
+                Manga.objects.refresh(manga_ids[i:i+chunk])
+            logger.info('Reindexed %d of %d mangas' % (
+                min(i+chunk, len(manga_ids)), len(manga_ids)))
+
+        self.stdout.write('Reindexed %d mangas.' % len(manga_ids))
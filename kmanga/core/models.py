@@ -1,14 +1,19 @@
+import hashlib
 import os.path
 
 from django.conf import settings
+from django.core.cache import cache
 from django.db import connection
 from django.db import models
+from django.db import transaction
 from django.db.models import Count
 from django.db.models import F
 from django.db.models import Q
 from django.urls import reverse
 from django.utils import timezone
 
+from .cache import SearchCache
+
 
 class TimeStampedModel(models.Model):
     created = models.DateTimeField(auto_now_add=True)
@@ -24,6 +29,10 @@ class Source(TimeStampedModel):
     url = models.URLField(unique=True)
     has_footer = models.BooleanField(default=False)
     enabled = models.BooleanField(default=True)
+    # High-water mark of the latest update, maintained by
+    # `UpdateDBPipeline`
+    latest_url = models.URLField(blank=True)
+    latest_release = models.DateField(null=True, blank=True)
 
     def __str__(self):
         return self.name
@@ -72,8 +81,21 @@ class Genre(TimeStampedModel):
 
 
 class AdvRawQuerySet(models.query.RawQuerySet):
-    """RawQuerySet subclass with advanced options."""
+    """RawQuerySet subclass with advanced options.
+
+    Besides the LIMIT / OFFSET pagination based on `paged_query`, it
+    can provide keyset (seek) pagination if `seek_query` is present.
+    This is a callable that receives the key of the last object of
+    the previous page and the size of the page, and returns the SQL
+    query and the parameters for the next page.  The key is the
+    value of the `seek_fields` attributes of the object.
+
+    If `count_timeout` is set, the result of `count_query` is stored
+    in the cache for this number of seconds.
+
+    """
     def __init__(self, raw_query, paged_query, count_query,
+                 seek_query=None, seek_fields=None, count_timeout=None,
                  model=None, query=None, params=None,
                  translations=None, using=None, hints=None):
         super(AdvRawQuerySet, self).__init__(raw_query, model=model,
@@ -84,6 +106,10 @@ class AdvRawQuerySet(models.query.RawQuerySet):
         self.raw_query = raw_query
         self.paged_query = paged_query
         self.count_query = count_query
+        self.seek_query = seek_query
+        self.seek_fields = seek_fields
+        self.count_timeout = count_timeout
+        self._count = None
 
     def __getitem__(self, key):
         if isinstance(key, slice):
@@ -102,67 +128,201 @@ class AdvRawQuerySet(models.query.RawQuerySet):
                                         hints=self._hints)
 
     def __len__(self):
-        cursor = connection.cursor()
-        cursor.execute(self.count_query, self.params)
-        return cursor.fetchone()[0]
+        if self._count is None:
+            if self.count_timeout:
+                key = '%s %s' % (self.count_query, self.params)
+                key = 'count-%s' % hashlib.md5(key.encode()).hexdigest()
+                self._count = cache.get(key)
+            if self._count is None:
+                cursor = connection.cursor()
+                cursor.execute(self.count_query, self.params)
+                self._count = cursor.fetchone()[0]
+                if self.count_timeout:
+                    cache.set(key, self._count, self.count_timeout)
+        return self._count
+
+    def seek(self, key, size):
+        """Return the `size` objects that follow the one with `key`.
+
+        If `key` is None, return the first page.
+
+        """
+        if not key:
+            return list(self[0:size])
+        query, params = self.seek_query(key, size)
+        return list(models.query.RawQuerySet(query,
+                                             model=self.model,
+                                             params=params,
+                                             translations=self.translations,
+                                             using=self._db,
+                                             hints=self._hints))
+
+    def seek_key(self, obj):
+        """Return the key of `obj` used in `seek()`."""
+        return [getattr(obj, field) for field in self.seek_fields]
+
+
+class CachedRawQuerySet(AdvRawQuerySet):
+    """AdvRawQuerySet that read the objects from a SearchCache.
+
+    The cache stores, for each result, the PK of the object and the
+    values of `seek_fields`.  Slices that fit inside a window of the
+    cache, and seeks from a key that is in the cache, do not need to
+    run the ranked query.
+
+    """
+    def __init__(self, *args, **kwargs):
+        self.search_cache = kwargs.pop('search_cache')
+        self.cache_key = kwargs.pop('cache_key')
+        super(CachedRawQuerySet, self).__init__(*args, **kwargs)
+
+    def _populate(self, offset, limit):
+        objects = super(CachedRawQuerySet, self).__getitem__(
+            slice(offset, offset + limit))
+        entries = [[obj.pk] + self.seek_key(obj) for obj in objects]
+        return super(CachedRawQuerySet, self).__len__(), entries
+
+    def _window(self, window):
+        return self.search_cache.get(self.cache_key, window, self._populate)
+
+    def _objects(self, entries):
+        objects = self.model.objects.in_bulk([e[0] for e in entries])
+        result = []
+        for pk, *key in entries:
+            # The object can be removed after the cache was populated
+            if pk in objects:
+                obj = objects[pk]
+                for field, value in zip(self.seek_fields, key):
+                    setattr(obj, field, value)
+                result.append(obj)
+        return result
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop = key.start, key.stop
+        else:
+            start, stop = key, key + 1
+        size = self.search_cache.window
+        window = start // size
+        if stop <= (window + 1) * size:
+            cached = self._window(window)
+            if cached:
+                _, entries = cached
+                start, stop = start - window * size, stop - window * size
+                return self._objects(entries[start:stop])
+        return super(CachedRawQuerySet, self).__getitem__(key)
+
+    def __len__(self):
+        if self._count is None:
+            cached = self._window(0)
+            if cached:
+                self._count, _ = cached
+        return super(CachedRawQuerySet, self).__len__()
+
+    def seek(self, key, size):
+        if key:
+            key = list(key)
+            for window in range(settings.SEARCH_CACHE_WINDOWS):
+                cached = self._window(window)
+                if not cached:
+                    break
+                count, entries = cached
+                keys = [e[1:] for e in entries]
+                if key in keys:
+                    index = keys.index(key) + 1
+                    entries = entries[index:index + size]
+                    last = (window + 1) * self.search_cache.window >= count
+                    if len(entries) == size or last:
+                        return self._objects(entries)
+                    break
+                if (window + 1) * self.search_cache.window >= count:
+                    break
+        return super(CachedRawQuerySet, self).seek(key, size)
 
 
 class MangaQuerySet(models.QuerySet):
     def latests(self):
         """Return the lastest mangas with new/updated issues."""
-        # The correct annotation expression is the next one, but due
-        # to an error in Django ORM, this empression uses a full GROUP
-        # BY with the data fields.  This produce a slow query.
-        #
-        # return self.annotate(
-        #     models.Max('issue__modified')
-        # ).order_by('-issue__modified__max')
-        #
-        # Alternative (without deferreds)
-        #
-        # extra_query = '''
-        # SELECT MAX(core_issue.modified)
-        #   FROM core_issue
-        #  WHERE core_issue.manga_id = core_manga.id
-        # '''
-        # Manga.objects.extra({
-        #     'issue__modified__max': extra_query
-        # }).order_by('-issue__modified__max')
-
+        # The natural query is an aggregation of MAX(issue.modified)
+        # for each manga, but this needs a full scan of the issues
+        # table.  Instead we use the denormalized field
+        # `last_issue_modified`, that is maintained by `Issue.save()`
+        # and have an index with the same order than this query (see
+        # bin/0003_latest_activity.py)
         raw_query = '''
-         SELECT core_manga.id,
-                MAX(core_issue.modified) AS issue__modified__max
-           FROM core_manga
-LEFT OUTER JOIN core_issue
-             ON (core_manga.id = core_issue.manga_id)
-       GROUP BY core_manga.id
-       ORDER BY issue__modified__max DESC NULLS LAST,
-                core_manga.name ASC,
-                core_manga.url ASC;
+  SELECT core_manga.*
+    FROM core_manga
+ORDER BY core_manga.last_issue_modified DESC NULLS LAST,
+         core_manga.name ASC,
+         core_manga.url ASC;
 '''
         paged_query = '''
-         SELECT core_manga.id,
-                MAX(core_issue.modified) AS issue__modified__max
-           FROM core_manga
-LEFT OUTER JOIN core_issue
-             ON (core_manga.id = core_issue.manga_id)
-       GROUP BY core_manga.id
-       ORDER BY issue__modified__max DESC NULLS LAST,
-                core_manga.name ASC,
-                core_manga.url ASC
-          LIMIT %s
-         OFFSET %s;
+  SELECT core_manga.*
+    FROM core_manga
+ORDER BY core_manga.last_issue_modified DESC NULLS LAST,
+         core_manga.name ASC,
+         core_manga.url ASC
+   LIMIT %s
+  OFFSET %s;
 '''
         count_query = '''
-         SELECT COUNT(*)
-           FROM core_manga;
+  SELECT COUNT(*)
+    FROM core_manga;
 '''
         return AdvRawQuerySet(raw_query=raw_query,
                               paged_query=paged_query,
                               count_query=count_query,
+                              seek_query=self._latests_seek,
+                              seek_fields=('last_issue_modified',
+                                           'name', 'url'),
                               model=self.model,
                               using=self.db)
 
+    def _latests_seek(self, key, size):
+        """Keyset query for the page of `latests()` after `key`."""
+        modified, name, url = key
+        if modified is None:
+            seek_query = '''
+  SELECT core_manga.*
+    FROM core_manga
+   WHERE core_manga.last_issue_modified IS NULL
+     AND (core_manga.name, core_manga.url) > (%s, %s)
+ORDER BY core_manga.name ASC,
+         core_manga.url ASC
+   LIMIT %s;
+'''
+            return seek_query, [name, url, size]
+
+        # The mangas without issues are at the end, and they are not
+        # reachable from a range condition over `last_issue_modified`
+        seek_query = '''
+  SELECT *
+    FROM (
+      (  SELECT core_manga.*, 0 AS seek_part
+           FROM core_manga
+          WHERE core_manga.last_issue_modified <= %s
+            AND (core_manga.last_issue_modified < %s
+                 OR (core_manga.name, core_manga.url) > (%s, %s))
+       ORDER BY core_manga.last_issue_modified DESC NULLS LAST,
+                core_manga.name ASC,
+                core_manga.url ASC
+          LIMIT %s)
+      UNION ALL
+      (  SELECT core_manga.*, 1 AS seek_part
+           FROM core_manga
+          WHERE core_manga.last_issue_modified IS NULL
+       ORDER BY core_manga.name ASC,
+                core_manga.url ASC
+          LIMIT %s)
+    ) AS page
+ORDER BY seek_part ASC,
+         last_issue_modified DESC NULLS LAST,
+         name ASC,
+         url ASC
+   LIMIT %s;
+'''
+        return seek_query, [modified, modified, name, url, size, size, size]
+
     def _to_tsquery(self, q):
         """Convert a query to a PostgreSQL tsquery."""
         # Remove special chars (except parens)
@@ -220,10 +380,11 @@ LEFT OUTER JOIN core_issue
     def search(self, q):
         q = self._to_tsquery(q)
         raw_query = '''
-    SELECT core_manga.*
+    SELECT core_manga.*, ids.search_rank
       FROM (
-          SELECT id
-            FROM core_manga_fts_view,
+          SELECT id,
+                 ts_rank(document, q) AS search_rank
+            FROM core_manga_fts,
                  to_tsquery(%s) AS q
            WHERE document @@ q
         ORDER BY ts_rank(document, q) DESC,
@@ -233,10 +394,11 @@ LEFT OUTER JOIN core_issue
 INNER JOIN core_manga ON core_manga.id = ids.id;
 '''
         paged_query = '''
-    SELECT core_manga.*
+    SELECT core_manga.*, ids.search_rank
       FROM (
-        SELECT id
-          FROM core_manga_fts_view,
+        SELECT id,
+               ts_rank(document, q) AS search_rank
+          FROM core_manga_fts,
                to_tsquery(%s) AS q
          WHERE document @@ q
       ORDER BY ts_rank(document, q) DESC,
@@ -245,23 +407,106 @@ INNER JOIN core_manga ON core_manga.id = ids.id;
          LIMIT %s
         OFFSET %s
       ) AS ids
-INNER JOIN core_manga ON core_manga.id = ids.id;
+INNER JOIN core_manga ON core_manga.id = ids.id
+  ORDER BY ids.search_rank DESC,
+           core_manga.name ASC,
+           core_manga.url ASC;
 '''
         count_query = '''
 SELECT COUNT(*)
-  FROM core_manga_fts_view
+  FROM core_manga_fts
  WHERE document @@ to_tsquery(%s);
 '''
-        return AdvRawQuerySet(raw_query=raw_query,
-                              paged_query=paged_query,
-                              count_query=count_query,
-                              model=self.model,
-                              params=[q],
-                              using=self.db)
 
-    def refresh(self):
+        def seek_query(key, size):
+            # `ts_rank` is a `real`, so the rank from the key needs to
+            # be compared with the same precision
+            rank, name, url = key
+            seek_query = '''
+    SELECT core_manga.*, ids.search_rank
+      FROM (
+        SELECT id,
+               ts_rank(document, q) AS search_rank
+          FROM core_manga_fts,
+               to_tsquery(%s) AS q
+         WHERE document @@ q
+           AND (ts_rank(document, q) < %s::real
+                OR (ts_rank(document, q) = %s::real
+                    AND (name, url) > (%s, %s)))
+      ORDER BY ts_rank(document, q) DESC,
+               name ASC,
+               url ASC
+         LIMIT %s
+      ) AS ids
+INNER JOIN core_manga ON core_manga.id = ids.id
+  ORDER BY ids.search_rank DESC,
+           core_manga.name ASC,
+           core_manga.url ASC;
+'''
+            return seek_query, [q, rank, rank, name, url, size]
+
+        kwargs = {
+            'raw_query': raw_query,
+            'paged_query': paged_query,
+            'count_query': count_query,
+            'seek_query': seek_query,
+            'seek_fields': ('search_rank', 'name', 'url'),
+            'model': self.model,
+            'params': [q],
+            'using': self.db,
+        }
+        search_cache = SearchCache()
+        if search_cache.enabled:
+            return CachedRawQuerySet(search_cache=search_cache,
+                                     cache_key=q, **kwargs)
+        return AdvRawQuerySet(**kwargs)
+
+    def refresh(self, manga_ids=None):
+        """Update the full text search document of the mangas.
+
+        If `manga_ids` is None, the documents of all the mangas are
+        rebuilt.  The rows are updated in place, so the searches are
+        not blocked during the update.
+
+        """
+        refresh_query = '''
+         INSERT INTO core_manga_fts (id, name, url, document)
+              SELECT core_manga.id,
+                     core_manga.name,
+                     core_manga.url,
+                     setweight(to_tsvector(core_manga.name), 'A') ||
+                     to_tsvector(core_source.name) ||
+                     to_tsvector(core_source.spider) ||
+                     to_tsvector(core_manga.description) ||
+                     to_tsvector(
+                       coalesce(string_agg(core_altname.name, ' '), '')
+                     ) AS document
+                FROM core_manga
+           LEFT JOIN core_altname ON core_manga.id = core_altname.manga_id
+          INNER JOIN core_source ON core_manga.source_id = core_source.id
+               WHERE %s IS NULL OR core_manga.id = ANY(%s)
+            GROUP BY core_manga.id,
+                     core_source.id
+ON CONFLICT (id) DO UPDATE
+                 SET name = EXCLUDED.name,
+                     url = EXCLUDED.url,
+                     document = EXCLUDED.document
+               WHERE core_manga_fts.document != EXCLUDED.document
+                  OR core_manga_fts.name != EXCLUDED.name
+                  OR core_manga_fts.url != EXCLUDED.url;
+'''
+        if manga_ids is not None:
+            manga_ids = list(manga_ids)
+            if not manga_ids:
+                return
         cursor = connection.cursor()
-        cursor.execute('REFRESH MATERIALIZED VIEW core_manga_fts_view;')
+        cursor.execute(refresh_query, [manga_ids, manga_ids])
+        if cursor.rowcount:
+            search_cache = SearchCache()
+            if search_cache.enabled:
+                # A search before the commit reads the old index, and
+                # the result can not be cached in the new version
+                transaction.on_commit(search_cache.bump)
 
 
 def _cover_path(instance, filename):
@@ -310,6 +555,10 @@ class Manga(TimeStampedModel):
     cover = models.ImageField(upload_to=_cover_path)
     url = models.URLField(unique=True, db_index=True)
     source = models.ForeignKey(Source, on_delete=models.CASCADE)
+    # Denormalized MAX(issue.modified), maintained by `Issue.save()`
+    last_issue_modified = models.DateTimeField(null=True, blank=True)
+    # Hash of the last scraped item, maintained by `UpdateDBPipeline`
+    fingerprint = models.CharField(max_length=40, blank=True)
 
     objects = MangaQuerySet.as_manager()
 
@@ -370,6 +619,12 @@ class Issue(TimeStampedModel):
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        """Save the issue and update the latest activity of the manga."""
+        super(Issue, self).save(*args, **kwargs)
+        Manga.objects.filter(pk=self.manga_id).update(
+            last_issue_modified=self.modified)
+
     def is_sent(self, user):
         """Check if an user has received this issue."""
         return self.result(user, status=Result.SENT).exists()
@@ -407,46 +662,158 @@ class Issue(TimeStampedModel):
 class SubscriptionQuerySet(models.QuerySet):
     def latests(self, user):
         """Return the latests subscriptions with changes in Result."""
-        # See the notes from `MangaQuerySet.latests()`
+        # See the notes from `MangaQuerySet.latests()`, here the
+        # denormalized field is `last_result_modified`, maintained by
+        # `Result.save()`
         raw_query = '''
-         SELECT core_subscription.id,
-                MAX(core_result.modified) AS result__modified__max
-           FROM core_subscription
-LEFT OUTER JOIN core_result
-             ON (core_subscription.id = core_result.subscription_id)
-          WHERE core_subscription.deleted = false
-            AND core_subscription.user_id = %s
-       GROUP BY core_subscription.id
-       ORDER BY result__modified__max DESC NULLS LAST,
-                core_subscription.id ASC;
+  SELECT core_subscription.*
+    FROM core_subscription
+   WHERE core_subscription.deleted = false
+     AND core_subscription.user_id = %s
+ORDER BY core_subscription.last_result_modified DESC NULLS LAST,
+         core_subscription.id ASC;
 '''
         paged_query = '''
-         SELECT core_subscription.id,
-                MAX(core_result.modified) AS result__modified__max
+  SELECT core_subscription.*
+    FROM core_subscription
+   WHERE core_subscription.deleted = false
+     AND core_subscription.user_id = %s
+ORDER BY core_subscription.last_result_modified DESC NULLS LAST,
+         core_subscription.id ASC
+   LIMIT %s
+  OFFSET %s;
+'''
+        count_query = '''
+  SELECT COUNT(*)
+    FROM core_subscription
+   WHERE core_subscription.deleted = false
+     AND core_subscription.user_id = %s;
+'''
+
+        def seek_query(key, size):
+            modified, id_ = key
+            if modified is None:
+                seek_query = '''
+  SELECT core_subscription.*
+    FROM core_subscription
+   WHERE core_subscription.deleted = false
+     AND core_subscription.user_id = %s
+     AND core_subscription.last_result_modified IS NULL
+     AND core_subscription.id > %s
+ORDER BY core_subscription.id ASC
+   LIMIT %s;
+'''
+                return seek_query, [user.id, id_, size]
+
+            # See the notes from `MangaQuerySet._latests_seek()`
+            seek_query = '''
+  SELECT *
+    FROM (
+      (  SELECT core_subscription.*, 0 AS seek_part
            FROM core_subscription
-LEFT OUTER JOIN core_result
-            ON (core_subscription.id = core_result.subscription_id)
           WHERE core_subscription.deleted = false
             AND core_subscription.user_id = %s
-       GROUP BY core_subscription.id
-       ORDER BY result__modified__max DESC NULLS LAST,
+            AND core_subscription.last_result_modified <= %s
+            AND (core_subscription.last_result_modified < %s
+                 OR core_subscription.id > %s)
+       ORDER BY core_subscription.last_result_modified DESC NULLS LAST,
                 core_subscription.id ASC
-          LIMIT %s
-         OFFSET %s;
-'''
-        count_query = '''
-         SELECT COUNT(*)
+          LIMIT %s)
+      UNION ALL
+      (  SELECT core_subscription.*, 1 AS seek_part
            FROM core_subscription
           WHERE core_subscription.deleted = false
-            AND core_subscription.user_id = %s;
+            AND core_subscription.user_id = %s
+            AND core_subscription.last_result_modified IS NULL
+       ORDER BY core_subscription.id ASC
+          LIMIT %s)
+    ) AS page
+ORDER BY seek_part ASC,
+         last_result_modified DESC NULLS LAST,
+         id ASC
+   LIMIT %s;
 '''
+            return seek_query, [user.id, modified, modified, id_, size,
+                                user.id, size, size]
+
         return AdvRawQuerySet(raw_query=raw_query,
                               paged_query=paged_query,
                               count_query=count_query,
+                              seek_query=seek_query,
+                              seek_fields=('last_result_modified', 'id'),
                               model=self.model,
                               params=[user.id],
                               using=self.db)
 
+    def issues_to_send(self, retry=None):
+        """Return the issues to send for each subscription.
+
+        This is the set-based version of `Subscription.issues_to_send`.
+        Return a dictionary with the list of issues to send, ordered
+        by number, for each subscription PK.
+
+        """
+        if not retry:
+            retry = Subscription.RETRY
+
+        # The issues of every subscription are numbered in a window,
+        # and only the first `remains` are returned
+        subscriptions, subscriptions_params = self.order_by().values(
+            'id').query.sql_with_params()
+        raw_query = '''
+WITH subscriptions AS (
+         SELECT core_subscription.id,
+                core_subscription.manga_id,
+                core_subscription.language,
+                GREATEST(core_subscription.issues_per_day -
+                         COALESCE(quota.already_sent, 0), 0) AS remains
+           FROM core_subscription
+LEFT OUTER JOIN (  SELECT core_quotaentry.subscription_id,
+                          COUNT(*) AS already_sent
+                     FROM core_quotaentry
+                    WHERE core_quotaentry.send_date BETWEEN %%s AND %%s
+                 GROUP BY core_quotaentry.subscription_id) AS quota
+             ON core_subscription.id = quota.subscription_id
+          WHERE core_subscription.id IN (%s)
+)
+  SELECT *
+    FROM (
+      SELECT core_issue.*,
+             subscriptions.id AS subscription_id,
+             subscriptions.remains,
+             ROW_NUMBER() OVER (
+               PARTITION BY subscriptions.id
+                   ORDER BY core_issue.order ASC,
+                            core_issue.id ASC
+             ) AS position
+        FROM subscriptions
+  INNER JOIN core_issue
+          ON core_issue.manga_id = subscriptions.manga_id
+         AND core_issue.language = subscriptions.language
+       WHERE subscriptions.remains > 0
+         AND NOT EXISTS (
+           SELECT 1
+             FROM core_result
+            WHERE core_result.issue_id = core_issue.id
+              AND core_result.subscription_id = subscriptions.id
+              AND (core_result.status IN (%%s, %%s)
+                   OR (core_result.status = %%s
+                       AND core_result.retry > %%s))
+         )
+    ) AS issues
+   WHERE position <= remains
+ORDER BY subscription_id ASC,
+         position ASC;
+''' % subscriptions
+        params = Result.objects.all()._last_24hs()
+        params.extend(subscriptions_params)
+        params.extend([Result.PROCESSING, Result.SENT, Result.FAILED, retry])
+
+        issues = {}
+        for issue in Issue.objects.raw(raw_query, params):
+            issues.setdefault(issue.subscription_id, []).append(issue)
+        return issues
+
 
 class SubscriptionManager(models.Manager):
     def get_queryset(self):
@@ -474,6 +841,8 @@ class Subscription(TimeStampedModel):
     issues_per_day = models.IntegerField(default=4)
     paused = models.BooleanField(default=False)
     deleted = models.BooleanField(default=False)
+    # Denormalized MAX(result.modified), maintained by `Result.save()`
+    last_result_modified = models.DateTimeField(null=True, blank=True)
 
     objects = SubscriptionManager.from_queryset(SubscriptionQuerySet)()
     actives = SubscriptionActiveManager.from_queryset(SubscriptionQuerySet)()
@@ -540,6 +909,55 @@ class Subscription(TimeStampedModel):
             models.Max('result__modified')
         ).order_by('-result__modified')
 
+    def latest_issue_position(self, timeout=3600):
+        """Return the position of the last modified issue's result.
+
+        Return a tuple with the number of issues ordered before the
+        issue with the most updated result (or None if there is no
+        result), and the total number of issues.  The value is cached
+        until there is a new result or a new issue.
+
+        """
+        # Both dates are updated with every new result or issue, so
+        # there is no need to delete the old keys
+        key = '%s %s %s' % (self.pk, self.last_result_modified,
+                            self.manga.last_issue_modified)
+        key = 'position-%s' % hashlib.md5(key.encode()).hexdigest()
+        position = cache.get(key)
+        if position is not None:
+            return position
+
+        # The RANK() of an issue is the number of issues ordered
+        # before it plus one, like `bisect_left` in a sorted list.
+        # Uses the same fields than Issue.Meta.ordering.
+        raw_query = '''
+WITH issues AS (
+  SELECT core_issue.id,
+         RANK() OVER (
+           ORDER BY core_issue.order ASC, core_issue.name ASC
+         ) - 1 AS position,
+         COUNT(*) OVER () AS total
+    FROM core_issue
+   WHERE core_issue.manga_id = %s
+     AND core_issue.language = %s
+), latest AS (
+    SELECT issues.position
+      FROM core_result
+INNER JOIN issues
+        ON issues.id = core_result.issue_id
+     WHERE core_result.subscription_id = %s
+  ORDER BY core_result.modified DESC
+     LIMIT 1
+)
+SELECT (SELECT position FROM latest),
+       COALESCE((SELECT total FROM issues LIMIT 1), 0);
+'''
+        cursor = connection.cursor()
+        cursor.execute(raw_query, [self.manga_id, self.language, self.pk])
+        position = cursor.fetchone()
+        cache.set(key, position, timeout)
+        return position
+
 
 class ResultQuerySet(models.QuerySet):
     TIME_DELTA = 2
@@ -550,25 +968,97 @@ class ResultQuerySet(models.QuerySet):
             query = query.filter(status=status)
         return query.order_by('-modified')
 
-    def _processed_last_24hs(self, user, subscription=None):
-        """Return the list of `Result` processed during the last 24 hours."""
+    def _last_24hs(self):
+        """Return the time range used to count the processed `Result`."""
         today = timezone.now()
         yesterday = today - timezone.timedelta(days=1)
         # XXX TODO - Objects are created / modified always after time
         # T.  If the send process is slow, the error margin can be
         # bigger than the one used here.
         yesterday += timezone.timedelta(hours=ResultQuerySet.TIME_DELTA)
-        query = self.filter(
-            subscription__user=user,
-            send_date__range=[yesterday, today],
-        )
-        if subscription:
-            query = query.filter(subscription=subscription)
-        return query
+        return [yesterday, today]
 
     def processed_last_24hs(self, user, subscription=None):
         """Return the number of `Result` processed during the last 24 hours."""
-        return self._processed_last_24hs(user, subscription).count()
+        # The count is done in the `QuotaEntry` ledger, that is
+        # indexed by user / subscription and `send_date`
+        query = QuotaEntry.objects.filter(user=user,
+                                          send_date__range=self._last_24hs())
+        if subscription:
+            query = query.filter(subscription=subscription)
+        return query.count()
+
+    @transaction.atomic
+    def transition(self, issues, user, status, set_send_date=True):
+        """Create or update the `Result` of a list of issues for an user.
+
+        This is the bulk version of `Issue.create_result_if_needed()`,
+        followed by `Result.set_status()`.  Issues from mangas where
+        the user is not subscribed are ignored.  Return the list of
+        `Result`.
+
+        """
+        issues = list(issues)
+        subscriptions = dict(Subscription.objects.filter(
+            user=user,
+            manga__in={issue.manga_id for issue in issues}
+        ).values_list('manga_id', 'id'))
+        # The same row can not be updated twice in one upsert
+        issues = {i.id: i for i in issues if i.manga_id in subscriptions}
+        issues = list(issues.values())
+        if not issues:
+            return []
+
+        now = timezone.now()
+        # See `Result.set_status()`, a FAILED result do not count as
+        # sent
+        if status == Result.FAILED:
+            send_date, update_send_date = None, 'NULL'
+        elif set_send_date:
+            send_date, update_send_date = now, 'EXCLUDED.send_date'
+        else:
+            send_date, update_send_date = None, 'core_result.send_date'
+
+        values = ', '.join(['(%s, %s, %s, %s, %s, 0, %s, 0)'] * len(issues))
+        raw_query = '''
+     INSERT INTO core_result (created, modified, issue_id, subscription_id,
+                              status, missing_pages, send_date, retry)
+          VALUES %s
+ON CONFLICT (issue_id, subscription_id) DO UPDATE
+             SET modified = EXCLUDED.modified,
+                 status = EXCLUDED.status,
+                 send_date = %s
+       RETURNING *;
+''' % (values, update_send_date)
+        params = []
+        for issue in issues:
+            params.extend((now, now, issue.id, subscriptions[issue.manga_id],
+                           status, send_date))
+        results = list(Result.objects.raw(raw_query, params))
+
+        # Update the data that `Result.save()` maintains
+        Subscription.all_objects.filter(
+            pk__in=set(subscriptions.values())
+        ).update(last_result_modified=now)
+        sent = [r.id for r in results if r.send_date]
+        if sent:
+            cursor = connection.cursor()
+            cursor.execute('''
+     INSERT INTO core_quotaentry (result_id, user_id, subscription_id,
+                                  send_date)
+          SELECT core_result.id, core_subscription.user_id,
+                 core_subscription.id, core_result.send_date
+            FROM core_result
+      INNER JOIN core_subscription
+              ON core_result.subscription_id = core_subscription.id
+           WHERE core_result.id = ANY(%s)
+ON CONFLICT (result_id) DO UPDATE
+             SET send_date = EXCLUDED.send_date;
+''', [sent])
+        QuotaEntry.objects.filter(
+            result__in=[r.id for r in results if not r.send_date]
+        ).delete()
+        return results
 
     def pending(self):
         return self.latests(status=Result.PENDING)
@@ -614,6 +1104,30 @@ class Result(TimeStampedModel):
     def get_absolute_url(self):
         return reverse('result-detail', kwargs={'pk': self.pk})
 
+    @transaction.atomic
+    def save(self, *args, **kwargs):
+        """Save the result and update the latest activity of the
+        subscription and the quota ledger.
+
+        """
+        adding = self._state.adding
+        super(Result, self).save(*args, **kwargs)
+        Subscription.all_objects.filter(pk=self.subscription_id).update(
+            last_result_modified=self.modified)
+        if self.send_date:
+            cursor = connection.cursor()
+            cursor.execute('''
+     INSERT INTO core_quotaentry (result_id, user_id, subscription_id,
+                                  send_date)
+          SELECT %s, core_subscription.user_id, core_subscription.id, %s
+            FROM core_subscription
+           WHERE core_subscription.id = %s
+ON CONFLICT (result_id) DO UPDATE
+             SET send_date = EXCLUDED.send_date;
+''', [self.pk, self.send_date, self.subscription_id])
+        elif not adding:
+            QuotaEntry.objects.filter(result=self).delete()
+
     def set_status(self, status):
         self.status = status
         # If the result is marked as FAILED, unset the `send_date`.
@@ -635,3 +1149,27 @@ class Result(TimeStampedModel):
 
     def is_failed(self):
         return self.status == Result.FAILED
+
+
+class QuotaEntry(models.Model):
+    """Ledger of the `Result` that count for the daily quota.
+
+    There is an entry for every `Result` with a `send_date`, updated
+    by `Result.save()`.
+
+    """
+    result = models.OneToOneField(Result, on_delete=models.CASCADE,
+                                  primary_key=True)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL,
+                             on_delete=models.CASCADE)
+    subscription = models.ForeignKey(Subscription, on_delete=models.CASCADE)
+    send_date = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'send_date']),
+            models.Index(fields=['subscription', 'send_date']),
+        ]
+
+    def __str__(self):
+        return '%s (%s)' % (self.result, self.send_date)
@@ -0,0 +1,177 @@
+import collections
+import concurrent.futures
+import json
+import logging
+import os
+
+
+logger = logging.getLogger(__name__)
+
+
+class Sweep(object):
+    """Parallel sweep of the files of a directory.
+
+    The directory is listed only once with `os.scandir`, and the
+    files are sent in batches of `batch` files to a thread pool of
+    `workers` threads.  The number of pending batches is bounded, so
+    the listing of a huge directory do not get ahead of the workers.
+
+    For every file `select(entry, stat)` is called, and if it returns
+    True the file is removed (unless `dry_run` is set).  The `stat`
+    result is the one cached in the `DirEntry`.
+
+    If `checkpoint` is a file name, the number of files at the
+    beginning of the listing that are already processed (and still
+    in the directory) is stored there every `CHECKPOINT_BATCHES`
+    batches, so an interrupted sweep can be resumed later skipping
+    those files.  This expects that the order of the listing do not
+    change, that is true for the files that are not removed.  A file
+    added meanwhile can be skipped, and will be checked in the next
+    sweep.  The files of the batches completed after the processed
+    prefix are checked again, so they can be counted twice in the
+    `scanned` stats.
+
+    """
+    CHECKPOINT_BATCHES = 10
+
+    def __init__(self, path, select, workers=4, batch=1000,
+                 checkpoint=None, dry_run=False):
+        self.path = path
+        self.select = select
+        self.workers = workers
+        self.batch = batch
+        self.checkpoint = checkpoint
+        self.dry_run = dry_run
+        self.stats = collections.Counter()
+        # Batches completed out of order, and the state of the
+        # completed prefix of the listing
+        self._completed = {}
+        self._next = 0
+        self._skip = 0
+        self._saved = 0
+
+    def _load_checkpoint(self):
+        """Load the number of files to skip and the stats."""
+        if not self.checkpoint or not os.path.exists(self.checkpoint):
+            return
+        with open(self.checkpoint) as f:
+            checkpoint = json.load(f)
+        if checkpoint['path'] != self.path:
+            logger.warning('Ignoring checkpoint for %s' % checkpoint['path'])
+            return
+        self._skip = checkpoint['skip']
+        self.stats.update(checkpoint['stats'])
+
+    def _save_checkpoint(self):
+        """Store the processed prefix of the listing and the stats."""
+        if not self.checkpoint:
+            return
+        tmp = '%s.tmp' % self.checkpoint
+        with open(tmp, 'w') as f:
+            json.dump({
+                'path': self.path,
+                'skip': self._skip,
+                'stats': dict(self.stats),
+            }, f)
+        os.replace(tmp, self.checkpoint)
+        self._saved = self._next
+
+    def _sweep_batch(self, entries):
+        """Check and remove a batch of files.
+
+        Return the stats and the number of files that are still in
+        the directory.
+
+        """
+        stats = collections.Counter()
+        kept = 0
+        for entry in entries:
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            stats['scanned'] += 1
+            stats['bytes_scanned'] += stat.st_size
+            if not self.select(entry, stat):
+                kept += 1
+                continue
+            if not self.dry_run:
+                try:
+                    os.unlink(entry.path)
+                except FileNotFoundError:
+                    continue
+            else:
+                kept += 1
+            stats['removed'] += 1
+            stats['bytes_removed'] += stat.st_size
+        return stats, kept
+
+    def _batches(self, skip):
+        """List the directory and yield the files in batches."""
+        batch = []
+        with os.scandir(self.path) as it:
+            for entry in it:
+                if not entry.is_file(follow_symlinks=False):
+                    continue
+                if skip:
+                    skip -= 1
+                    continue
+                batch.append(entry)
+                if len(batch) >= self.batch:
+                    yield batch
+                    batch = []
+        if batch:
+            yield batch
+
+    def _collect(self, futures, return_when):
+        """Wait for some pending batches and update the stats."""
+        done, _ = concurrent.futures.wait(futures, return_when=return_when)
+        error = None
+        for future in done:
+            index = futures.pop(future)
+            try:
+                self._completed[index] = future.result()
+            except BaseException as e:
+                error = e
+                continue
+            self.stats.update(self._completed[index][0])
+
+        # Advance the prefix of the listing that is fully processed
+        while self._next in self._completed:
+            _, kept = self._completed.pop(self._next)
+            self._skip += kept
+            self._next += 1
+        if self._next - self._saved >= self.CHECKPOINT_BATCHES:
+            self._save_checkpoint()
+
+        if done:
+            self._progress()
+        if error:
+            raise error
+
+    def _progress(self):
+        logger.info('%d files scanned, %d removed (%d bytes).' % (
+            self.stats['scanned'], self.stats['removed'],
+            self.stats['bytes_removed']))
+
+    def run(self):
+        """Sweep the directory and return the stats."""
+        self._load_checkpoint()
+        futures = {}
+        try:
+            with concurrent.futures.ThreadPoolExecutor(self.workers) as pool:
+                for index, batch in enumerate(self._batches(self._skip)):
+                    if len(futures) >= 2 * self.workers:
+                        self._collect(futures,
+                                      concurrent.futures.FIRST_COMPLETED)
+                    futures[pool.submit(self._sweep_batch, batch)] = index
+                self._collect(futures, concurrent.futures.ALL_COMPLETED)
+        except BaseException:
+            # Keep the progress of an interrupted sweep
+            self._save_checkpoint()
+            raise
+
+        # The sweep is complete, the next one starts from scratch
+        if self.checkpoint and os.path.exists(self.checkpoint):
+            os.unlink(self.checkpoint)
+        return self.stats
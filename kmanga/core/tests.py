@@ -1,5 +1,22 @@
+from io import StringIO
+import json
+import os
+import shutil
+import tempfile
+import time
+from unittest.mock import patch
+
+from django.core import signing
+from django.core.management import call_command
+from django.db import connection
+from django.http import Http404
+from django.test import RequestFactory
 from django.test import TestCase
+from django.test import override_settings
+from django.utils import timezone
+from redis.exceptions import RedisError
 
+from core.cache import SearchCache
 from core.models import AltName
 from core.models import Genre
 from core.models import Issue
@@ -8,6 +25,10 @@ from core.models import Result
 from core.models import Source
 from core.models import SourceLanguage
 from core.models import Subscription
+from core.sweep import Sweep
+from core.views import MangaListView
+from mobi.cache import IssueCache
+from mobi.cache import MobiCache
 from registration.models import UserProfile
 
 
@@ -36,6 +57,7 @@ class GenreTestCase(TestCase):
         self.assertEqual(str(Genre.objects.get(pk=1)), 'source1_genre1')
 
 
+@override_settings(SEARCH_CACHE_TIMEOUT=None)
 class MangaTestCase(TestCase):
     fixtures = ['registration.json', 'core.json']
 
@@ -81,6 +103,40 @@ class MangaTestCase(TestCase):
         Manga.objects.refresh()
         self.assertQuerysetEqual(Manga.objects.search('keyword'), [])
 
+    def test_full_text_search_refresh(self):
+        """Test the incremental update of the FTS index."""
+        Manga.objects.refresh()
+
+        m1 = Manga.objects.get(name='Manga 1')
+        m1.name = 'keyword'
+        m1.save()
+        m2 = Manga.objects.get(name='Manga 2')
+        m2.altname_set.create(name='keyword')
+
+        # Only the documents of the selected mangas are updated
+        Manga.objects.refresh([m2.pk])
+        q = Manga.objects.search('keyword')
+        self.assertQuerysetEqual(q, ['<Manga: Manga 2>'])
+
+        Manga.objects.refresh([])
+        Manga.objects.refresh([m1.pk, m2.pk])
+        q = Manga.objects.search('keyword')
+        self.assertQuerysetEqual(q, ['<Manga: keyword>', '<Manga: Manga 2>'],
+                                 ordered=False)
+
+        # Deleted mangas are removed from the index
+        m1.delete()
+        q = Manga.objects.search('keyword')
+        self.assertQuerysetEqual(q, ['<Manga: Manga 2>'])
+
+    def test_search_reindex(self):
+        """Test the command to rebuild the FTS index."""
+        self.assertEqual(len(Manga.objects.search('Description')), 0)
+        call_command('search-reindex', spiders='source1', stdout=StringIO())
+        self.assertEqual(len(Manga.objects.search('Description')), 2)
+        call_command('search-reindex', stdout=StringIO())
+        self.assertEqual(len(Manga.objects.search('Description')), 4)
+
     def test_full_text_search_rank(self):
         """Test FTS ranking."""
         # Initially the materialized view empty
@@ -115,6 +171,22 @@ class MangaTestCase(TestCase):
         self.assertEqual(ms1.index(ms3[0]), 1)
         self.assertEqual(ms1.index(ms3[1]), 2)
 
+    def test_full_text_search_seek(self):
+        """Test keyset pagination of FTS operations."""
+        Manga.objects.refresh()
+
+        ms = Manga.objects.search('Description')
+        expected = [m.name for m in ms[0:4]]
+        for size in (1, 3, 4):
+            key, names = None, []
+            while True:
+                page = ms.seek(key, size)
+                if not page:
+                    break
+                names.extend(m.name for m in page)
+                key = ms.seek_key(page[-1])
+            self.assertEqual(names, expected)
+
     def test_latests(self):
         """Test the recovery of updated mangas."""
         # Random order where we expect the mangas
@@ -140,6 +212,73 @@ class MangaTestCase(TestCase):
         self.assertEqual(ml2, names[1:2])
         self.assertEqual(ml3, names[1:3])
 
+    def test_latests_seek(self):
+        """Test keyset pagination of updated mangas."""
+        # Only two mangas have updated issues, the rest are at the end
+        for name in ('Manga 3', 'Manga 2'):
+            issue = Issue.objects.get(name='%s issue 1' % name.lower())
+            issue.save()
+
+        ml = Manga.objects.latests()
+        expected = ['Manga 2', 'Manga 3', 'Manga 1', 'Manga 4']
+        self.assertEqual([m.name for m in ml], expected)
+        for size in (1, 2, 3, 4):
+            key, names = None, []
+            while True:
+                page = ml.seek(key, size)
+                if not page:
+                    break
+                self.assertTrue(len(page) <= size)
+                names.extend(m.name for m in page)
+                key = ml.seek_key(page[-1])
+            self.assertEqual(names, expected)
+
+    def test_seek_cursor(self):
+        """Test that the pagination cursor is bound to the queryset."""
+        factory = RequestFactory()
+
+        def paginate(params):
+            view = MangaListView()
+            view.request = factory.get('/manga/', params)
+            view.kwargs = {}
+            _, _, objects, _ = view.paginate_queryset(view.get_queryset(), 1)
+            return view.next_cursor, objects
+
+        cursor, first = paginate({})
+        _, second = paginate({'cursor': cursor})
+        self.assertEqual(len(second), 1)
+        self.assertNotEqual(second, first)
+
+        # A cursor from the latest mangas can not be used in a search
+        with self.assertRaises(Http404):
+            paginate({'cursor': cursor, 'q': 'Description'})
+
+        # Well signed cursors with a bad key
+        _, key, binding = signing.loads(cursor, salt='core.views')
+        for payload in ([2, key[:2], binding],
+                        [2, ['date', 'Manga 1', 'url'], binding],
+                        [2, [{}, 'Manga 1', 'url'], binding],
+                        ['2', key, binding],
+                        [2, key, [binding[0], ['q']]],
+                        [2, key]):
+            cursor = signing.dumps(payload, salt='core.views')
+            with self.assertRaises(Http404):
+                paginate({'cursor': cursor})
+
+    def test_last_issue_modified(self):
+        """Test the update of the latest issue activity."""
+        manga = Manga.objects.get(name='Manga 1')
+        issue = manga.issue_set.first()
+        issue.save()
+        manga.refresh_from_db()
+        self.assertEqual(manga.last_issue_modified, issue.modified)
+
+        issue = manga.issue_set.create(
+            name='manga 1 issue 7', number='7', order=7, language='EN',
+            release=timezone.now(), url='http://source1.com/manga1/issue7')
+        manga.refresh_from_db()
+        self.assertEqual(manga.last_issue_modified, issue.modified)
+
     def test_str(self):
         """Test manga representation."""
         self.assertEqual(str(Manga.objects.get(pk=1)), 'Manga 1')
@@ -174,6 +313,215 @@ class MangaTestCase(TestCase):
             Subscription.all_objects.filter(user=user).count(), 4)
 
 
+class SearchCacheTestCase(TestCase):
+    fixtures = ['registration.json', 'core.json']
+
+    def setUp(self):
+        self.search_cache = SearchCache()
+        try:
+            # Start with an empty cache
+            self.search_cache.bump()
+            self.search_cache.version()
+        except RedisError:
+            self.skipTest('Redis is not available')
+        Manga.objects.refresh()
+        self._commit()
+
+    def _commit(self):
+        """Run the callbacks registered for the commit."""
+        # The TestCase transaction is never commited
+        callbacks, connection.run_on_commit = connection.run_on_commit, []
+        for _, callback in callbacks:
+            callback()
+
+    def test_search(self):
+        """Test the search results from the cache."""
+        expected = [m.name for m in Manga.objects.search('Description')]
+
+        # The first access populates the window of the cache
+        ms = Manga.objects.search('Description')
+        self.assertEqual(len(ms), 4)
+        self.assertEqual([m.name for m in ms[0:4]], expected)
+
+        # Later only the mangas are read from the database
+        ms = Manga.objects.search('Description')
+        with self.assertNumQueries(0):
+            self.assertEqual(len(ms), 4)
+        with self.assertNumQueries(1):
+            self.assertEqual([m.name for m in ms[1:3]], expected[1:3])
+
+        key, names = None, []
+        with self.assertNumQueries(4):
+            for _ in range(4):
+                page = ms.seek(key, 1)
+                names.extend(m.name for m in page)
+                key = ms.seek_key(page[-1])
+        self.assertEqual(names, expected)
+        self.assertEqual(ms.seek(key, 1), [])
+
+    def test_refresh(self):
+        """Test the invalidation of the cache after a refresh."""
+        self.assertEqual(len(Manga.objects.search('keyword')), 0)
+        m = Manga.objects.get(name='Manga 1')
+        m.name = 'keyword'
+        m.save()
+        self.assertEqual(len(Manga.objects.search('keyword')), 0)
+        version = SearchCache().version()
+        Manga.objects.refresh([m.pk])
+        # The cache is invalidated after the commit
+        self.assertEqual(SearchCache().version(), version)
+        self._commit()
+        self.assertEqual(SearchCache().version(), version + 1)
+        q = Manga.objects.search('keyword')
+        self.assertEqual(len(q), 1)
+        self.assertEqual([m.name for m in q[0:1]], ['keyword'])
+
+
+class SweepTestCase(TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.old = time.time() - 3600
+        for i in range(40):
+            name = os.path.join(self.path, '%02x.jpg' % (i * 6))
+            with open(name, 'wb') as f:
+                f.write(b'x' * i)
+            if i % 2:
+                os.utime(name, (self.old, self.old))
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def _select(self, entry, stat):
+        return stat.st_mtime <= self.old
+
+    def test_sweep(self):
+        """Test the parallel sweep of a directory."""
+        sweep = Sweep(self.path, self._select, batch=3, dry_run=True)
+        stats = sweep.run()
+        self.assertEqual(stats['scanned'], 40)
+        self.assertEqual(stats['removed'], 20)
+        self.assertEqual(len(os.listdir(self.path)), 40)
+
+        stats = Sweep(self.path, self._select, workers=2, batch=3).run()
+        self.assertEqual(stats['removed'], 20)
+        self.assertEqual(stats['bytes_removed'],
+                         sum(i for i in range(40) if i % 2))
+        self.assertEqual(len(os.listdir(self.path)), 20)
+
+    def test_sweep_scandir(self):
+        """Test that the directory is listed only once."""
+        with patch('core.sweep.os.scandir', wraps=os.scandir) as scandir:
+            stats = Sweep(self.path, self._select, workers=2, batch=1).run()
+        self.assertEqual(scandir.call_count, 1)
+        self.assertEqual(stats['scanned'], 40)
+        self.assertEqual(stats['removed'], 20)
+
+    def test_sweep_checkpoint(self):
+        """Test the resume of an interrupted sweep."""
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        checkpoint = os.path.join(path, 'checkpoint')
+        seen = []
+
+        def _select(entry, stat):
+            if len(seen) == 12:
+                raise KeyboardInterrupt()
+            seen.append(entry.name)
+            return self._select(entry, stat)
+
+        sweep = Sweep(self.path, _select, workers=1, batch=3,
+                      checkpoint=checkpoint)
+        sweep.CHECKPOINT_BATCHES = 1
+        with self.assertRaises(KeyboardInterrupt):
+            sweep.run()
+        with open(checkpoint) as f:
+            skip = json.load(f)['skip']
+        self.assertGreater(skip, 0)
+
+        # The processed files are not checked again
+        stats = Sweep(self.path, self._select, batch=3,
+                      checkpoint=checkpoint).run()
+        self.assertEqual(stats['removed'], 20)
+        self.assertGreaterEqual(stats['scanned'], 40)
+        self.assertEqual(len(os.listdir(self.path)), 20)
+        self.assertFalse(os.path.exists(checkpoint))
+
+    def test_cache_gc(self):
+        """Test the removal of images not referenced by the caches."""
+        images_store = os.path.join(self.path, 'images')
+        os.makedirs(os.path.join(images_store, 'full'))
+        for name in ('aa.jpg', 'bb.jpg', 'cc.jpg'):
+            name = os.path.join(images_store, 'full', name)
+            open(name, 'w').close()
+            os.utime(name, (self.old, self.old))
+        issues_store = os.path.join(self.path, 'issues')
+        mobi_store = os.path.join(self.path, 'mobi')
+        issue_cache = IssueCache(issues_store, images_store)
+        issue_cache['url'] = [
+            {'images': [{'path': 'full/aa.jpg'}]},
+            {'images': [{'path': 'full/bb.jpg'}]},
+        ]
+
+        with override_settings(IMAGES_STORE=images_store,
+                               ISSUES_STORE=issues_store,
+                               MOBI_STORE=mobi_store):
+            call_command('clean', 'cache-gc', hours='0', force=True,
+                         stdout=StringIO())
+        self.assertEqual(
+            sorted(os.listdir(os.path.join(images_store, 'full'))),
+            ['aa.jpg', 'bb.jpg'])
+
+        # An issue stored during the sweep reuses an old image
+        dd = os.path.join(images_store, 'full', 'dd.jpg')
+        open(dd, 'w').close()
+        os.utime(dd, (self.old, self.old))
+        run = Sweep.run
+
+        def _run(sweep):
+            stats = run(sweep)
+            issue_cache['url2'] = [{'images': [{'path': 'full/dd.jpg'}]}]
+            return stats
+
+        with override_settings(IMAGES_STORE=images_store,
+                               ISSUES_STORE=issues_store,
+                               MOBI_STORE=mobi_store), \
+                patch('core.management.commands.clean.Sweep.run', _run):
+            call_command('clean', 'cache-gc', hours='0', force=True,
+                         stdout=StringIO())
+        self.assertTrue(os.path.exists(dd))
+
+    def test_cache_dry_run(self):
+        """Test that a dry run do not remove the cached files."""
+        images_store = os.path.join(self.path, 'images')
+        issues_store = os.path.join(self.path, 'issues')
+        mobi_store = os.path.join(self.path, 'mobi')
+        media_root = os.path.join(self.path, 'media')
+        issue_cache = IssueCache(issues_store, images_store)
+        issue_cache['url'] = [{'images': []}]
+        mobi = os.path.join(self.path, 'issue.mobi')
+        open(mobi, 'w').close()
+        mobi_cache = MobiCache(mobi_store)
+        mobi_cache[MobiCache.key('url', 'generic')] = [mobi]
+        Source.objects.create(name='Source', spider='source1',
+                              url='http://source1.com')
+        cover = os.path.join(media_root, 'source1', 'cover.jpg')
+        os.makedirs(os.path.dirname(cover))
+        open(cover, 'w').close()
+
+        with override_settings(IMAGES_STORE=images_store,
+                               ISSUES_STORE=issues_store,
+                               MOBI_STORE=mobi_store,
+                               MEDIA_ROOT=media_root):
+            for command in ('issue-cache', 'mobi-cache', 'cover'):
+                call_command('clean', command, hours='0', dry_run=True,
+                             stdout=StringIO())
+        self.assertIn('url', issue_cache)
+        self.assertEqual(len(mobi_cache), 1)
+        self.assertEqual(len(os.listdir(mobi_cache.data)), 1)
+        self.assertTrue(os.path.exists(cover))
+
+
 class AltNameTestCase(TestCase):
     fixtures = ['registration.json', 'core.json']
 
@@ -223,6 +571,33 @@ class IssueTestCase(TestCase):
                 self.assertEqual(len(issue.result(user1)), 0)
                 self.assertEqual(len(issue.result(user2)), 0)
 
+    def test_clean_mobi_cache(self):
+        """Test the removal of old MOBI documents per device."""
+        issue = Issue.objects.get(pk=1)
+        path = tempfile.mkdtemp()
+        try:
+            mobi = os.path.join(path, 'issue.mobi')
+            open(mobi, 'w').close()
+            mobi_store = os.path.join(path, 'mobi')
+            mobi_cache = MobiCache(mobi_store)
+            key = MobiCache.key(issue.url, 'kindle')
+            mobi_cache[key] = [mobi]
+            # Entry created before the device profiles
+            mobi_cache[issue.url] = [mobi]
+
+            with override_settings(MOBI_STORE=mobi_store):
+                out = StringIO()
+                call_command('clean', 'mobi-cache', hours='1', list=True,
+                             stdout=out)
+                self.assertIn(str(issue.manga), out.getvalue())
+                self.assertNotIn('<UNKNOWN>', out.getvalue())
+
+                call_command('clean', 'mobi-cache', hours='1', force=True,
+                             stdout=StringIO())
+            self.assertEqual(list(mobi_cache), [key])
+        finally:
+            shutil.rmtree(path)
+
 
 class SubscriptionTestCase(TestCase):
     fixtures = ['registration.json', 'core.json']
@@ -261,6 +636,25 @@ class SubscriptionTestCase(TestCase):
             ids = [s.id for s in Subscription.objects.latests(user)]
             self.assertEqual(ids, sorted(ids, reverse=True))
 
+    def test_latests_seek(self):
+        """Test keyset pagination of updated subscriptions."""
+        user = UserProfile.objects.get(pk=1).user
+        subs = Subscription.objects.filter(user=user).order_by('pk').last()
+        subs.add_sent(subs.manga.issue_set.first())
+
+        rqs = Subscription.objects.latests(user)
+        expected = [s.id for s in rqs]
+        self.assertEqual(expected[0], subs.id)
+        for size in (1, 2):
+            key, ids = None, []
+            while True:
+                page = rqs.seek(key, size)
+                if not page:
+                    break
+                ids.extend(s.id for s in page)
+                key = rqs.seek_key(page[-1])
+            self.assertEqual(ids, expected)
+
     def test_str(self):
         """Test subscription representation"""
         self.assertEqual(str(Subscription.objects.get(pk=1)),
@@ -310,6 +704,41 @@ class SubscriptionTestCase(TestCase):
             issues = subs.issues_to_send()
             _test_issues_to_send(subs, issues)
 
+    def test_issues_to_send_bulk(self):
+        """Test the set-based issues_to_send method"""
+        def _test_issues_to_send_bulk():
+            subscriptions = Subscription.actives.all()
+            issues = subscriptions.issues_to_send()
+            for subs in subscriptions:
+                self.assertEqual(issues.get(subs.pk, []),
+                                 list(subs.issues_to_send()))
+            self.assertTrue(set(issues) <= {s.pk for s in subscriptions})
+
+        _test_issues_to_send_bulk()
+
+        Result.objects.all().delete()
+        _test_issues_to_send_bulk()
+
+        # Mark some issues as sent, failed and failed too many times
+        for subs in Subscription.actives.all():
+            issues = list(subs.issues_to_send())
+            subs.add_sent(issues[0])
+            result, _ = subs.add_sent(issues[1])
+            result.set_status(Result.FAILED)
+            result, _ = subs.add_sent(issues[2])
+            result.set_status(Result.FAILED)
+            result.retry = Subscription.RETRY + 1
+            result.save()
+        _test_issues_to_send_bulk()
+
+        # Fill the quota of the first subscription
+        subs = Subscription.actives.first()
+        for issue in subs.issues_to_send():
+            subs.add_sent(issue)
+        issues = Subscription.actives.all().issues_to_send()
+        self.assertNotIn(subs.pk, issues)
+        _test_issues_to_send_bulk()
+
     def test_add_sent(self):
         """Test that a subscription can register a sent."""
         Result.objects.all().delete()
@@ -323,6 +752,20 @@ class SubscriptionTestCase(TestCase):
         self.assertEqual(r.issue, issue)
         self.assertEqual(r.status, Result.SENT)
 
+    def test_latest_issue_position(self):
+        """Test the position of the last modified issue's result."""
+        Result.objects.all().delete()
+        subs = Subscription.actives.all()[0]
+        issues = list(subs.issues())
+        self.assertEqual(subs.latest_issue_position(), (None, len(issues)))
+
+        for issue in (issues[-1], issues[0], issues[len(issues) // 2]):
+            subs.add_sent(issue)
+            # The cache is invalidated with the new result
+            subs.refresh_from_db()
+            self.assertEqual(subs.latest_issue_position(),
+                             (issues.index(issue), len(issues)))
+
 
 class ResultTestCase(TestCase):
     fixtures = ['registration.json', 'core.json']
@@ -340,6 +783,13 @@ class ResultTestCase(TestCase):
 
         self.assertFalse(Result.objects.latests(status=Result.SENT).exists())
 
+    def test_last_result_modified(self):
+        """Test the update of the latest result activity."""
+        result = Result.objects.first()
+        result.set_status(Result.SENT)
+        subs = Subscription.all_objects.get(pk=result.subscription_id)
+        self.assertEqual(subs.last_result_modified, result.modified)
+
     def test_processed_last_24hs(self):
         """Test the method to detect last processed issues."""
         user1 = UserProfile.objects.get(pk=1).user
@@ -356,6 +806,51 @@ class ResultTestCase(TestCase):
                 Result.objects.processed_last_24hs(user1, subscription=subs),
                 1)
 
+    def test_transition(self):
+        """Test the bulk creation and update of results."""
+        user1 = UserProfile.objects.get(pk=1).user
+        Result.objects.all().delete()
+        subs = Subscription.actives.filter(user=user1)
+        issues = [s.manga.issue_set.all()[0] for s in subs]
+        # Issues from mangas without subscription are ignored
+        other = Issue.objects.exclude(manga__subscription__user=user1)[0]
+
+        results = Result.objects.transition(issues + [other], user1,
+                                            Result.PROCESSING)
+        self.assertEqual(len(results), len(issues))
+        self.assertEqual({r.issue_id for r in results},
+                         {i.id for i in issues})
+        self.assertTrue(all(r.status == Result.PROCESSING for r in results))
+        self.assertTrue(all(r.send_date for r in results))
+        self.assertEqual(Result.objects.processed_last_24hs(user1),
+                         len(issues))
+
+        # The second transition update the same rows
+        results2 = Result.objects.transition(issues, user1, Result.FAILED)
+        self.assertEqual({r.id for r in results2}, {r.id for r in results})
+        self.assertTrue(all(r.status == Result.FAILED for r in results2))
+        self.assertFalse(any(r.send_date for r in results2))
+        self.assertEqual(Result.objects.processed_last_24hs(user1), 0)
+
+        # Without send date the previous one is preserved
+        Result.objects.transition(issues, user1, Result.SENT)
+        Result.objects.transition(issues, user1, Result.PENDING,
+                                  set_send_date=False)
+        self.assertTrue(all(r.send_date for r in Result.objects.all()))
+        self.assertEqual(Result.objects.pending().count(), len(issues))
+        for subscription in subs:
+            subscription.refresh_from_db()
+            self.assertIsNotNone(subscription.last_result_modified)
+
+        self.assertEqual(Result.objects.transition([], user1, Result.SENT),
+                         [])
+
+        # Repeated issues are updated once
+        results = Result.objects.transition(issues + issues, user1,
+                                            Result.SENT)
+        self.assertEqual(len(results), len(issues))
+        self.assertTrue(all(r.status == Result.SENT for r in results))
+
     def test_status(self):
         """Test recovery latest results instances with some status."""
         user1 = UserProfile.objects.get(pk=1).user
@@ -375,6 +870,22 @@ class ResultTestCase(TestCase):
             self.assertEqual(getattr(Result.objects, latest)().count(), 1)
             self.assertTrue(getattr(result, is_)())
 
+    def test_clean_result(self):
+        """Test the chunked removal of results in a bad state."""
+        Result.objects.update(status=Result.FAILED)
+        count = Result.objects.count()
+
+        out = StringIO()
+        call_command('clean', 'result-failed', hours='0', dry_run=True,
+                     batch='1', stdout=out)
+        self.assertEqual(Result.objects.count(), count)
+        self.assertIn('core.Result', out.getvalue())
+        self.assertIn('dry run', out.getvalue())
+
+        call_command('clean', 'result-failed', hours='0', force=True,
+                     batch='2', stdout=StringIO())
+        self.assertEqual(Result.objects.count(), 0)
+
     def test_str(self):
         """Test result representation"""
         self.assertEqual(str(Result.objects.get(pk=1)),
@@ -1,7 +1,10 @@
-import bisect
+import datetime
 
 from django.contrib.auth.mixins import LoginRequiredMixin
-from django.core.paginator import InvalidPage, Paginator
+from django.core import signing
+from django.core.exceptions import FieldDoesNotExist
+from django.core.exceptions import ValidationError
+from django.core.paginator import InvalidPage, Page, Paginator
 from django.http import Http404
 from django.http import HttpResponseForbidden
 from django.http import HttpResponseRedirect
@@ -66,6 +69,92 @@ class SafeCreateView(CreateView):
         return super(CreateView, self).post(request, *args, **kwargs)
 
 
+class SeekPaginationMixin(object):
+    """Keyset pagination for querysets that support `seek()`.
+
+    The next page is requested with an opaque `cursor` token, that
+    contains the page number and the key of the last object of the
+    current page.  With this token the next page is found without
+    OFFSET.  The token is bound to the ordering and the parameters
+    of the queryset (like the search query), so it can not be used
+    with a different one.  The total number of objects is cached
+    `count_timeout` seconds.
+
+    """
+    cursor_kwarg = 'cursor'
+    count_timeout = 5 * 60
+
+    def _cursor_binding(self, queryset):
+        """Return the ordering and the parameters of the queryset."""
+        params = list(queryset.params) if queryset.params else None
+        return [list(queryset.seek_fields), params]
+
+    def _load_cursor(self, queryset, cursor):
+        """Return the page number and the key stored in a cursor."""
+        try:
+            page_number, key, binding = signing.loads(cursor, salt=__name__)
+        except (signing.BadSignature, ValueError, TypeError):
+            raise Http404('Invalid cursor')
+        if binding != self._cursor_binding(queryset) or \
+           type(page_number) is not int or page_number < 2 or \
+           not isinstance(key, list) or \
+           len(key) != len(queryset.seek_fields):
+            raise Http404('Invalid cursor')
+        for field, value in zip(queryset.seek_fields, key):
+            if value is None:
+                continue
+            if isinstance(value, bool) or \
+               not isinstance(value, (int, float, str)):
+                raise Http404('Invalid cursor')
+            try:
+                field = queryset.model._meta.get_field(field)
+            except FieldDoesNotExist:
+                # Annotations, like the rank of a search
+                if isinstance(value, str):
+                    raise Http404('Invalid cursor')
+                continue
+            try:
+                field.to_python(value)
+            except ValidationError:
+                raise Http404('Invalid cursor')
+        return page_number, key
+
+    def paginate_queryset(self, queryset, page_size):
+        if not getattr(queryset, 'seek_query', None):
+            return super(SeekPaginationMixin, self).paginate_queryset(
+                queryset, page_size)
+
+        queryset.count_timeout = self.count_timeout
+        cursor = self.request.GET.get(self.cursor_kwarg)
+        if cursor:
+            page_number, key = self._load_cursor(queryset, cursor)
+            paginator = self.get_paginator(
+                queryset, page_size, orphans=self.get_paginate_orphans(),
+                allow_empty_first_page=self.get_allow_empty())
+            page = Page(queryset.seek(key, page_size), page_number, paginator)
+        else:
+            paginator, page, _, _ = super(
+                SeekPaginationMixin, self).paginate_queryset(queryset,
+                                                             page_size)
+            page.object_list = list(page.object_list)
+
+        self.next_cursor = None
+        if page.has_next() and page.object_list:
+            key = queryset.seek_key(page.object_list[-1])
+            key = [k.isoformat() if isinstance(k, datetime.datetime) else k
+                   for k in key]
+            self.next_cursor = signing.dumps(
+                [page.number + 1, key, self._cursor_binding(queryset)],
+                salt=__name__)
+        return (paginator, page, page.object_list, page.has_other_pages())
+
+    def get_context_data(self, **kwargs):
+        """Extend the context data with the next cursor."""
+        context = super(SeekPaginationMixin, self).get_context_data(**kwargs)
+        context['next_cursor'] = getattr(self, 'next_cursor', None)
+        return context
+
+
 class AboutTemplateView(TemplateView):
     template_name = 'core/about.html'
 
@@ -84,7 +173,8 @@ class ThanksTemplateView(TemplateView):
     template_name = 'core/thanks.html'
 
 
-class MangaListView(LoginRequiredMixin, ListView, MultipleObjectMixin):
+class MangaListView(LoginRequiredMixin, SeekPaginationMixin, ListView,
+                    MultipleObjectMixin):
     model = Manga
     paginate_by = 9
 
@@ -143,7 +233,8 @@ class IssueDeleteView(LoginRequiredMixin, DeleteView):
     success_url = reverse_lazy('issue-list')
 
 
-class SubscriptionListView(LoginRequiredMixin, ListView, MultipleObjectMixin):
+class SubscriptionListView(LoginRequiredMixin, SeekPaginationMixin, ListView,
+                           MultipleObjectMixin):
     model = Subscription
     paginate_by = 9
 
@@ -168,16 +259,20 @@ class SubscriptionDetailView(LoginRequiredMixin, SubscriptionOwnerMixin,
         except (ValueError, TypeError):
             paginate_by = self.paginate_by
 
+        position, count = self.object.latest_issue_position()
         paginator = Paginator(
             self.object.issues(),
             paginate_by,
             orphans=0,
             allow_empty_first_page=True
         )
+        # The number of issues comes from the same query used to find
+        # the last page, avoid a new COUNT
+        paginator.count = count
 
         page = self.kwargs.get('page') or self.request.GET.get('page')
         if not page:
-            page = self.get_last_page()
+            page = self.get_last_page(position, paginate_by)
         try:
             page_number = int(page)
         except ValueError:
@@ -199,20 +294,13 @@ class SubscriptionDetailView(LoginRequiredMixin, SubscriptionOwnerMixin,
         })
         return context
 
-    def get_last_page(self):
+    def get_last_page(self, position, paginate_by):
         """Get the page number of the last modified issue's result."""
-        # We get the last page taking first the Issue that contains
-        # the most updated result, and searching it in the ordered
-        # list of issues.  For each Issue we get the same fields used
-        # in Meta.ordering, so we are sure that bisect will work.
-        fields = Issue._meta.ordering
-        latest_issues = self.object.latest_issues
-        latest_issue = latest_issues().values_list(*fields).first()
-        if not latest_issue:
+        # The position of the issue that contains the most updated
+        # result is calculated in the database.
+        if position is None:
             return 1
-        issues = self.object.issues().values_list(*fields)
-        index = bisect.bisect_left(issues, latest_issue)
-        return (index / self.paginate_by) + 1
+        return (position // paginate_by) + 1
 
 
 class SubscriptionCreateView(LoginRequiredMixin, SafeCreateView):
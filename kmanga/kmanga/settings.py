@@ -166,6 +166,16 @@ RQ_QUEUES = {
     }
 }
 
+# Cache for the full text search results.  The results are stored in
+# the Redis instance of a RQ queue, in windows of SEARCH_CACHE_WINDOW
+# entries, and only the first SEARCH_CACHE_WINDOWS windows are used
+# for keyset pagination.  Set SEARCH_CACHE_TIMEOUT to None to disable
+# the cache.
+SEARCH_CACHE_QUEUE = 'default'
+SEARCH_CACHE_TIMEOUT = 60 * 60
+SEARCH_CACHE_WINDOW = 90
+SEARCH_CACHE_WINDOWS = 10
+
 KINDLEGEN = os.path.join(BASE_DIR, '..', 'bin', 'kindlegen')
 # IMAGES_STORE and ISSUES_STORE are also in `scraper` settings
 IMAGES_STORE = os.path.join(BASE_DIR, '..', 'scraper', 'img_store')
@@ -13,6 +13,9 @@ from scrapyctl.scrapyctl import ScrapyCtl
 class Command(BaseCommand):
     help = 'Process proxies for spiders from command line.'
 
+    # Number of new proxies stored in each INSERT
+    BATCH = 100
+
     def add_arguments(self, parser):
         parser.add_argument('command', choices=[
             'list',
@@ -58,18 +61,31 @@ class Command(BaseCommand):
 
     def _update_proxy(self, clean):
         """Get the list of valid proxies and update the model."""
+        sources = {s.spider: s.pk for s in Source.objects.all()}
+        current = {
+            (proxy, spider): pk for pk, proxy, spider in
+            Proxy.objects.values_list('pk', 'proxy', 'source__spider')
+        }
+
         if clean:
-            proxies = Proxy.objects.values_list('proxy', flat=True)
-            proxies = set(check_proxy(proxies))
-            for proxy in Proxy.objects.all():
-                if (proxy.proxy, proxy.source.spider) not in proxies:
-                    proxy.delete()
+            proxies = {proxy for proxy, _ in current}
+            valid = set(check_proxy(proxies))
+            broken = [pk for key, pk in current.items() if key not in valid]
+            Proxy.objects.filter(pk__in=broken).delete()
+            current = {k: v for k, v in current.items() if k in valid}
+            self.stdout.write('Removed %s broken proxies' % len(broken))
 
-        # Recover new proxies
-        proxies = update_proxy()
-        self.stdout.write('Found %s valid proxies' % len(proxies))
-        for proxy, spider in proxies:
-            source = Source.objects.get(spider=spider)
-            Proxy.objects.get_or_create(proxy=proxy, source=source)
+        # Recover new proxies.  The proxies are stored in batches, as
+        # soon as they are validated
+        found, batch = 0, []
+        for proxy, spider in update_proxy():
+            found += 1
+            if (proxy, spider) not in current:
+                batch.append((proxy, sources[spider]))
+            if len(batch) >= self.BATCH:
+                Proxy.objects.bulk_add(batch)
+                batch = []
+        Proxy.objects.bulk_add(batch)
+        self.stdout.write('Found %s valid proxies' % found)
         total = Proxy.objects.all().count()
         self.stdout.write('Number of proxies in the database: %s' % total)
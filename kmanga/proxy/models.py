@@ -1,4 +1,7 @@
+from django.db import connection
 from django.db import models
+from django.db.models import F
+from django.utils import timezone
 
 from core.models import Source
 from core.models import TimeStampedModel
@@ -17,6 +20,44 @@ class ProxyQuerySet(models.QuerySet):
         except Proxy.DoesNotExist:
             pass
 
+    def discard_many(self, failures, spider):
+        """Discard a set of proxies that are failing.
+
+        `failures` is a dictionary with the number of failures of
+        every proxy.  Return the number of proxies removed.
+
+        """
+        by_count = {}
+        for proxy, count in failures.items():
+            by_count.setdefault(count, []).append(proxy)
+        query = self.filter(source__spider=spider)
+        for count, proxies in by_count.items():
+            query.filter(proxy__in=proxies).update(retry=F('retry') + count)
+        deleted, _ = query.filter(retry__gt=Proxy.RETRY).delete()
+        return deleted
+
+    def bulk_add(self, proxies):
+        """Add a list of (proxy, source_id) pairs, ignoring the old ones.
+
+        Return the number of new proxies.
+
+        """
+        proxies = list(proxies)
+        if not proxies:
+            return 0
+        now = timezone.now()
+        values = ', '.join(['(%s, %s, %s, %s, 0)'] * len(proxies))
+        params = []
+        for proxy, source_id in proxies:
+            params.extend((now, now, proxy, source_id))
+        cursor = connection.cursor()
+        cursor.execute('''
+INSERT INTO proxy_proxy (created, modified, proxy, source_id, retry)
+     VALUES %s
+ON CONFLICT (proxy, source_id) DO NOTHING;
+''' % values, params)
+        return cursor.rowcount
+
     def remainings(self, spider):
         """Return the number of proxy for a source."""
         return self.filter(source__spider=spider).count()
@@ -1,3 +1,157 @@
+import gzip
+import http.server
+from io import StringIO
+import socket
+import threading
+from unittest.mock import patch
+
+from django.core.management import call_command
+from django.test import SimpleTestCase
 from django.test import TestCase
 
-# Create your tests here.
+from core.models import Source
+from proxy import utils
+from proxy.models import Proxy
+
+
+class StubProxyHandler(http.server.BaseHTTPRequestHandler):
+    """Proxy that answers every request with the URL and the Host."""
+
+    def do_GET(self):
+        if 'forbidden' in self.path:
+            self.send_response(403)
+            self.end_headers()
+            return
+        body = ('%s %s' % (self.path, self.headers['Host'])).encode()
+        self.send_response(200)
+        if 'gzip' in self.path:
+            body = gzip.compress(body)
+            self.send_header('Content-Encoding', 'gzip')
+        if 'corrupt' in self.path:
+            body = gzip.compress(body)[:-8]
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', len(body))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class CheckProxyTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.server = http.server.HTTPServer(('127.0.0.1', 0),
+                                             StubProxyHandler)
+        self.proxy = '127.0.0.1:%d' % self.server.server_port
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+
+        # A port with nothing listening on it
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        self.broken = '127.0.0.1:%d' % sock.getsockname()[1]
+        sock.close()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+    def _source(self, url, valid=None, invalid=None):
+        return {utils.URL: url, utils.VALID: valid, utils.INVALID: invalid}
+
+    def test_check_proxy(self):
+        """Test the validation of proxies with a stub proxy."""
+        proxy_map = {
+            # A corrupt body do not discard the proxy for the rest
+            'source0': self._source('http://source0.com/corrupt',
+                                    invalid=['source0.com']),
+            'source1': self._source('http://source1.com/manga',
+                                    valid=['http://source1.com/manga']),
+            'source2': self._source('http://source2.com/gzip',
+                                    valid=['gzip source2.com']),
+            'source3': self._source('http://source3.com/manga',
+                                    invalid=['source3.com']),
+            'source4': self._source('http://source4.com/forbidden',
+                                    invalid=['source4.com']),
+            'source5': self._source('http://source5.com/manga',
+                                    valid=['10.0.0.1/manga source5.com']),
+        }
+        vhost = {'source5': '10.0.0.1'}
+        with patch.dict(utils.PROXY_MAP, proxy_map), \
+                patch.dict(utils.VHOST, vhost):
+            proxies = utils.check_proxy([self.proxy, self.broken],
+                                        concurrency=1)
+            self.assertEqual(sorted(proxies), [
+                (self.proxy, 'source1'),
+                (self.proxy, 'source2'),
+                (self.proxy, 'source5'),
+            ])
+
+    def test_check_proxy_timeout(self):
+        """Test that a proxy that do not answer is discarded."""
+        proxy_map = {
+            'source1': self._source('http://source1.com/manga',
+                                    valid=['manga']),
+        }
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        sock.listen(1)
+        silent = '127.0.0.1:%d' % sock.getsockname()[1]
+        try:
+            with patch.dict(utils.PROXY_MAP, proxy_map):
+                proxies = utils.check_proxy([silent, self.proxy],
+                                            timeout=0.5)
+                self.assertEqual(list(proxies), [(self.proxy, 'source1')])
+        finally:
+            sock.close()
+
+
+class ProxyTestCase(TestCase):
+    fixtures = ['registration.json', 'core.json']
+
+    def test_bulk_add(self):
+        """Test the addition of new proxies."""
+        source = Source.objects.get(spider='source1')
+        Proxy.objects.create(proxy='10.0.0.1:80', source=source)
+        added = Proxy.objects.bulk_add([('10.0.0.1:80', source.pk),
+                                        ('10.0.0.2:80', source.pk)])
+        self.assertEqual(added, 1)
+        self.assertEqual(Proxy.objects.remainings('source1'), 2)
+        self.assertEqual(Proxy.objects.bulk_add([]), 0)
+
+    def test_discard_many(self):
+        """Test the discard of a set of failing proxies."""
+        source = Source.objects.get(spider='source1')
+        Proxy.objects.create(proxy='10.0.0.1:80', source=source)
+        Proxy.objects.create(proxy='10.0.0.2:80', source=source, retry=2)
+        Proxy.objects.create(proxy='10.0.0.3:80', source=source)
+        deleted = Proxy.objects.discard_many(
+            {'10.0.0.1:80': 1, '10.0.0.2:80': 2, '10.0.0.3:80': 1},
+            'source1')
+        self.assertEqual(deleted, 1)
+        self.assertEqual(
+            sorted(Proxy.objects.values_list('proxy', 'retry')),
+            [('10.0.0.1:80', 1), ('10.0.0.3:80', 1)])
+
+    @patch('proxy.management.commands.proxy.update_proxy')
+    @patch('proxy.management.commands.proxy.check_proxy')
+    def test_update_proxy(self, check_proxy, update_proxy):
+        """Test the update of the proxies from the command."""
+        source1 = Source.objects.get(spider='source1')
+        source2 = Source.objects.get(spider='source2')
+        Proxy.objects.create(proxy='10.0.0.1:80', source=source1)
+        Proxy.objects.create(proxy='10.0.0.1:80', source=source2)
+        Proxy.objects.create(proxy='10.0.0.2:80', source=source1)
+
+        check_proxy.return_value = iter([('10.0.0.1:80', 'source1')])
+        update_proxy.return_value = iter([('10.0.0.1:80', 'source1'),
+                                          ('10.0.0.3:80', 'source1'),
+                                          ('10.0.0.3:80', 'source2')])
+        call_command('proxy', 'update-proxy', clean=True, stdout=StringIO())
+        self.assertEqual(
+            sorted(Proxy.objects.values_list('proxy', 'source__spider')),
+            [('10.0.0.1:80', 'source1'),
+             ('10.0.0.3:80', 'source1'),
+             ('10.0.0.3:80', 'source2')])
@@ -1,12 +1,12 @@
+import asyncio
 import gzip
 import io
-import itertools
 import logging
 import re
 import urllib.error
 import urllib.parse
 import urllib.request
-from multiprocessing.pool import ThreadPool
+import zlib
 
 logger = logging.getLogger(__name__)
 
@@ -16,6 +16,9 @@ INVALID = 'INVALID'
 
 TIMEOUT = 5
 
+# Maximum number of concurrent connections used to validate proxies
+CONCURRENCY = 512
+
 # Virtual Host table
 VHOST = {
     # 'spider_name': 'real_ip',
@@ -70,7 +73,7 @@ PROXY_SOURCE = [
 
 
 def update_proxy():
-    """Collect new proxies and return validation array."""
+    """Collect new proxies and generate the valid (proxy, source)."""
     collector = {
         'plain': _collect_proxies_plain,
         'xml': _collect_proxies_xml,
@@ -85,11 +88,34 @@ def update_proxy():
     return check_proxy(proxies)
 
 
-def check_proxy(proxies):
-    """Return validation array for a list of proxies."""
-    pool = ThreadPool(processes=512)
-    proxy_source = itertools.product(proxies, PROXY_MAP)
-    return [p for p in pool.imap(_is_valid_proxy, proxy_source) if p]
+def check_proxy(proxies, concurrency=CONCURRENCY, timeout=TIMEOUT):
+    """Generate the (proxy, source) pairs that are valid.
+
+    The proxies are validated concurrently, with a maximum of
+    `concurrency` open connections, and the pairs are generated as
+    soon as every proxy is validated.
+
+    """
+    loop = asyncio.new_event_loop()
+    semaphore = asyncio.Semaphore(concurrency, loop=loop)
+    pending = {
+        loop.create_task(_check_proxy(proxy, semaphore, timeout))
+        for proxy in proxies
+    }
+    try:
+        while pending:
+            done, pending = loop.run_until_complete(
+                asyncio.wait(pending, loop=loop,
+                             return_when=asyncio.FIRST_COMPLETED))
+            for task in done:
+                yield from task.result()
+    finally:
+        for task in pending:
+            task.cancel()
+        if pending:
+            loop.run_until_complete(
+                asyncio.wait(pending, loop=loop))
+        loop.close()
 
 
 def needs_proxy(spider):
@@ -139,34 +165,70 @@ def _collect_proxies_gz(url):
     return proxy_re.findall(body)
 
 
-def _is_valid_proxy(proxy_source):
-    """Check if is a valid proxy for a specific Source."""
-    proxy, source = proxy_source
-
-    _proxy = urllib.request.ProxyHandler({'http': proxy})
-    opener = urllib.request.build_opener(_proxy)
-
-    test = PROXY_MAP[source]
-    url, valid, invalid = test[URL], test[VALID], test[INVALID]
-
+async def _check_proxy(proxy, semaphore, timeout):
+    """Return the list of (proxy, source) pairs that are valid."""
+    valid = []
+    for source in PROXY_MAP:
+        try:
+            async with semaphore:
+                body = await asyncio.wait_for(
+                    _get_url_proxy(proxy, source), timeout)
+        except (OSError, ValueError, asyncio.TimeoutError):
+            # If the proxy do not work for one source, it will not
+            # work for the rest
+            logger.debug('Fail proxy %s' % proxy)
+            break
+        if body is not None and _is_valid_body(body, source):
+            valid.append((proxy, source))
+    return valid
+
+
+async def _get_url_proxy(proxy, source):
+    """Get the content of the test URL of a Source using a proxy.
+
+    Return None if the response is not a 200, or if the body can not
+    be decoded.
+
+    """
+    url = PROXY_MAP[source][URL]
+    parse = urllib.parse.urlparse(url)
+    netloc = parse.netloc
     if source in VHOST:
-        parse = urllib.parse.urlparse(url)
-        netloc = parse.netloc
         url = parse._replace(netloc=VHOST[source]).geturl()
-        req = urllib.request.Request(url)
-        req.add_unredirected_header('Host', netloc)
-    else:
-        req = urllib.request.Request(url)
 
+    host, port = proxy.rsplit(':', 1)
+    reader, writer = await asyncio.open_connection(host, int(port))
     try:
-        response = opener.open(req, timeout=TIMEOUT)
-        if response.info().get('Content-Encoding') == 'gzip':
-            body = io.BytesIO(response.read())
-            body = gzip.open(body).read().decode('utf-8')
-        else:
-            body = response.read().decode('utf-8')
-    except Exception:
+        # HTTP/1.0 to avoid chunked responses
+        writer.write((
+            'GET %s HTTP/1.0\r\n'
+            'Host: %s\r\n'
+            'Connection: close\r\n'
+            '\r\n' % (url, netloc)).encode('ascii'))
+        response = await reader.read()
+    finally:
+        writer.close()
+
+    head, _, body = response.partition(b'\r\n\r\n')
+    status, *headers = head.decode('latin-1').split('\r\n')
+    if len(status.split()) < 2 or status.split()[1] != '200':
         return None
+    headers = dict(h.lower().split(':', 1) for h in headers if ':' in h)
+    if headers.get('content-encoding', '').strip() == 'gzip':
+        # A truncated or corrupt body is not a valid one for the
+        # source, but the proxy can work for other sources
+        try:
+            body = gzip.decompress(body)
+        except (OSError, EOFError, zlib.error):
+            logger.debug('Fail decoding the body from %s' % proxy)
+            return None
+    return body.decode('utf-8', errors='replace')
+
+
+def _is_valid_body(body, source):
+    """Check if the body is the expected one for a Source."""
+    test = PROXY_MAP[source]
+    valid, invalid = test[VALID], test[INVALID]
 
     if valid and invalid:
         is_valid = all(i in body for i in valid)
@@ -177,5 +239,4 @@ def _is_valid_proxy(proxy_source):
         is_valid = not any(i in body for i in invalid)
     else:
         is_valid = False
-    if is_valid:
-        return (proxy, source)
+    return is_valid
@@ -47,6 +47,7 @@ class UserUpdateForm(UserChangeForm):
     time_zone = forms.IntegerField()
     send_at = forms.IntegerField()
     email_kindle = forms.EmailField()
+    device = forms.ChoiceField(choices=UserProfile.DEVICE_CHOICES)
 
     class Meta:
         model = User
@@ -58,6 +59,7 @@ class UserUpdateForm(UserChangeForm):
         userprofile.time_zone = self.cleaned_data['time_zone']
         userprofile.send_at = self.cleaned_data['send_at']
         userprofile.email_kindle = self.cleaned_data['email_kindle']
+        userprofile.device = self.cleaned_data['device']
         userprofile.save()
         return super(UserUpdateForm, self).save(*args, **kwargs)
 
@@ -37,6 +37,19 @@ class UserProfile(models.Model):
         FREE: 30,
         PAY: 60,
     }
+    # Device profiles defined in `mobi.DEVICES`
+    GENERIC = 'generic'
+    KINDLE = 'kindle'
+    PAPERWHITE = 'paperwhite'
+    OASIS = 'oasis'
+    SCRIBE = 'scribe'
+    DEVICE_CHOICES = (
+        (GENERIC, 'Generic (800x1280)'),
+        (KINDLE, 'Kindle (600x800)'),
+        (PAPERWHITE, 'Kindle Paperwhite / Voyage (1072x1448)'),
+        (OASIS, 'Kindle Oasis (1264x1680)'),
+        (SCRIBE, 'Kindle Scribe (1860x2480)'),
+    )
 
     user = models.OneToOneField(settings.AUTH_USER_MODEL,
                                 on_delete=models.CASCADE,
@@ -49,6 +62,8 @@ class UserProfile(models.Model):
     send_at = models.IntegerField(choices=HOUR_CHOICES, default=0)
     issues_per_day = models.IntegerField(default=ISSUES_PER_DAY[FREE])
     email_kindle = models.EmailField(unique=True)
+    device = models.CharField(max_length=16, choices=DEVICE_CHOICES,
+                              default=GENERIC)
 
     def __str__(self):
         return self.user.username
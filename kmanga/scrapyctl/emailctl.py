@@ -5,32 +5,35 @@ from django.core.mail import EmailMessage
 from django_rq import job
 
 from core.models import Result
-from core.models import Subscription
 from mobi.cache import MobiCache
 
 logger = logging.getLogger(__name__)
 
 
 @job('high', timeout=15*60)
-def send_mobi(issue, user):
-    """RQ job to send MOBI documents."""
+def send_mobi(issue, user, device=None):
+    """RQ job to send MOBI documents created for a device."""
     mobi_cache = MobiCache(settings.MOBI_STORE)
 
-    try:
-        result = issue.create_result_if_needed(user, Result.PROCESSING)
-    except Subscription.DoesNotExist:
+    results = Result.objects.transition([issue], user, Result.PROCESSING)
+    if not results:
         # Results in PROCESSING status are cleaned during the
         # subscription removal
         msg = 'Subscription removed for user %s (%s)' % (user, issue)
         logger.warning(msg)
         return
+    result = results[0]
 
-    if issue.url not in mobi_cache:
+    # Jobs queued before the device profiles do not have the device
+    if device is None:
+        device = user.userprofile.device
+    key = MobiCache.key(issue.url, device)
+    if key not in mobi_cache:
         logger.error('Issue not found in mobi cache (%s)' % issue)
         result.set_status(Result.FAILED)
         return
     # Ignore the creation date from the cache.
-    mobi_info, _ = mobi_cache[issue.url]
+    mobi_info, _ = mobi_cache[key]
 
     email = user.userprofile.email_kindle
     for mobi_name, mobi_file in mobi_info:
@@ -9,7 +9,6 @@ from django.db.models import F
 from django.db.models import Q
 from django.utils import timezone
 
-from core.models import Manga
 from core.models import Source
 from core.models import Subscription
 from registration.models import UserProfile
@@ -53,9 +52,9 @@ class Command(BaseCommand):
             '--details', action='store_true', dest='details', default=False,
             help='Add more details in the list of mangas.')
         parser.add_argument(
-            '--until', action='store', dest='until',
-            default=datetime.date.today(),
-            help='Until parameter to latest update (<DD-MM-YYYY>).')
+            '--until', action='store', dest='until', default=None,
+            help='Until parameter to latest update (<DD-MM-YYYY>). By '
+            'default the last release seen by the spider.')
         parser.add_argument(
             '--issues-per-day', action='store', dest='issues-per-day',
             default=4,
@@ -285,10 +284,6 @@ class Command(BaseCommand):
         else:
             raise CommandError('Not valid command value.')
 
-        # Refresh the MATERIALIZED VIEW for full text search
-        if command.startswith('update'):
-            Manga.objects.refresh()
-
         # Print the SQL statistics in DEBUG mode
         if loglevel == 'DEBUG':
             queries = ['[%s]: %s' % (q['time'], q['sql'])
@@ -390,8 +385,9 @@ class Command(BaseCommand):
         #     order (for sources that are active).
         #
         #   * For each subcription, get the list of issues that can be
-        #     sent for this user today. This calculation is done in
-        #     `Subscription.issues_to_send()`
+        #     sent for this user today. This calculation is done for
+        #     all the subscriptions in one query in
+        #     `SubscriptionQuerySet.issues_to_send()`
         #
         remains = user_profile.remains()
 
@@ -399,8 +395,9 @@ class Command(BaseCommand):
         subscriptions = user.subscription_set(manager='actives')\
                             .filter(manga__source__enabled=True)\
                             .order_by('?')
+        issues_to_send = subscriptions.issues_to_send()
         for subscription in subscriptions:
-            for issue in subscription.issues_to_send():
+            for issue in issues_to_send.get(subscription.pk, []):
                 # Exit if we reach the limit for today
                 if remains <= 0:
                     break
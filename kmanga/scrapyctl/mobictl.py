@@ -7,9 +7,10 @@ from django.conf import settings
 from django_rq import job
 
 from core.models import Result
-from core.models import Subscription
 from scrapyctl.emailctl import send_mobi
 from mobi import Container
+from mobi import DEVICES
+from mobi import GENERIC
 from mobi import MangaMobi
 from mobi.cache import IssueCache
 from mobi.cache import MobiCache
@@ -93,36 +94,42 @@ class MobiInfo(object):
 class MobiCtl(object):
     """Helper class to create MOBI documents."""
 
-    def __init__(self, issue, images, images_store):
+    def __init__(self, issue, images, images_store, device=GENERIC):
         """Create a new MOBI from one issue and a set of images."""
         self.issue = issue
         self.images = images
         self.images_store = images_store
+        self.device = device
+        self.profile = DEVICES[device]
 
         self.kindlegen = settings.KINDLEGEN
         self.mobi_store = settings.MOBI_STORE
-        self.volume_max_size = settings.VOLUME_MAX_SIZE
+        self.volume_max_size = (self.profile.size_limit or
+                                settings.VOLUME_MAX_SIZE)
 
     def _create_mobi(self):
         """Create the MOBI file and return a list of files and containers."""
         dir_name = tempfile.mkdtemp(dir=self.mobi_store)
-        container = Container(dir_name)
+        container = Container(dir_name, profile=self.profile)
         container.create(clean=True)
         images = sorted(self.images, key=lambda x: x['number'])
-        _images = []
+        _images, bboxes = [], []
         for i in images:
             if i['images']:
                 image_path = i['images'][0]['path']
+                # Stored by the pipeline in Kindle mode
+                bbox = i['images'][0].get('bbox')
             else:
-                image_path = EMPTY
+                image_path, bbox = EMPTY, None
             _images.append(os.path.join(self.images_store, image_path))
+            bboxes.append(bbox)
 
         # By default reduce the margin of the image
         _filter = Container.FILTER_MARGIN
         if self.issue.manga.source.has_footer:
             _filter |= Container.FILTER_FOOTER
         container.add_images(_images, adjust=Container.ROTATE,
-                             _filter=_filter, as_link=True)
+                             _filter=_filter, as_link=True, bboxes=bboxes)
 
         if container.get_size() > self.volume_max_size:
             containers = container.split(self.volume_max_size, clean=True)
@@ -143,23 +150,24 @@ class MobiCtl(object):
     def create_mobi(self):
         """Create the MOBI file and return a list of files and names."""
         cache = MobiCache(settings.MOBI_STORE)
+        key = MobiCache.key(self.issue.url, self.device)
 
-        if self.issue.url not in cache:
+        if key not in cache:
             mobi_and_containers = self._create_mobi()
             # XXX TODO - We are not storing stats in the cache anymore (is
             # not the place), so we need to store it in a different place.
             # Maybe in the database?
-            cache[self.issue.url] = [m[0] for m in mobi_and_containers]
+            cache[key] = [m[0] for m in mobi_and_containers]
             # The containers need to be cleaned here.
             for _, container in mobi_and_containers:
                 container.clean()
 
-        mobi_info, _ = cache[self.issue.url]
+        mobi_info, _ = cache[key]
         return mobi_info
 
 
 @job('low', timeout=2*60*60)
-def _create_mobi(issue, result=None):
+def _create_mobi(issue, result=None, device=GENERIC):
     """RQ job to create a single MOBI document."""
     issue_cache = IssueCache(settings.ISSUES_STORE, settings.IMAGES_STORE)
 
@@ -174,7 +182,7 @@ def _create_mobi(issue, result=None):
         del issue_cache[issue.url]
     else:
         images, _ = issue_cache[issue.url]
-        mobictl = MobiCtl(issue, images, settings.IMAGES_STORE)
+        mobictl = MobiCtl(issue, images, settings.IMAGES_STORE, device)
         mobictl.create_mobi()
 
 
@@ -188,10 +196,14 @@ def create_mobi(issues):
 @job('high')
 def create_mobi_and_send(issues, user):
     """RQ job to create MOBI documents and send it to the user."""
+    results = Result.objects.transition(issues, user, Result.PROCESSING)
+    results = {result.issue_id: result for result in results}
+    # The MOBI is sent for the device used to create it, even if the
+    # user changes the profile meanwhile
+    device = user.userprofile.device
     for issue in issues:
-        try:
-            result = issue.create_result_if_needed(user, Result.PROCESSING)
-        except Subscription.DoesNotExist:
+        result = results.get(issue.id)
+        if not result:
             # Results in PROCESSING status are cleaned during the
             # subscription removal
             msg = 'Subscription removed for user %s (%s)' % (user, issue)
@@ -199,5 +211,5 @@ def create_mobi_and_send(issues, user):
             continue
 
         # These jobs also update the Result status
-        mobi_job = _create_mobi.delay(issue, result=result)
-        send_mobi.delay(issue, user, depends_on=mobi_job)
+        mobi_job = _create_mobi.delay(issue, result=result, device=device)
+        send_mobi.delay(issue, user, device=device, depends_on=mobi_job)
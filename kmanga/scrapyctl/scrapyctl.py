@@ -1,3 +1,4 @@
+from datetime import date
 import logging
 import logging.handlers
 import os
@@ -5,6 +6,7 @@ import os
 from django.conf import settings
 from django_rq import job
 
+from core.models import Source
 from mobi.cache import IssueCache
 from scrapy import signals
 from scrapy.crawler import CrawlerProcess
@@ -122,16 +124,26 @@ class ScrapyCtl(object):
         self._update(spiders, 'collection', manga=manga, url=url,
                      dry_run=dry_run)
 
-    def update_latest(self, spiders, until, dry_run=False):
-        """Launch the scraper to update the latest issues."""
+    def update_latest(self, spiders, until=None, dry_run=False):
+        """Launch the scraper to update the latest issues.
+
+        If `until` is None, every spider will stop at the release date
+        of the last issue seen in the previous update.
+
+        """
+        marks = {}
+        if not until:
+            marks = dict(Source.objects.filter(
+                spider__in=spiders).values_list('spider', 'latest_release'))
         for spider in spiders:
+            _until = until or marks.get(spider) or date.today()
             if spider in self.accounts:
                 username, password = self.accounts[spider]
             else:
                 username, password = None, None
 
             kwargs = {
-                'latest': until.strftime('%d-%m-%Y'),
+                'latest': _until.strftime('%d-%m-%Y'),
                 'username': username,
                 'password': password,
             }
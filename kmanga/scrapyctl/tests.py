@@ -10,7 +10,10 @@ from core.models import Manga
 from core.models import Source
 # from registration.models import UserProfile
 from scrapyctl.management.commands.scrapy import Command
+from mobi import DEVICES
+from scrapyctl.mobictl import MobiCtl
 from scrapyctl.mobictl import MobiInfo
+from scrapyctl.mobictl import create_mobi_and_send
 from scrapyctl.scrapyctl import ScrapyCtl
 
 
@@ -232,6 +235,27 @@ class CommandTestCase(TestCase):
         scrapyctl.update_latest.assert_called_once_with(
             self.all_spiders, until, False)
 
+    def test_update_latest_high_water_mark(self):
+        """Test that `update_latest` starts from the last release."""
+        Source.objects.filter(spider='source1').update(
+            latest_release=date(year=2015, month=1, day=1),
+            latest_url='http://source1.com/manga1/issue1')
+        self.scrapy.process = Mock()
+        self.scrapy.update_latest(['source1', 'source2'])
+        calls = self.scrapy.process.crawl.call_args_list
+        self.assertEqual(calls[0][0][0], 'source1')
+        self.assertEqual(calls[0][1]['latest'], '01-01-2015')
+        self.assertEqual(calls[1][0][0], 'source2')
+        self.assertEqual(calls[1][1]['latest'],
+                         date.today().strftime('%d-%m-%Y'))
+
+        # An explicit date has precedence
+        self.scrapy.process.reset_mock()
+        self.scrapy.update_latest(['source1'],
+                                  date(year=2014, month=1, day=1))
+        self.assertEqual(
+            self.scrapy.process.crawl.call_args[1]['latest'], '01-01-2014')
+
     @patch.object(Command, 'search')
     def test_handle_search(self, search):
         """Test the `search` handle method."""
@@ -351,6 +375,36 @@ class CommandTestCase(TestCase):
 
 class MobiCtlTestCase(TestCase):
 
+    @patch('scrapyctl.mobictl.MobiCache')
+    def test_create_mobi_device(self, mobicache):
+        """Test that the MOBI is created and cached per device."""
+        cache = MagicMock()
+        cache.__contains__.return_value = True
+        cache.__getitem__.return_value = ([('mobi', 'path')], None)
+        mobicache.return_value = cache
+        mobicache.key.return_value = 'url|kindle'
+
+        issue = Mock(url='url')
+        mobictl = MobiCtl(issue, [], 'images', device='kindle')
+        self.assertIs(mobictl.profile, DEVICES['kindle'])
+        self.assertEqual(mobictl.create_mobi(), [('mobi', 'path')])
+        mobicache.key.assert_called_with('url', 'kindle')
+        cache.__getitem__.assert_called_with('url|kindle')
+
+    @patch('scrapyctl.mobictl.send_mobi')
+    @patch('scrapyctl.mobictl._create_mobi')
+    @patch('scrapyctl.mobictl.Result')
+    def test_create_mobi_and_send_device(self, result, create_mobi,
+                                         send_mobi):
+        """Test that the MOBI is sent for the device used to create it."""
+        issue = Mock(id=1)
+        result.objects.transition.return_value = [Mock(issue_id=1)]
+        user = Mock()
+        user.userprofile.device = 'kindle'
+        create_mobi_and_send(issues=[issue], user=user)
+        self.assertEqual(create_mobi.delay.call_args[1]['device'], 'kindle')
+        self.assertEqual(send_mobi.delay.call_args[1]['device'], 'kindle')
+
     def test_info_title(self):
         """Test the Info._title() method."""
         issue = Mock()
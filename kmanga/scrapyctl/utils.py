@@ -10,8 +10,7 @@ from scrapyctl.scrapyctl import scrape_issues_slow
 def send(issues, user, accounts=None, loglevel=logging.WARNING):
     """Send a list of issues to an user."""
 
-    for issue in issues:
-        issue.create_result_if_needed(user, Result.PROCESSING)
+    Result.objects.transition(issues, user, Result.PROCESSING)
 
     # Split the issues in `fast` (direct access) and `slow` (needs proxy)
     fast_issues = [i for i in issues if not needs_proxy(i.manga.source.spider)]
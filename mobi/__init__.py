@@ -18,4 +18,7 @@
 # along with KManga.  If not, see <http://www.gnu.org/licenses/>.
 
 from .mobi import Container
+from .mobi import DEVICES
+from .mobi import GENERIC
 from .mobi import MangaMobi
+from .mobi import Profile
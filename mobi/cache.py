@@ -252,10 +252,12 @@ class MobiCache(Cache):
     This cache avoid the creation of new MOBI documents previously
     created.
 
-    The `key` is expected to be an URL, and the value assigned is
-    expected to be a list of MOBI file paths.
+    The `key` is expected to be an URL and the name of the device
+    profile (see `MobiCache.key`), so there is a variant of the MOBI
+    for every device, and the value assigned is expected to be a list
+    of MOBI file paths.
 
-    key = 'url'
+    key = 'url|device'
     value = [
         'tests/fixtures/cache/mobi1.1.mobi',
         'tests/fixtures/cache/mobi1.2.mobi'
@@ -284,6 +286,29 @@ class MobiCache(Cache):
         if not os.path.exists(self.data):
             os.makedirs(self.data)
 
+    @staticmethod
+    def key(url, device):
+        """Return the key of the MOBI of an URL for a device."""
+        return '%s|%s' % (url, device)
+
+    @staticmethod
+    def split_key(key):
+        """Return the URL and the device of a key.
+
+        The entries stored before the device profiles have no device,
+        and None is returned for it.
+
+        """
+        url, sep, device = key.rpartition('|')
+        return (url, device) if sep else (key, None)
+
+    def remove(self, url):
+        """Remove the MOBI of an URL for all the devices."""
+        with DB(self.cache):
+            prefix = self.key(url, '')
+            for key in [k for k in self if k.startswith(prefix)]:
+                del self[key]
+
     def __data_file(self, key):
         """Return the full path of the data file."""
         # hashlib.md5 do not accept unicode
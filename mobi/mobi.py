@@ -124,6 +124,73 @@ html{color:#000;background:#FFF;}body,div,dl,dt,dd,ul,ol,li,h1,h2,h3,h4,h5,h6,pr
 """
 
 
+class Profile(object):
+    """Encoding profile for the images of a container.
+
+    The images are converted to grayscale and reduced to the device
+    resolution.  The JPEG images are stored with `quality` and
+    optimized Huffman tables, and the PNG images are quantized to the
+    `colors` grey levels of the device and stored as a palette.
+
+    """
+    def __init__(self, width=WIDTH, height=HEIGHT, colors=16, quality=80,
+                 optimize=True, size_limit=None):
+        self.width = width
+        self.height = height
+        self.colors = colors
+        self.quality = quality
+        self.optimize = optimize
+        # Maximum size of the images of a volume, in bytes
+        self.size_limit = size_limit
+
+    def encode(self, img):
+        """Convert an image to grayscale and reduce it to the page."""
+        changed = False
+        if img.mode in ('RGBA', 'LA', 'P'):
+            img = img.convert('RGBA')
+            background = Image.new('RGBA', img.size, '#ffffff')
+            background.paste(img, img)
+            img = background
+        if img.mode != 'L':
+            img = img.convert('L')
+            changed = True
+        width, height = img.size
+        if width > self.width or height > self.height:
+            ratio = min(self.width/width, self.height/height)
+            width, height = int(ratio*width+0.5), int(ratio*height+0.5)
+            img = img.resize((width, height), Image.ANTIALIAS)
+            changed = True
+        return img, changed
+
+    def save(self, img, path):
+        """Store an image encoded for the device."""
+        if path.endswith('.png') and self.colors:
+            # Levels of grey in the palette, as indexes of the palette
+            colors = self.colors - 1
+            img = img.point(lambda x: (x * colors + 127) // 255)
+            img = img.convert('P')
+            img.putpalette([i * 255 // colors for i in range(colors + 1)
+                            for _ in range(3)])
+            bits = max(1, colors.bit_length())
+            img.save(path, optimize=self.optimize,
+                     bits=bits if bits in (1, 2, 4) else 8)
+        else:
+            # The quantization of the levels of grey do not reduce
+            # the size of JPEG images
+            img.save(path, quality=self.quality, optimize=self.optimize)
+
+
+# Device profiles, by name
+GENERIC = 'generic'
+DEVICES = {
+    GENERIC: Profile(),
+    'kindle': Profile(width=600, height=800),
+    'paperwhite': Profile(width=1072, height=1448),
+    'oasis': Profile(width=1264, height=1680),
+    'scribe': Profile(width=1860, height=2480),
+}
+
+
 class Container(object):
     # Values for 'adjust' parameter
     RESIZE = 'resize'
@@ -138,8 +205,12 @@ class Container(object):
     MIN_MARGIN = 0.01
     MAX_MARGIN = 0.2
 
-    def __init__(self, path):
+    def __init__(self, path, profile=None):
         self.path = path
+        # If there is a profile, the images are encoded for the device
+        self.profile = profile
+        self.width = profile.width if profile else WIDTH
+        self.height = profile.height if profile else HEIGHT
         self.has_cover = False
         # Store information about images.  This information can be
         # recreated from the container.
@@ -163,8 +234,15 @@ class Container(object):
         """Remove the container directoy and all the content."""
         shutil.rmtree(self.path)
 
-    def add_image(self, image, adjust=None, _filter=None, as_link=False):
-        """Add an image into the container."""
+    def add_image(self, image, adjust=None, _filter=None, as_link=False,
+                  bbox=None):
+        """Add an image into the container.
+
+        If `bbox` is not None, is used as the bounding box of the
+        image without margins (see `margin_bbox`), so the image is not
+        analyzed again.
+
+        """
         order = self._npages
         img_dir = os.path.join(self.path, 'images')
         img_name = '%03d%s' % (order, os.path.splitext(image)[1])
@@ -178,21 +256,39 @@ class Container(object):
             img_dst, img_dst_ext = os.path.splitext(img_dst)
             img_dst = '%s_%s%s' % (img_dst, adjust, img_dst_ext)
 
+            # The bounding box follows the rotation of the image, but
+            # is not valid for the rest of adjustments
+            if bbox and adjust == Container.ROTATE:
+                left, top, right, bottom = bbox
+                # The width of the rotated image is the original height
+                height = img.size[0]
+                bbox = (height - bottom, left, height - top, right)
+            else:
+                bbox = None
+
         # Remove the margin and/or the footer.  First we check for the
         # footer filter, and we apply the margin filter to the result.
-        #
-        # XXX TODO - If one of the filter is called, we consider the
-        # image adjusted (changed), event if the bounding box was
-        # exactly the full image (so not change)
+        # If the bounding box is exactly the full image, the image is
+        # not changed.
         if _filter and _filter & Container.FILTER_FOOTER:
             img = self.filter_footer(img)
             adjusted = True
+            bbox = None
         if _filter and _filter & Container.FILTER_MARGIN:
-            img = self.filter_margin(img)
-            adjusted = True
+            bbox = bbox or self.margin_bbox(img)
+            if bbox and tuple(bbox) != (0, 0) + img.size:
+                img = img.crop(bbox)
+                adjusted = True
+
+        if self.profile:
+            img, changed = self.profile.encode(img)
+            # PNG images are always quantized
+            adjusted = adjusted or changed or img_dst.endswith('.png')
 
         if as_link and not adjusted:
             os.link(image, img_dst)
+        elif adjusted and self.profile:
+            self.profile.save(img, img_dst)
         elif adjusted:
             img.save(img_dst)
         else:
@@ -200,11 +296,13 @@ class Container(object):
         self._npages += 1
         self._image_info = []
 
-    def add_images(self, images, adjust=None, _filter=None, as_link=False):
+    def add_images(self, images, adjust=None, _filter=None, as_link=False,
+                   bboxes=None):
         """Add a list of images into the container."""
-        for image in images:
+        bboxes = bboxes if bboxes else [None] * len(images)
+        for image, bbox in zip(images, bboxes):
             self.add_image(image, adjust=adjust, _filter=_filter,
-                           as_link=as_link)
+                           as_link=as_link, bbox=bbox)
 
     def set_image_adjust(self, number, adjust):
         """Set the adjustment postfix in a image."""
@@ -350,11 +448,11 @@ class Container(object):
             # RESIZE adjust the longest size of the image to size of a
             # page. The net result is:
             #
-            #   new_width <= WIDTH
-            #   new_height <= HEIGHT
+            #   new_width <= self.width
+            #   new_height <= self.height
             #
             width, height = img.size
-            ratio = min(WIDTH/width, HEIGHT/height)
+            ratio = min(self.width/width, self.height/height)
             width, height = int(ratio*width+0.5), int(ratio*height+0.5)
             resample = Image.BICUBIC if ratio > 1 else Image.ANTIALIAS
             img = img.resize((width, height), resample)
@@ -369,14 +467,14 @@ class Container(object):
 
             # Resize the current image
             width, height = size
-            ratio = min(WIDTH/width, HEIGHT/height)
+            ratio = min(self.width/width, self.height/height)
             width, height = int(ratio*width+0.5), int(ratio*height+0.5)
             resample = Image.BICUBIC if ratio > 1 else Image.ANTIALIAS
             resized_img = img.resize((width, height), resample)
 
             # Create a new white image and paste the resized image
-            x, y = (WIDTH - width) // 2, (HEIGHT - height) // 2
-            img = Image.new(mode, (WIDTH, HEIGHT), '#ffffff')
+            x, y = (self.width - width) // 2, (self.height - height) // 2
+            img = Image.new(mode, (self.width, self.height), '#ffffff')
             img.paste(resized_img, (x, y))
             adjusted = True
         elif adjust == Container.ROTATE:
@@ -394,12 +492,13 @@ class Container(object):
 
         return img, adjusted
 
-    def bbox(self, img):
+    @classmethod
+    def bbox(cls, img):
         """Return the bounding box of an image inside some ranges."""
-        margin = Container.MIN_MARGIN / 2
+        margin = cls.MIN_MARGIN / 2
         min_margin = [int(margin*i+0.5) for i in img.size]
 
-        margin = Container.MAX_MARGIN / 2
+        margin = cls.MAX_MARGIN / 2
         max_margin = [int(margin*i+0.5) for i in img.size]
 
         bbox = img.getbbox()
@@ -447,14 +546,20 @@ class Container(object):
         # If the image is white, we do not have bbox
         return img.crop(_img.getbbox()) if _img.getbbox() else img
 
-    def filter_margin(self, img):
-        """Filter to remove empty margins in an image."""
+    @classmethod
+    def margin_bbox(cls, img):
+        """Return the bounding box without the empty margins, or None."""
         # This filter is based on a simple Gaussian with a threshold
         _img = ImageOps.invert(img.convert(mode='L'))
         _img = _img.filter(ImageFilter.GaussianBlur(radius=3))
         _img = _img.point(lambda x: (x >= 16) and x)
         # If the image is white, we do not have bbox
-        return img.crop(self.bbox(_img)) if _img.getbbox() else img
+        return cls.bbox(_img) if _img.getbbox() else None
+
+    def filter_margin(self, img):
+        """Filter to remove empty margins in an image."""
+        bbox = self.margin_bbox(img)
+        return img.crop(bbox) if bbox else img
 
     def split(self, size, clean=False):
         """Split the container in volumes of same size."""
@@ -462,7 +567,7 @@ class Container(object):
         nvolumes = 1 + current_size // size
         volume_size = 1 + current_size // nvolumes
 
-        containers = [Container('%s_V%02d' % (self.path, i+1))
+        containers = [Container('%s_V%02d' % (self.path, i+1), self.profile)
                       for i in range(nvolumes)]
         images = self.get_image_info()
         containers_used, begin = 0, 0
@@ -496,6 +601,9 @@ class MangaMobi(object):
         self.container = container
         self.info = info
         self.kindlegen = kindlegen if kindlegen else KINDLEGEN
+        # The resolution of the device comes from the container
+        self.width = container.width
+        self.height = container.height
 
     def create(self):
         """Create the mobi file calling kindlegen."""
@@ -535,7 +643,7 @@ class MangaMobi(object):
             ('fixed-layout', 'true'),
             ('orientation-lock', 'none'),
             # XXX TODO - Detect the original resolution
-            ('original-resolution', '%dx%d' % (WIDTH, HEIGHT)),
+            ('original-resolution', '%dx%d' % (self.width, self.height)),
             # This is decided by KindleGen
             # ('RegionMagnification', 'true'),
             ('book-type', 'comic'),
@@ -677,7 +785,7 @@ class MangaMobi(object):
 
     def _img_scaled_size(self, size, scale=1.0):
         width, height = size
-        ratio = min(WIDTH/width, HEIGHT/height)
+        ratio = min(self.width/width, self.height/height)
         width, height = int(scale*ratio*width+0.5), int(scale*ratio*height+0.5)
         return width, height
 
@@ -688,8 +796,10 @@ class MangaMobi(object):
 
     def _img_style_margin(self, size):
         width, height = self._img_scaled_size(size)
-        mtop, mleft = (HEIGHT - height) // 2, (WIDTH - width) // 2
-        mbottom, mright = (HEIGHT - height) - mtop, (WIDTH - width) - mleft
+        mtop = (self.height - height) // 2
+        mleft = (self.width - width) // 2
+        mbottom = (self.height - height) - mtop
+        mright = (self.width - width) - mleft
         style = 'margin-top:%dpx;margin-bottom:%dpx;' % (mtop, mbottom)
         style += 'margin-left:%dpx;margin-right:%dpx;' % (mleft, mright)
         return style
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+#
+# (c) 2018 Alberto Planas <aplanas@gmail.com>
+#
+# This file is part of KManga.
+#
+# KManga is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# KManga is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with KManga.  If not, see <http://www.gnu.org/licenses/>.
+
+# Lazy access to the KManga models from the scraper.
+#
+# Django is configured the first time that one of the models is used,
+# so the commands and crawls that do not touch the database (like
+# `scrapy list` or `scrapy check`) do not load the full application
+# registry.
+
+import importlib
+import threading
+
+from django.apps import apps
+
+_lock = threading.Lock()
+
+
+def setup():
+    """Configure Django, if was not configured before."""
+    if not apps.ready:
+        with _lock:
+            if not apps.ready:
+                import django
+                django.setup()
+
+
+class LazyModel(object):
+    """Reference to a Django model that is imported on first use."""
+
+    def __init__(self, module, name):
+        self._module = module
+        self._name = name
+        self._model = None
+
+    def _resolve(self):
+        if self._model is None:
+            setup()
+            module = importlib.import_module(self._module)
+            self._model = getattr(module, self._name)
+        return self._model
+
+    def __getattr__(self, attr):
+        return getattr(self._resolve(), attr)
+
+    def __call__(self, *args, **kwargs):
+        return self._resolve()(*args, **kwargs)
+
+    def __repr__(self):
+        return '<LazyModel %s.%s>' % (self._module, self._name)
+
+
+Issue = LazyModel('core.models', 'Issue')
+Manga = LazyModel('core.models', 'Manga')
+Source = LazyModel('core.models', 'Source')
+Proxy = LazyModel('proxy.models', 'Proxy')
@@ -17,20 +17,35 @@
 # You should have received a copy of the GNU General Public License
 # along with KManga.  If not, see <http://www.gnu.org/licenses/>.
 
+import email.utils
+import gzip
+import hashlib
+import http.cookies
 import logging
+import os
 import os.path
+import pickle
+import random
 import re
 import time
 import urllib.parse
 
+from django.utils import timezone
 import scrapy
+from scrapy import signals
+from scrapy.exceptions import IgnoreRequest
+from scrapy.http import Headers
+from scrapy.responsetypes import responsetypes
 from spidermonkey import Spidermonkey
+from twisted.internet import reactor
+from twisted.internet import task
+from twisted.internet import threads
+from w3lib.url import canonicalize_url
 
-import django
-django.setup()
-
-from proxy.models import Proxy
 from proxy.utils import needs_proxy
+from scraper.db import Manga
+from scraper.db import Proxy
+from scraper.pipelines.updatedb import item_fingerprint
 
 logger = logging.getLogger(__name__)
 
@@ -60,6 +75,69 @@ class RetryPartial(object):
         return response
 
 
+class ProxyPool(object):
+    """In-memory pool of proxies for a spider.
+
+    The proxies are selected randomly, weighted by the success rate
+    observed during the crawl.  The failures are buffered and written
+    in the database every `flush_interval` seconds, and when the pool
+    is closed.
+
+    """
+    def __init__(self, spider, flush_interval=60):
+        self.spider = spider
+        self.flush_interval = flush_interval
+        self.load()
+
+    def load(self):
+        """Load the proxies of the spider from the database."""
+        proxies = Proxy.objects.filter(
+            source__spider=self.spider).values_list('proxy', 'retry')
+        # For every proxy, store the [successes, failures]
+        self.proxies = {proxy: [0, retry] for proxy, retry in proxies}
+        self.failures = {}
+        self.last_flush = time.time()
+
+    def __len__(self):
+        return len(self.proxies)
+
+    def get(self):
+        """Return one proxy, or None if the pool is empty."""
+        if not self.proxies:
+            # Maybe there are new proxies in the database
+            self.flush()
+            self.load()
+        if not self.proxies:
+            return None
+        proxies = list(self.proxies)
+        # Laplace smoothing, so a new proxy has a weight of 1/2
+        weights = [(s + 1) / (s + f + 2)
+                   for s, f in (self.proxies[p] for p in proxies)]
+        return random.choices(proxies, weights)[0]
+
+    def success(self, proxy):
+        """Register a successful response from a proxy."""
+        if proxy in self.proxies:
+            self.proxies[proxy][0] += 1
+
+    def failure(self, proxy):
+        """Register a failure, and discard the proxy if needed."""
+        self.failures[proxy] = self.failures.get(proxy, 0) + 1
+        if proxy in self.proxies:
+            self.proxies[proxy][1] += 1
+            if self.proxies[proxy][1] > Proxy.RETRY:
+                del self.proxies[proxy]
+        if time.time() - self.last_flush > self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        """Write the buffered failures in the database."""
+        if self.failures:
+            Proxy.objects.discard_many(self.failures, self.spider)
+            self.failures = {}
+        self.last_flush = time.time()
+
+
 class SmartProxy(object):
     """Middleware to add a proxy to certain requests."""
     def __init__(self, settings):
@@ -69,10 +147,34 @@ class SmartProxy(object):
         self.retry_error_codes = {
             int(x) for x in settings.getlist('RETRY_HTTP_CODES')
         }
+        self.flush_interval = settings.getfloat(
+            'SMART_PROXY_FLUSH_INTERVAL', 60)
+        self.pools = {}
 
     @classmethod
     def from_crawler(cls, crawler):
-        return cls(crawler.settings)
+        middleware = cls(crawler.settings)
+        crawler.signals.connect(middleware.spider_opened,
+                                signal=signals.spider_opened)
+        crawler.signals.connect(middleware.spider_closed,
+                                signal=signals.spider_closed)
+        return middleware
+
+    def spider_opened(self, spider):
+        if needs_proxy(spider.name):
+            self._pool(spider)
+
+    def spider_closed(self, spider):
+        pool = self.pools.pop(spider.name, None)
+        if pool:
+            pool.flush()
+
+    def _pool(self, spider):
+        """Return the proxy pool of a spider, loading it if needed."""
+        if spider.name not in self.pools:
+            self.pools[spider.name] = ProxyPool(spider.name,
+                                                self.flush_interval)
+        return self.pools[spider.name]
 
     def process_request(self, request, spider):
         # The proxy only works if the request comes from a spider that
@@ -91,10 +193,10 @@ class SmartProxy(object):
             return
 
         if needs_proxy(spider.name):
-            proxy = Proxy.objects.get_one(spider.name)
+            proxy = self._pool(spider).get()
             if proxy:
                 logger.info('Using proxy <%s> for request' % proxy)
-                request.meta['proxy'] = 'http://%s' % proxy.proxy
+                request.meta['proxy'] = 'http://%s' % proxy
                 # Disable redirection when a proxy is in use
                 request.meta['dont_redirect'] = True
             else:
@@ -137,6 +239,9 @@ class SmartProxy(object):
                                      response.status))
                     self._map_status_error(response)
                     self._delete_proxy_from_request(request, spider)
+            elif spider.name in self.pools:
+                proxy = request.meta['proxy'].lstrip('htp:/')
+                self.pools[spider.name].success(proxy)
         return response
 
     def process_exception(self, request, exception, spider):
@@ -158,9 +263,10 @@ class SmartProxy(object):
     def _delete_proxy_from_request(self, request, spider):
         proxy = request.meta['proxy'].lstrip('htp:/')
         del request.meta['proxy']
-        Proxy.objects.discard(proxy, spider.name)
+        pool = self._pool(spider)
+        pool.failure(proxy)
         logger.warning('Removing failed proxy <%s>, %d proxies left' % (
-            proxy, Proxy.objects.remainings(spider=spider.name)))
+            proxy, len(pool)))
 
     def _valid_redirect(self, status, url_from, url_to):
         """Implement some heuristics to detect valid redirections."""
@@ -182,53 +288,151 @@ class SmartProxy(object):
 
 
 class VHost(object):
-    """Middleware to replace the host name with the IP."""
+    """Middleware to replace the host name with the IP.
+
+    The patterns for the allowed domains and for the IP are compiled
+    once per spider, and only match the host part at the beginning of
+    the URL.  The rewritten requests are marked in the meta with the
+    original host, used to restore the URL of the response.
+
+    """
+    HOST_RE = r'^(https?://)%s(:\d+)?(?=[/?#]|$)'
+
+    def __init__(self):
+        self.hosts = {}
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        middleware = cls()
+        crawler.signals.connect(middleware.spider_opened,
+                                signal=signals.spider_opened)
+        return middleware
+
+    def spider_opened(self, spider):
+        if hasattr(spider, 'vhost_ip'):
+            domains = '|'.join(re.escape(d) for d in spider.allowed_domains)
+            domains = r'(?:www\.)?(%s)' % domains
+            ip = '(%s)' % re.escape(spider.vhost_ip)
+            self.hosts[spider.name] = (
+                re.compile(self.HOST_RE % domains, re.IGNORECASE),
+                re.compile(self.HOST_RE % ip),
+            )
+
+    def _hosts(self, spider):
+        """Return the compiled domain and IP patterns of a spider."""
+        if spider.name not in self.hosts:
+            self.spider_opened(spider)
+        return self.hosts[spider.name]
+
+    def _replace_host(self, url, match, host):
+        """Replace the host matched in the URL, keeping the port."""
+        scheme, _, port = match.groups()
+        return ''.join((scheme, host, port or '', url[match.end():]))
 
     def process_request(self, request, spider):
         """Replace the host name with the IP."""
-        if hasattr(spider, 'vhost_ip'):
-            for domain in spider.allowed_domains:
-                ip = spider.vhost_ip
-                url = re.sub(r'(www.)?%s' % domain, ip, request.url)
-                # During the second pass, both URL are the same (there
-                # is not replacement)
-                if request.url != url:
-                    request = request.replace(url=url,
-                                              headers={'Host': domain})
-                    return request
+        if not hasattr(spider, 'vhost_ip'):
+            return
+
+        # During the second pass the request is already rewritten.
+        # The meta is copied in the redirections, so only the URL
+        # can tell if the request uses the IP.
+        domains, ip = self._hosts(spider)
+        if ip.match(request.url):
+            return
+        match = domains.match(request.url)
+        if match:
+            domain = match.group(2).lower()
+            url = self._replace_host(request.url, match, spider.vhost_ip)
+            request = request.replace(url=url, headers={'Host': domain})
+            request.meta['vhost'] = domain
+            return request
 
     def process_response(self, request, response, spider):
         """Replace back the IP with the host name."""
         if hasattr(spider, 'vhost_ip'):
-            headers = request.headers.to_unicode_dict()
-            domain = headers.get('Host', spider.allowed_domains[0])
-            ip = spider.vhost_ip
-            url = re.sub(ip, domain, response.url)
-            response = response.replace(url=url)
+            _, ip = self._hosts(spider)
+            match = ip.match(response.url)
+            if match:
+                domain = spider.allowed_domains[0]
+                domain = request.meta.get('vhost', domain)
+                url = self._replace_host(response.url, match, domain)
+                response = response.replace(url=url)
         return response
 
 
 class CloudFlare(object):
-    """Middleware to bypass the CloudFlare protection."""
+    """Middleware to bypass the CloudFlare protection.
+
+    The challenge is resolved in a thread, and the answer is sent
+    after the delay required by CloudFlare, without blocking the
+    reactor.  The clearance cookies are shared by all the crawlers of
+    the process, and reused until they expire.
+
+    """
+    # Seconds that CloudFlare expects before receiving the answer
+    DELAY = 4
+    # Lifetime of a clearance cookie without expiration date
+    CLEARANCE_TTL = 3600
+    CLEARANCE_COOKIES = ('cf_clearance', '__cfduid')
+
+    # Clearance cookies per domain: {domain: (cookies, expiration)}
+    clearance = {}
+
+    def process_request(self, request, spider):
+        """Add the clearance cookies of the domain, if any."""
+        if getattr(spider, 'cloudflare', False) and \
+           isinstance(request.cookies, dict):
+            domain = spider.allowed_domains[0]
+            cookies, expiration = self.clearance.get(domain, ({}, 0))
+            if expiration > time.time():
+                for name, value in cookies.items():
+                    request.cookies.setdefault(name, value)
 
     def process_response(self, request, response, spider):
         """Resolve the CloudFlare challenge."""
         request_response = response
-        if hasattr(spider, 'cloudflare') and spider.cloudflare:
-            if response.status == 503 and response.headers['Server']:
+        if getattr(spider, 'cloudflare', False):
+            self._store_clearance(response, spider)
+            # We resolve it once per request
+            is_answer = request.meta.get('cloudflare', False)
+            if response.status == 503 and response.headers.get('Server') \
+               and not is_answer:
                 logger.debug('CloudFlare challenge detected')
                 request_response = self._cloudflare(request, response, spider)
-            # We resolve it once per request
-            spider.cloudflare = False
         return request_response
 
+    def _store_clearance(self, response, spider):
+        """Store the clearance cookies sent by CloudFlare."""
+        cookies, expiration = {}, time.time() + self.CLEARANCE_TTL
+        for header in response.headers.getlist('Set-Cookie'):
+            cookie = http.cookies.SimpleCookie()
+            try:
+                cookie.load(header.decode('latin-1'))
+            except http.cookies.CookieError:
+                continue
+            for name, morsel in cookie.items():
+                if name not in self.CLEARANCE_COOKIES:
+                    continue
+                cookies[name] = morsel.value
+                if name == 'cf_clearance' and morsel['expires']:
+                    expires = email.utils.parsedate_tz(morsel['expires'])
+                    if expires:
+                        expiration = email.utils.mktime_tz(expires)
+        if 'cf_clearance' in cookies:
+            domain = spider.allowed_domains[0]
+            self.clearance[domain] = (cookies, expiration)
+
+    def _solve(self, init, challenge, variable, domain):
+        """Evaluate the JavaScript challenge, called in a thread."""
+        result = 'print((%s+%s).toFixed(10))' % (variable, len(domain))
+        code = (init, challenge)
+        proc = Spidermonkey(early_script_file='-', code=code)
+        stdout, stderr = proc.communicate(result)
+        return stdout.strip()
+
     def _cloudflare(self, request, response, spider):
         """Resolve the CloudFlare challenge."""
-        # Extract the URL from the form
-        xp = '//form/@action'
-        url = response.xpath(xp).extract_first()
-        url = response.urljoin(url)
-
         domain = spider.allowed_domains[0]
 
         # Extract the parameters from the form
@@ -237,34 +441,219 @@ class CloudFlare(object):
         xp = '//form/input[@name="pass"]/@value'
         pass_ = response.xpath(xp).extract_first()
 
-        if jschl_vc and pass_:
-            # Extract the JavaScript snippets that can be evaluated
-            xp = '//script/text()'
-            init = response.xpath(xp).re_first(r'var s,t,o,p.*')
-            challenge = response.xpath(xp).re_first(r'(.*;)a.value')
-            variable = response.xpath(xp).re_first(r'\s+;(\w+\.\w+).=')
-            result = 'print((%s+%s).toFixed(10))' % (variable, len(domain))
-            code = (init, challenge)
-            proc = Spidermonkey(early_script_file='-', code=code)
-            stdout, stderr = proc.communicate(result)
-            jschl_answer = stdout.strip()
-            logger.debug('Challenge response: %s', jschl_answer)
+        if not (jschl_vc and pass_):
+            # The challenge changed and the code is outdated
+            logger.error('CloudFlare challenge changed. Please update')
+            return response
 
+        # Extract the JavaScript snippets that can be evaluated
+        xp = '//script/text()'
+        init = response.xpath(xp).re_first(r'var s,t,o,p.*')
+        challenge = response.xpath(xp).re_first(r'(.*;)a.value')
+        variable = response.xpath(xp).re_first(r'\s+;(\w+\.\w+).=')
+        start = time.time()
+
+        def _request(jschl_answer):
+            logger.debug('Challenge response: %s', jschl_answer)
             # Generate the new request
             formdata = {
                 'jschl_vc': jschl_vc,
                 'pass': pass_,
                 'jschl_answer': jschl_answer,
             }
-            original_url = request.url
-            request = scrapy.FormRequest.from_response(
+            new_request = scrapy.FormRequest.from_response(
                 response, formdata=formdata)
-            request.headers['Referer'] = original_url
-            # XXX TODO - Is there a way to delay this single request?
-            time.sleep(4)
-            return request
-        else:
-            # The challenge changed and the code is outdated
-            logger.error('CloudFlare challenge changed. Please update')
+            new_request.headers['Referer'] = request.url
+            new_request.meta['cloudflare'] = True
+            # Send the answer after the delay, without blocking
+            delay = max(0, self.DELAY - (time.time() - start))
+            return task.deferLater(reactor, delay, lambda: new_request)
+
+        def _error(failure):
+            logger.error('Error resolving the CloudFlare challenge: %s' % (
+                failure.getErrorMessage()))
+            return response
+
+        d = threads.deferToThread(self._solve, init, challenge, variable,
+                                  domain)
+        d.addCallback(_request)
+        d.addErrback(_error)
+        return d
+
+
+class SmartCache(object):
+    """Middleware to cache the catalog and collection pages.
+
+    The pages parsed by `parse_catalog` and `parse_collection` are
+    stored compressed in disk, keyed by the canonical URL.  A cached
+    page is used without download during the TTL configured for the
+    spider operation, and after that the page is re-validated with a
+    conditional request (ETag and Last-Modified).
+
+    If the content of a collection page (and the item populated by
+    the catalog, if any) did not change since the last crawl, the
+    request is ignored, so the page is not parsed and the database is
+    not updated.  The last crawl is recorded only when the item of
+    the page is scraped (stored by the pipelines), and the page is
+    ignored only if the manga is still in the database with the same
+    fingerprint.
+
+    """
+    CALLBACKS = {
+        'parse_catalog': 'catalog',
+        'parse_collection': 'collection',
+    }
+
+    def __init__(self, settings, stats):
+        self.path = settings.get('SMART_CACHE_DIR')
+        self.ttl = settings.getdict('SMART_CACHE_TTL')
+        self.stats = stats
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        middleware = cls(crawler.settings, crawler.stats)
+        crawler.signals.connect(middleware.item_scraped,
+                                signal=signals.item_scraped)
+        return middleware
+
+    def _kind(self, request, spider):
+        """Return the kind of page (catalog or collection), if any."""
+        operation = getattr(spider, '_operation', None)
+        if operation not in self.ttl or request.method != 'GET' or \
+           request.meta.get('dont_cache'):
+            return
+        if request.callback is None:
+            return operation if operation in self.CALLBACKS.values() \
+                else None
+        return self.CALLBACKS.get(getattr(request.callback, '__name__', None))
+
+    def _path(self, request, spider):
+        key = hashlib.sha1(
+            canonicalize_url(request.url).encode('utf-8')).hexdigest()
+        return os.path.join(self.path, spider.name, key[:2], key)
+
+    def _digest(self, request, body):
+        """Hash of the body and of the pre-populated item."""
+        digest = hashlib.sha1(body)
+        if 'manga' in request.meta:
+            manga = sorted(dict(request.meta['manga']).items())
+            digest.update(repr(manga).encode('utf-8'))
+        return digest.hexdigest()
+
+    def _load(self, request, spider):
+        try:
+            with open(self._path(request, spider), 'rb') as f:
+                return pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+
+    def _store(self, request, spider, entry):
+        path = self._path(request, spider)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = '%s.tmp' % path
+        with open(tmp, 'wb') as f:
+            pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+
+    def _response(self, request, entry):
+        """Build a response from a cache entry."""
+        headers = Headers(entry['headers'])
+        body = gzip.decompress(entry['body'])
+        respcls = responsetypes.from_args(headers=headers, url=entry['url'],
+                                          body=body)
+        return respcls(url=entry['url'], status=entry['status'],
+                       headers=headers, body=body, request=request,
+                       flags=['cached'])
+
+    def _ignore(self, request, spider, crawled, digest):
+        """Ignore the request of a collection crawled before."""
+        request.meta['smart_cache_digest'] = digest
+        if request.meta['smart_cache'] != 'collection' or \
+           hasattr(spider, 'dry_run') or \
+           not crawled or crawled['digest'] != digest:
+            return
+        # Signalize that the manga is still there, like the pipeline
+        # does for an unchanged item.  If the manga is not found (or
+        # is different) the page is parsed again.
+        if not Manga.objects.filter(
+                url=crawled['url'], source__spider=spider.name.lower(),
+                fingerprint=crawled['fingerprint'],
+        ).update(modified=timezone.now()):
+            return
+        self.stats.inc_value('smartcache/unchanged', spider=spider)
+        logger.debug('Unchanged page - url: %s' % request.url)
+        raise IgnoreRequest('Unchanged page %s' % request.url)
+
+    def item_scraped(self, item, response, spider):
+        """Record the crawl of a collection page."""
+        digest = response.meta.get('smart_cache_digest')
+        if not digest or response.meta['smart_cache'] != 'collection' or \
+           hasattr(spider, 'dry_run'):
+            return
+        entry = self._load(response.request, spider)
+        if not entry:
+            return
+        entry['crawled'] = {
+            'digest': digest,
+            'url': item['url'],
+            'fingerprint': item_fingerprint(item),
+        }
+        self._store(response.request, spider, entry)
+
+    def process_request(self, request, spider):
+        kind = self._kind(request, spider)
+        if not kind:
+            return
+
+        request.meta['smart_cache'] = kind
+        entry = self._load(request, spider)
+        if not entry:
+            self.stats.inc_value('smartcache/miss', spider=spider)
+            return
+
+        if time.time() - entry['time'] < self.ttl[spider._operation]:
+            self.stats.inc_value('smartcache/fresh', spider=spider)
+            response = self._response(request, entry)
+            digest = self._digest(request, response.body)
+            self._ignore(request, spider, entry.get('crawled'), digest)
+            return response
 
+        # Re-validate the page
+        if entry['etag']:
+            request.headers['If-None-Match'] = entry['etag']
+        if entry['last_modified']:
+            request.headers['If-Modified-Since'] = entry['last_modified']
+
+    def process_response(self, request, response, spider):
+        kind = request.meta.get('smart_cache')
+        if not kind or 'cached' in response.flags:
+            return response
+
+        entry = self._load(request, spider)
+        if response.status == 304 and entry:
+            self.stats.inc_value('smartcache/revalidated', spider=spider)
+            response = self._response(request, entry)
+            body = response.body
+        elif response.status == 200:
+            body = response.body
+        else:
+            return response
+
+        digest = self._digest(request, body)
+        crawled = entry.get('crawled') if entry else None
+        self._store(request, spider, {
+            'url': response.url,
+            'status': 200,
+            'headers': {k: v for k, v in response.headers.items()
+                        if k not in (b'Content-Encoding', b'Content-Length')},
+            'body': gzip.compress(body),
+            'digest': digest,
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'time': time.time(),
+            'crawled': crawled,
+        })
+        self.stats.inc_value('smartcache/store', spider=spider)
+
+        self._ignore(request, spider, crawled, digest)
         return response
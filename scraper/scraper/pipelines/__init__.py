@@ -7,6 +7,7 @@
 
 from .clean import *
 from .collector import *
+from .images import *
 from .updatedb import *
 
 # class ScraperPipeline(object):
@@ -20,6 +20,7 @@
 from datetime import date
 from datetime import datetime
 from datetime import timedelta
+import functools
 import logging
 import re
 import urllib.parse
@@ -27,6 +28,8 @@ import urllib.parse
 from scrapy.exceptions import DropItem
 from scrapy.utils.markup import remove_tags, replace_entities
 
+from scraper.items import Genres, Manga, Issue, IssuePage
+
 logger = logging.getLogger(__name__)
 
 # Languages
@@ -41,86 +44,114 @@ LANGUAGES = (GERMAN, ENGLISH, SPANISH, FRENCH, ITALIAN, RUSSIAN,
              PORTUGUESE)
 
 
-def convert_to_date(str_, dmy=False):
-    """Parse humanized dates."""
+# Humanized relative dates.  Each entry is (suffixes, regex, delta,
+# precise), where `delta` converts the number of units into a
+# `timedelta`, and `precise` indicates that the delta needs to be
+# resolved against the current time and not the current day.
+_RELATIVE_DATES = (
+    (('days ago', 'day ago'), re.compile(r'(\d+) days? ago'),
+     lambda n: timedelta(days=n), False),
+    (('hours ago', 'hour ago'), re.compile(r'(\d+) hours? ago'),
+     lambda n: timedelta(hours=n), True),
+    (('minutes ago', 'minute ago'), re.compile(r'(\d+) minutes? ago'),
+     lambda n: timedelta(minutes=n), True),
+    (('weeks ago', 'week ago'), re.compile(r'(\d+) weeks? ago'),
+     lambda n: timedelta(weeks=n), False),
+    (('months ago', 'month ago'), re.compile(r'(\d+) months? ago'),
+     lambda n: timedelta(days=n*30), False),
+    (('years ago', 'year ago'), re.compile(r'(\d+) years? ago'),
+     lambda n: timedelta(days=n*365), False),
+)
+
+# Absolute dates.  Each entry is (regex, format, dmy_format), where
+# `dmy_format` is used instead of `format` when the caller asks for a
+# day-month-year interpretation.
+#
+# The table is ordered by hit frequency in the catalog crawls, but
+# some patterns are prefixes of others: '%d %B %Y - %I:%M %p' needs
+# to be checked before '%d %b %Y', and '%b %d, %Y %H:%M%p' before
+# '%b %d, %Y'.
+_ABSOLUTE_DATES = (
+    (re.compile(r'\d{1,2}/\d{1,2}/\d{4}'), '%m/%d/%Y', '%d/%m/%Y'),
+    (re.compile(r'\w{3} \d{1,2}, \d{4} \d{2}:\d{2}\w{2}'),
+     '%b %d, %Y %H:%M%p', None),
+    (re.compile(r'\w{3} \d{1,2}, \d{4}'), '%b %d, %Y', None),
+    (re.compile(r'\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}\+00:00'),
+     '%Y-%m-%dT%H:%M:%S+00:00', None),
+    (re.compile(r'\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2} UTC'),
+     '%Y-%m-%d %H:%M:%S UTC', None),
+    (re.compile(r'\d{2} \w+ \d{4} - \d{2}:\d{2} \w{2}'),
+     '%d %B %Y - %I:%M %p', None),
+    (re.compile(r'\d{2} \w{3} \d{4}'), '%d %b %Y', None),
+    (re.compile(r'\d{1,2}-\d{1,2}-\d{4}'), '%d-%m-%Y', None),
+)
+
+# Number of absolute dates remembered by `convert_to_date`
+DATE_CACHE_SIZE = 4096
+
+
+def _convert_relative_date(str_, now=None):
+    """Parse humanized relative dates, or return None."""
     if str_.startswith('Today'):
-        return date.today()
+        return now.date() if now else date.today()
     elif str_.startswith('Yesterday'):
-        return date.today() - timedelta(days=1)
+        return (now.date() if now else date.today()) - timedelta(days=1)
     elif str_.endswith('now'):
-        return date.today()
-    elif str_.endswith(('minutes ago', 'minute ago')):
-        minutes = 1
-        try:
-            minutes = int(re.search(r'(\d+) minutes? ago', str_).group(1))
-        except AttributeError:
-            pass
-        return (datetime.now() - timedelta(minutes=minutes)).date()
-    elif str_.endswith(('hours ago', 'hour ago')):
-        hours = 1
-        try:
-            hours = int(re.search(r'(\d+) hours? ago', str_).group(1))
-        except AttributeError:
-            pass
-        return (datetime.now() - timedelta(hours=hours)).date()
-    elif str_.endswith(('days ago', 'day ago')):
-        days = 1
-        try:
-            days = int(re.search(r'(\d+) days? ago', str_).group(1))
-        except AttributeError:
-            pass
-        return date.today() - timedelta(days=days)
-    elif str_.endswith(('weeks ago', 'week ago')):
-        weeks = 1
-        try:
-            weeks = int(re.search(r'(\d+) weeks? ago', str_).group(1))
-        except AttributeError:
-            pass
-        return date.today() - timedelta(weeks=weeks)
-    elif str_.endswith(('months ago', 'month ago')):
-        months = 1
-        try:
-            months = int(re.search(r'(\d+) months? ago', str_).group(1))
-        except AttributeError:
-            pass
-        return date.today() - timedelta(days=months*30)
-    elif str_.endswith(('years ago', 'year ago')):
-        years = 1
-        try:
-            years = int(re.search(r'(\d+) years? ago', str_).group(1))
-        except AttributeError:
-            pass
-        return date.today() - timedelta(days=years*365)
-    elif re.match(r'\d{2} \w+ \d{4} - \d{2}:\d{2} \w{2}', str_):
-        return datetime.strptime(str_, '%d %B %Y - %I:%M %p').date()
-    elif re.match(r'\d{2} \w{3} \d{4}', str_):
-        return datetime.strptime(str_, '%d %b %Y').date()
-    elif re.match(r'\w{3} \d{1,2}, \d{4} \d{2}:\d{2}\w{2}', str_):
-        return datetime.strptime(str_, '%b %d, %Y %H:%M%p').date()
-    elif re.match(r'\w{3} \d{1,2}, \d{4}', str_):
-        return datetime.strptime(str_, '%b %d, %Y').date()
-    elif re.match(r'\d{1,2}-\d{1,2}-\d{4}', str_):
-        return datetime.strptime(str_, '%d-%m-%Y').date()
-    elif re.match(r'\d{1,2}/\d{1,2}/\d{4}', str_):
-        if dmy:
-            return datetime.strptime(str_, '%d/%m/%Y').date()
-        else:
-            return datetime.strptime(str_, '%m/%d/%Y').date()
-    elif re.match(r'\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}\+00:00', str_):
-        return datetime.strptime(str_, '%Y-%m-%dT%H:%M:%S+00:00').date()
-    elif re.match(r'\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2} UTC', str_):
-        return datetime.strptime(str_, '%Y-%m-%d %H:%M:%S UTC').date()
-    else:
-        raise ValueError('Format "%s" not recognized' % str_)
+        return now.date() if now else date.today()
+    elif str_.endswith(' ago'):
+        for suffixes, regex, delta, precise in _RELATIVE_DATES:
+            if str_.endswith(suffixes):
+                match = regex.search(str_)
+                units = int(match.group(1)) if match else 1
+                if precise:
+                    base = now if now else datetime.now()
+                    return (base - delta(units)).date()
+                base = now.date() if now else date.today()
+                return base - delta(units)
+
+
+@functools.lru_cache(maxsize=DATE_CACHE_SIZE)
+def _convert_absolute_date(str_, dmy=False):
+    """Parse absolute dates."""
+    for regex, format_, dmy_format in _ABSOLUTE_DATES:
+        if regex.match(str_):
+            if dmy and dmy_format:
+                format_ = dmy_format
+            return datetime.strptime(str_, format_).date()
+    raise ValueError('Format "%s" not recognized' % str_)
+
+
+def convert_to_date(str_, dmy=False, now=None):
+    """Parse humanized dates.
+
+    Relative dates ('2 days ago') are resolved against `now`, or
+    against the current time if not provided.  Absolute dates are
+    memoized, because the same strings are repeated across the full
+    catalog.
+
+    """
+    value = _convert_relative_date(str_, now)
+    if value is None:
+        value = _convert_absolute_date(str_, dmy)
+    return value
+
+
+_ORDINAL_SUFFIX = re.compile(r'(st|nd|rd|th)')
+
+
+@functools.lru_cache(maxsize=16)
+def _separator(separator):
+    """Return the compiled pattern of a decimal separator."""
+    return re.compile(separator)
 
 
 def convert_to_number(str_, as_int=False, separator=r',', default=0):
     """Parse issues / viewers numbers."""
     result = default
     # Remove ordinal suffix
-    str_ = re.sub(r'(st|nd|rd|th)', '', str_)
+    str_ = _ORDINAL_SUFFIX.sub('', str_)
     # Remove decimal separator (for millards)
-    str_ = re.sub(separator, '', str_)
+    str_ = _separator(separator).sub('', str_)
     try:
         if str_.endswith('k'):
             result = 1000 * float(str_[:-1])
@@ -138,38 +169,132 @@ def convert_to_number(str_, as_int=False, separator=r',', default=0):
     return result
 
 
+def _identity(item):
+    """Cleaning plan for items that do not need to be cleaned."""
+    return item
+
+
 class CleanBasePipeline(object):
 
-    def process_item(self, item, spider):
-        """Search a proper method to clean this item. Generate names of
-        candidates and call it passing the item and the spider. The
-        order of calling is:
+    # Item classes that have a cleaning plan.  The plans for those
+    # classes are compiled when the spider is open.
+    items = ()
 
-        - clean_<spidername>_<itemname>()
-        - clean_<itemname>()
+    def __init__(self):
+        # Reference time used to resolve relative dates.  Fixed
+        # during the crawl, so all the items share the same `now`.
+        self.now = None
+        # Compiled cleaning plans, indexed by (spider name, item class)
+        self._plans = {}
 
-        """
+    def open_spider(self, spider):
+        self.now = datetime.now()
+        self._plans = {}
+        for item_class in self.items:
+            self.get_plan(item_class, spider)
+
+    def process_item(self, item, spider):
+        """Clean the item using the compiled plan for the spider."""
 
         # Bypass the pipeline if called with dry-run parameter.
         if hasattr(spider, 'dry_run'):
             return item
 
-        # Deduce the name of the method that can take care of the
-        # item, two options: one generic and one specific for the
-        # spider.
-        item_name = item.__class__.__name__.lower()
+        return self.clean(item, spider)
+
+    def clean(self, item, spider):
+        """Clean an item using the compiled plan for the spider."""
+        return self.get_plan(item.__class__, spider)(item)
+
+    def get_plan(self, item_class, spider):
+        """Return the compiled cleaning plan for an item class.
+
+        The plan is compiled the first time that is requested for a
+        spider, and is a callable that receive the item and return
+        the cleaned one.
+
+        """
+        key = (spider.name, item_class)
+        try:
+            plan = self._plans[key]
+        except KeyError:
+            plan = self._plans[key] = self.compile_plan(item_class, spider)
+        return plan
+
+    def compile_plan(self, item_class, spider):
+        """Search a proper method to clean items of a class.
+
+        Generate names of candidates and compile a plan that call it
+        passing the item and the spider.  The search order is:
+
+        - clean_<spidername>_<itemname>()
+        - cleaning_plan_<itemname>(), compiled with `compile_fields()`
+        - clean_<itemname>()
+
+        """
+        item_name = item_class.__name__.lower()
         spider_name = spider.name.lower()
-        item_method = 'clean_%s' % item_name
         spider_method = 'clean_%s_%s' % (spider_name, item_name)
+        plan_method = 'cleaning_plan_%s' % item_name
+        item_method = 'clean_%s' % item_name
 
         if hasattr(self, spider_method):
-            return getattr(self, spider_method)(item, spider)
+            method = getattr(self, spider_method)
+            return lambda item: method(item, spider)
+        elif hasattr(self, plan_method):
+            cleaning_plan = getattr(self, plan_method)(spider)
+            fields = self.compile_fields(item_class, spider, cleaning_plan)
+            return functools.partial(self._clean_fields, fields=fields)
         elif hasattr(self, item_method):
-            return getattr(self, item_method)(item, spider)
+            method = getattr(self, item_method)
+            return lambda item: method(item, spider)
         else:
             logger.debug('Method (%s, %s) not found,'
                          'item not cleaned' % (item_method, spider_method))
-        return item
+            return _identity
+
+    def compile_fields(self, item_class, spider, cleaning_plan):
+        """Compile the cleaners for all the fields in an item class.
+
+        For every field search a method that can clean it.  The
+        search order is:
+
+        - clean_field_<sipdername>_<itemname>_<fieldname>()
+        - clean_field_<itemname>_<fieldname>()
+        - <fieldname> inside the cleaning_plan dict
+
+        Return a dict with a callable for every field that can be
+        cleaned.
+
+        """
+        item_name = item_class.__name__.lower()
+        spider_name = spider.name.lower()
+
+        field_names = set(getattr(item_class, 'fields', ()))
+        field_names.update(cleaning_plan)
+
+        fields = {}
+        for field_name in sorted(field_names):
+            item_method = 'clean_field_%s_%s' % (item_name, field_name)
+            spider_method = 'clean_field_%s_%s_%s' % (spider_name, item_name,
+                                                      field_name)
+            if hasattr(self, spider_method):
+                fields[field_name] = getattr(self, spider_method)
+            elif hasattr(self, item_method):
+                fields[field_name] = getattr(self, item_method)
+            elif field_name in cleaning_plan:
+                _call = cleaning_plan[field_name]
+                if callable(_call):
+                    fields[field_name] = _call
+                else:
+                    fields[field_name] = functools.partial(_call[0],
+                                                           **_call[1])
+            else:
+                logger.debug('Method (%s, %s) not found,'
+                             'field %s not cleaned' % (item_method,
+                                                       spider_method,
+                                                       field_name))
+        return fields
 
     def _as_str(self, obj, separator=' '):
         """Convert the object into a string, if can be iterated, use separator
@@ -285,7 +410,7 @@ class CleanBasePipeline(object):
             return field
         value = self._as_str(field)
         try:
-            value = convert_to_date(value, dmy=dmy)
+            value = convert_to_date(value, dmy=dmy, now=self.now)
         except ValueError:
             if not optional:
                 raise ValueError('field is not optional'
@@ -295,43 +420,26 @@ class CleanBasePipeline(object):
     def clean_item(self, item, spider, cleaning_plan):
         """Clean all the fields in a item.
 
-        This method iterates for every field in the item object and
-        search a method that can clean it.  The search order is:
-
-        - clean_field_<sipdername>_<itemname>_<fieldname>()
-        - clean_field_<itemname>_<fieldname>()
-        - <itemname>() inside the cleaning_plan dict
+        This method compiles the cleaning plan (see
+        `compile_fields()`) and use it for this item only.  Prefer
+        `clean()`, that use the plan compiled for the spider.
 
         This _clean do not update the item instance. Return a new
         cleaned instance.
 
         """
+        fields = self.compile_fields(item.__class__, spider, cleaning_plan)
+        return self._clean_fields(item, fields)
 
-        item_name = item.__class__.__name__.lower()
-        spider_name = spider.name.lower()
-
+    def _clean_fields(self, item, fields):
+        """Clean all the fields in a item using compiled cleaners."""
         _item = item.copy()
         for field_name, value in item.items():
-            item_method = 'clean_field_%s_%s' % (item_name, field_name)
-            spider_method = 'clean_field_%s_%s_%s' % (spider_name, item_name,
-                                                      field_name)
-
+            cleaner = fields.get(field_name)
+            if cleaner is None:
+                continue
             try:
-                if hasattr(self, spider_method):
-                    _item[field_name] = getattr(self, spider_method)(value)
-                elif hasattr(self, item_method):
-                    _item[field_name] = getattr(self, item_method)(value)
-                elif field_name in cleaning_plan:
-                    _call = cleaning_plan[field_name]
-                    if callable(_call):
-                        _item[field_name] = _call(value)
-                    else:
-                        _item[field_name] = _call[0](value, **_call[1])
-                else:
-                    logger.debug('Method (%s, %s) not found,'
-                                 'field %s not cleaned' % (item_method,
-                                                           spider_method,
-                                                           field_name))
+                _item[field_name] = cleaner(value)
             except ValueError as e:
                 msg = 'Error processing %s: %s [%s]'
                 raise DropItem(msg % (field_name, str(value), e))
@@ -340,17 +448,18 @@ class CleanBasePipeline(object):
 
 class CleanPipeline(CleanBasePipeline):
 
+    items = (Genres, Manga, Issue, IssuePage)
+
     # -- Genres
-    def clean_genres(self, item, spider):
+    def cleaning_plan_genres(self, spider):
         exclude = ('All', '[no chapters]', '')
-        cleaning_plan = {
+        return {
             'names': (self._clean_field_list, {'exclude': exclude})
         }
-        return self.clean_item(item, spider, cleaning_plan)
 
     # -- Manga
-    def clean_manga(self, item, spider):
-        cleaning_plan = {
+    def cleaning_plan_manga(self, spider):
+        return {
             'name': self._clean_field_str,
             'alt_name': (self._clean_field_list,
                          {
@@ -403,11 +512,13 @@ class CleanPipeline(CleanBasePipeline):
                        }),
             'url': self._clean_field_str,
         }
-        return self.clean_item(item, spider, cleaning_plan)
 
     # -- Issue
     def clean_issue(self, item, spider):
-        cleaning_plan = {
+        return self.clean(item, spider)
+
+    def cleaning_plan_issue(self, spider):
+        return {
             'name': (self._clean_field_str, {'max_length': 200}),
             'number': (self._clean_field_str, {
                 'optional': True,
@@ -419,18 +530,16 @@ class CleanPipeline(CleanBasePipeline):
             'release': self._clean_field_date,
             'url': self._clean_field_str,
         }
-        return self.clean_item(item, spider, cleaning_plan)
 
     # -- IssuePage
-    def clean_issuepage(self, item, spider):
-        cleaning_plan = {
+    def cleaning_plan_issuepage(self, spider):
+        return {
             'manga': self._clean_field_str,
             'issue': (self._clean_field_str, {'optional': True}),
             'number': self._clean_field_int,
             # 'image_urls'
             # 'images'
         }
-        return self.clean_item(item, spider, cleaning_plan)
 
     # -- Batoto fields
     def clean_field_batoto_genres_names(self, field):
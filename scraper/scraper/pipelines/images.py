@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+#
+# (c) 2018 Alberto Planas <aplanas@gmail.com>
+#
+# This file is part of KManga.
+#
+# KManga is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# KManga is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with KManga.  If not, see <http://www.gnu.org/licenses/>.
+
+from io import BytesIO
+
+from PIL import Image
+from scrapy.pipelines.images import ImagesPipeline
+from scrapy.settings import Settings
+
+from mobi import Container
+from mobi.mobi import HEIGHT
+from mobi.mobi import WIDTH
+
+
+class KMangaImagesPipeline(ImagesPipeline):
+    """Images pipeline with an optional Kindle mode.
+
+    If `IMAGES_KINDLE` is set, the images are converted to grayscale
+    and reduced to the Kindle resolution when downloaded.  The result
+    of the pipeline contains also the size of the stored image and the
+    bounding box without margins (see `Container.margin_bbox`), so the
+    MOBI builder do not need to analyze the image again.
+
+    """
+    def __init__(self, store_uri, download_func=None, settings=None):
+        super(KMangaImagesPipeline, self).__init__(
+            store_uri, download_func=download_func, settings=settings)
+        if isinstance(settings, dict) or settings is None:
+            settings = Settings(settings)
+        self.kindle = settings.getbool('IMAGES_KINDLE')
+        # Metadata of the stored images, indexed by path
+        self.metadata = {}
+
+    def _kindle_size(self, image):
+        """Return the size of the page for an image."""
+        # Double page images are rotated in the MOBI
+        width, height = image.size
+        return (HEIGHT, WIDTH) if width > height else (WIDTH, HEIGHT)
+
+    def convert_image(self, image, size=None):
+        if not self.kindle:
+            return super(KMangaImagesPipeline, self).convert_image(
+                image, size)
+
+        if image.mode in ('RGBA', 'LA', 'P'):
+            image = image.convert('RGBA')
+            background = Image.new('RGBA', image.size, (255, 255, 255))
+            background.paste(image, image)
+            image = background
+        image = image.convert('L')
+        # `thumbnail` never enlarges the image
+        image.thumbnail(size if size else self._kindle_size(image),
+                        Image.ANTIALIAS)
+
+        buf = BytesIO()
+        image.save(buf, 'JPEG')
+        return image, buf
+
+    def get_images(self, response, request, info):
+        images = super(KMangaImagesPipeline, self).get_images(
+            response, request, info)
+        for n, (path, image, buf) in enumerate(images):
+            # The first one is the full image, the rest are thumbnails
+            if self.kindle and n == 0:
+                self.metadata[path] = {
+                    'size': image.size,
+                    'bbox': Container.margin_bbox(image),
+                }
+            yield path, image, buf
+
+    def media_downloaded(self, response, request, info):
+        result = super(KMangaImagesPipeline, self).media_downloaded(
+            response, request, info)
+        result.update(self.metadata.pop(result['path'], {}))
+        return result
@@ -17,30 +17,60 @@
 # You should have received a copy of the GNU General Public License
 # along with KManga.  If not, see <http://www.gnu.org/licenses/>.
 
+import hashlib
+import json
 import logging
 import os.path
 import urllib.parse
 
 from django.core.files import File
 from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from scrapy import signals
 
-import django
-django.setup()
-
-from core.models import Issue
-from core.models import Manga
-from core.models import Source
+from scraper.db import Issue
+from scraper.db import Manga
+from scraper.db import Source
 
 logger = logging.getLogger(__name__)
 
 
+def item_fingerprint(item):
+    """Stable hash of the fields and relations of a manga item."""
+    fields = dict(item)
+    fields['issues'] = sorted((dict(i) for i in item['issues']),
+                              key=lambda i: i['url'])
+    fields['images'] = [i['path'] for i in item.get('images', [])]
+    data = json.dumps(fields, sort_keys=True, default=str)
+    return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+
 class UpdateDBPipeline(object):
-    def __init__(self, images_store):
+    def __init__(self, images_store, stats=None):
         self.images_store = images_store
+        self.stats = stats
+        # Newest (release, url) issue seen during the latest update
+        self.latest = {}
 
     @classmethod
-    def from_settings(cls, settings):
-        return cls(settings['IMAGES_STORE'])
+    def from_crawler(cls, crawler):
+        pipeline = cls(crawler.settings['IMAGES_STORE'], crawler.stats)
+        crawler.signals.connect(pipeline.spider_closed,
+                                signal=signals.spider_closed)
+        return pipeline
+
+    def spider_closed(self, spider, reason):
+        """Advance the high-water mark of the latest update."""
+        spider_name = spider.name.lower()
+        if reason != 'finished' or spider_name not in self.latest:
+            return
+        release, url = self.latest.pop(spider_name)
+        # The mark never moves backward, even with concurrent updates
+        Source.objects.filter(
+            Q(latest_release__isnull=True) | Q(latest_release__lte=release),
+            spider=spider_name,
+        ).update(latest_release=release, latest_url=url)
 
     def process_item(self, item, spider):
         # Bypass the pipeline if called with dry-run parameter.
@@ -181,10 +211,26 @@ class UpdateDBPipeline(object):
         # always updated)
         self.update_collection(item, spider)
 
+    def _inc_stats(self, key, spider):
+        if self.stats:
+            self.stats.inc_value(key, spider=spider)
+
     @transaction.atomic
     def update_collection(self, item, spider):
         """Update a collection of issues (a manga)."""
         spider_name = spider.name.lower()
+
+        # If the manga did not change since the last update, we only
+        # signalize that the manga is still there (see `modified`)
+        fingerprint = item_fingerprint(item)
+        unchanged = Manga.objects.filter(
+            url=item['url'], source__spider=spider_name,
+            fingerprint=fingerprint).update(modified=timezone.now())
+        if unchanged:
+            self._inc_stats('updatedb/fingerprint/hit', spider)
+            return
+        self._inc_stats('updatedb/fingerprint/miss', spider)
+
         source = Source.objects.get(spider=spider_name)
         try:
             manga = Manga.objects.get(url=item['url'], source=source)
@@ -208,9 +254,13 @@ class UpdateDBPipeline(object):
         # detection of the values that are required.
         #
         # Update the fields of the manga object that are populated
-        for f in fields:
-            self._sic(manga, item, f)
+        updated = {f for f in fields if self._sic(manga, item, f)}
 
+        # The full text search document needs to be updated for new
+        # mangas, or when some of the indexed fields change
+        reindex = not manga.pk or bool(updated & {'name', 'description'})
+
+        manga.fingerprint = fingerprint
         # Save the object to have a PK (creation of relations). Also
         # update the the `modified` field to signalize that the Manga
         # is still there (share semantic with `last_seen`)
@@ -218,8 +268,9 @@ class UpdateDBPipeline(object):
 
         # alt_name
         alt_names = [{'name': i} for i in item['alt_name']]
-        self._update_relation(manga, 'altname_set', 'name',
-                              alt_names, self._update_name)
+        new_values, _, del_values = self._update_relation(
+            manga, 'altname_set', 'name', alt_names, self._update_name)
+        reindex = reindex or new_values or del_values
 
         # genres
         genres = [{'name': i} for i in item['genres']]
@@ -242,13 +293,30 @@ class UpdateDBPipeline(object):
             manga.cover.delete()
 
         # issues
-        self._update_relation(manga, 'issue_set', 'url', item['issues'],
-                              self._update_issue)
+        _, _, del_values = self._update_relation(
+            manga, 'issue_set', 'url', item['issues'], self._update_issue)
+        # `Issue.save()` maintains the latest activity, but not the
+        # removal of issues
+        if del_values:
+            Manga.objects.filter(pk=manga.pk).update(
+                last_issue_modified=timezone.now())
+
+        if reindex:
+            Manga.objects.refresh([manga.pk])
 
     @transaction.atomic
     def update_latest(self, item, spider):
         """Update the latest issues in a collection."""
         spider_name = spider.name.lower()
+
+        # Track the newest issue for the high-water mark
+        releases = [(i['release'], i['url']) for i in item['issues']
+                    if i.get('release')]
+        if spider_name in self.latest:
+            releases.append(self.latest[spider_name])
+        if releases:
+            self.latest[spider_name] = max(releases)
+
         source = Source.objects.get(spider=spider_name)
         try:
             manga = Manga.objects.get(url=item['url'], source=source)
@@ -257,11 +325,18 @@ class UpdateDBPipeline(object):
             # because will be created in the next full sync.
             return
 
+        added = False
         for item_issue in item['issues']:
             if not manga.issue_set.filter(url=item_issue['url']).exists():
                 issue = Issue()
                 self._update_issue(issue, item_issue)
                 manga.issue_set.add(issue, bulk=False)
+                added = True
+
+        # The fingerprint do not describe the issues anymore, so the
+        # next collection update needs to synchronize them
+        if added:
+            Manga.objects.filter(pk=manga.pk).update(fingerprint='')
 
     @transaction.atomic
     def update_manga(self, item, spider):
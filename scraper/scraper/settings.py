@@ -97,6 +97,8 @@ RETRY_HTTP_CODES = [500, 502, 503, 400, 403, 404, 408]
 # Some proxy generate redirects of other errors, this codes invalidate
 # the proxy and is mapped as a RETRY_HTTP_CODE 500
 SMART_PROXY_ERROR_CODES = [301, 302, 504]
+# Seconds between updates of the failed proxies in the database
+SMART_PROXY_FLUSH_INTERVAL = 60
 
 DOWNLOADER_MIDDLEWARES = {
     # Engine side
@@ -105,6 +107,9 @@ DOWNLOADER_MIDDLEWARES = {
     'scraper.middlewares.VHost': 50,
     # CloudFlare middleware needs to be before RetryMiddleware (550)
     'scraper.middlewares.CloudFlare': 555,
+    # SmartCache needs to be before HttpCompressionMiddleware (590),
+    # so the responses are stored and hashed already decompressed.
+    'scraper.middlewares.SmartCache': 580,
     # We need to put SmartProxy between RetryMiddleware (500) and
     # HttpProxyMiddleware (750).  Note that RedirectMiddleware (600)
     # can influence if the response is seem by SmartProxy.
@@ -116,8 +121,17 @@ DOWNLOADER_MIDDLEWARES = {
     # Downloader side
 }
 
+# Seconds that a cached page is used without re-validation, for
+# every spider operation.  Only the operations listed here use the
+# cache.
+SMART_CACHE_TTL = {
+    'catalog': 12 * 3600,
+    'collection': 0,
+    'latest': 0,
+}
+
 ITEM_PIPELINES = {
-    'scrapy.pipelines.images.ImagesPipeline': 25,
+    'scraper.pipelines.KMangaImagesPipeline': 25,
     'scraper.pipelines.CleanPipeline': 50,
     'scraper.pipelines.UpdateDBPipeline': 75,
     'scraper.pipelines.CollectorPipeline': 100,
@@ -126,6 +140,10 @@ ITEM_PIPELINES = {
 _dirname = os.path.dirname(__file__)
 IMAGES_STORE = os.path.join(_dirname, '..', 'img_store')
 ISSUES_STORE = os.path.join(_dirname, '..', 'issue_store')
+# Store the images in grayscale and reduced to the Kindle resolution
+IMAGES_KINDLE = False
+# Directory for the cached catalog and collection pages
+SMART_CACHE_DIR = os.path.join(_dirname, '..', 'http_cache')
 
 USER_AGENT = 'Mozilla/5.0 (X11; Linux x86_64; rv:52.0) Gecko/20100101 Firefox/52.0'
 
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+#
+# (c) 2018 Alberto Planas <aplanas@gmail.com>
+#
+# This file is part of KManga.
+#
+# KManga is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# KManga is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with KManga.  If not, see <http://www.gnu.org/licenses/>.
+
+# Benchmarks for the clean pipeline.  Run it from the root directory:
+#
+#   PYTHONPATH=.:scraper:kmanga DJANGO_SETTINGS_MODULE=kmanga.settings \
+#     python -m tests.bench_clean
+#
+
+from datetime import datetime
+import timeit
+
+import scraper.items
+from scraper.pipelines import CleanPipeline
+from scraper.pipelines.clean import _convert_absolute_date
+from scraper.pipelines.clean import convert_to_date
+
+# Date strings as found in the `release` field of each spider
+DATES = {
+    'batoto': [
+        '2 days ago', '5 hours ago', '1 week ago', 'an hour ago',
+        '3 months ago', '1 year ago', '10 minutes ago',
+    ],
+    'kissmanga': [
+        '7/24/2018', '12/31/2017', '1/5/2016', '10/10/2015',
+    ],
+    'mangadex': [
+        '2018-07-24 10:21:34 UTC', '2017-12-31 00:00:00 UTC',
+        '2016-01-05 18:42:11 UTC',
+    ],
+    'mangafox': [
+        'Today', 'Yesterday', 'Jul 24, 2018', 'Dec 31, 2017',
+        'Jan 5, 2016',
+    ],
+    'mangahere': [
+        'Today', 'Yesterday', 'Jul 24, 2018', 'Dec 31, 2017',
+        'Jan 05, 2016 10:00AM',
+    ],
+    'mangareader': [
+        '07/24/2018', '12/31/2017', '01/05/2016',
+    ],
+    'mangasee': [
+        '2018-07-24T10:21:34+00:00', '2017-12-31T00:00:00+00:00',
+        '2016-01-05T18:42:11+00:00',
+    ],
+    'unionmangas': [
+        '24/07/2018', '31/12/2017', '05/01/2016',
+    ],
+}
+
+# Number of times that the corpus of every spider is parsed
+REPEAT = 10000
+
+# Number of items pushed through the pipeline
+ITEMS = 100000
+
+
+class Spider(object):
+    def __init__(self, name):
+        self.name = name
+
+
+def bench_convert_to_date():
+    now = datetime.now()
+    for spider, dates in sorted(DATES.items()):
+        dmy = spider == 'unionmangas'
+
+        def run():
+            for date_ in dates:
+                convert_to_date(date_, dmy=dmy, now=now)
+
+        _convert_absolute_date.cache_clear()
+        cold = timeit.timeit(run, number=1)
+        warm = timeit.timeit(run, number=REPEAT)
+        calls = len(dates) * REPEAT
+        print('%-12s cold: %8.2f us/call  warm: %8.2f us/call' % (
+            spider, 1e6 * cold / len(dates), 1e6 * warm / calls))
+    print(_convert_absolute_date.cache_info())
+
+
+def bench_clean_pipeline():
+    for spider_name in ('mangafox', 'unionmangas'):
+        spider = Spider(spider_name)
+        dates = DATES[spider_name]
+        issues = [
+            scraper.items.Issue(
+                name=['Manga %d ' % i, 'Ch.%d' % i],
+                number=[' %d ' % i],
+                order=str(i),
+                language='EN' if spider_name == 'mangafox' else 'PT',
+                release=[dates[i % len(dates)]],
+                url='http://example.com/manga/c%03d/' % i,
+            ) for i in range(ITEMS)
+        ]
+
+        pipeline = CleanPipeline()
+        pipeline.open_spider(spider)
+        elapsed = timeit.timeit(
+            lambda: [pipeline.process_item(i, spider) for i in issues],
+            number=1)
+        print('%-12s %d items: %6.2f s (%6.2f us/item)' % (
+            spider_name, ITEMS, elapsed, 1e6 * elapsed / ITEMS))
+
+
+if __name__ == '__main__':
+    bench_convert_to_date()
+    bench_clean_pipeline()
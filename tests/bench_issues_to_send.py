@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+#
+# (c) 2018 Alberto Planas <aplanas@gmail.com>
+#
+# This file is part of KManga.
+#
+# KManga is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# KManga is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with KManga.  If not, see <http://www.gnu.org/licenses/>.
+
+# Benchmark for the per-subscription and the set-based versions of
+# `issues_to_send`, over a seeded test database.  Run it from the
+# root directory:
+#
+#   PYTHONPATH=.:scraper:kmanga DJANGO_SETTINGS_MODULE=kmanga.settings \
+#     python -m tests.bench_issues_to_send
+#
+
+import datetime
+import timeit
+
+import django
+from django.test.utils import setup_test_environment
+from django.test.runner import DiscoverRunner
+from django.utils import timezone
+
+# Size of the seeded database
+USERS = 1000
+SUBSCRIPTIONS_PER_USER = 10
+MANGAS = 500
+ISSUES_PER_MANGA = 20
+
+
+def seed():
+    from django.contrib.auth.models import User
+
+    from core.models import Issue
+    from core.models import Manga
+    from core.models import QuotaEntry
+    from core.models import Result
+    from core.models import Source
+    from core.models import Subscription
+
+    source = Source.objects.create(name='source', spider='spider',
+                                   url='http://example.com')
+    Manga.objects.bulk_create(
+        Manga(name='Manga %d' % i, url='http://example.com/manga%d' % i,
+              description='Description', source=source)
+        for i in range(MANGAS))
+    mangas = list(Manga.objects.all())
+    release = datetime.date(year=2018, month=1, day=1)
+    Issue.objects.bulk_create(
+        Issue(name='%s issue %d' % (manga.name, i), number=str(i), order=i,
+              language='EN', release=release,
+              url='%s/issue%d' % (manga.url, i), manga=manga)
+        for manga in mangas for i in range(ISSUES_PER_MANGA))
+    User.objects.bulk_create(
+        User(username='user%d' % i, email='user%d@example.com' % i)
+        for i in range(USERS))
+    users = list(User.objects.all())
+    Subscription.objects.bulk_create(
+        Subscription(manga=mangas[(u * SUBSCRIPTIONS_PER_USER + i) % MANGAS],
+                     user=user, language='EN')
+        for u, user in enumerate(users)
+        for i in range(SUBSCRIPTIONS_PER_USER))
+
+    issues = {}
+    for issue in Issue.objects.order_by('order'):
+        issues.setdefault(issue.manga_id, []).append(issue)
+    # Every subscription has one issue sent recently, one failed and
+    # one failed too many times
+    now = timezone.now()
+    results = []
+    for subs in Subscription.objects.all():
+        sent, failed, retried = issues[subs.manga_id][:3]
+        results.extend((
+            Result(issue=sent, subscription=subs, status=Result.SENT,
+                   send_date=now),
+            Result(issue=failed, subscription=subs, status=Result.FAILED),
+            Result(issue=retried, subscription=subs, status=Result.FAILED,
+                   retry=Subscription.RETRY + 1),
+        ))
+    Result.objects.bulk_create(results)
+    # `bulk_create` do not call `Result.save()`
+    results = Result.objects.filter(
+        send_date__isnull=False).select_related('subscription')
+    QuotaEntry.objects.bulk_create(
+        QuotaEntry(result=r, user_id=r.subscription.user_id,
+                   subscription=r.subscription, send_date=r.send_date)
+        for r in results)
+
+
+def bench_issues_to_send():
+    from core.models import Subscription
+
+    subscriptions = Subscription.actives.all()
+    count = subscriptions.count()
+
+    def per_subscription():
+        return {s.pk: list(s.issues_to_send()) for s in subscriptions}
+
+    def set_based():
+        return subscriptions.issues_to_send()
+
+    assert per_subscription() == set_based()
+    for name, func in (('per-subscription', per_subscription),
+                       ('set-based', set_based)):
+        elapsed = timeit.timeit(func, number=1)
+        print('%-16s %d subscriptions: %6.2f s' % (name, count, elapsed))
+
+
+if __name__ == '__main__':
+    # Configure Django to run outside the manage.py tool.  The models
+    # are imported after this.
+    django.setup()
+    setup_test_environment()
+
+    dr = DiscoverRunner()
+    old_config = dr.setup_databases()
+    try:
+        seed()
+        bench_issues_to_send()
+    finally:
+        dr.teardown_databases(old_config)
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+#
+# (c) 2018 Alberto Planas <aplanas@gmail.com>
+#
+# This file is part of KManga.
+#
+# KManga is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# KManga is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with KManga.  If not, see <http://www.gnu.org/licenses/>.
+
+# Benchmark for the size and the build time of the containers with
+# and without an encoding profile, over the fixture images.  Run it
+# from the root directory:
+#
+#   PYTHONPATH=.:scraper:kmanga python -m tests.bench_profile
+#
+
+import glob
+import tempfile
+import time
+
+from mobi import Container
+from mobi import Profile
+
+IMAGES = sorted(glob.glob('tests/fixtures/images/*.*'))
+
+# Profiles to compare
+PROFILES = (
+    ('none', None),
+    ('quality-75', Profile(quality=75)),
+    ('quality-80', Profile(quality=80)),
+    ('quality-90', Profile(quality=90)),
+)
+
+
+def bench_profile():
+    for name, profile in PROFILES:
+        with tempfile.TemporaryDirectory() as tmp:
+            container = Container('%s/container' % tmp, profile=profile)
+            container.create()
+            start = time.time()
+            container.add_images(IMAGES, adjust=Container.ROTATE,
+                                 _filter=Container.FILTER_MARGIN)
+            elapsed = time.time() - start
+            size = container.get_size()
+        print('%-12s %d pages: %8d bytes/page, %6.3f s' % (
+            name, len(IMAGES), size // len(IMAGES), elapsed))
+
+
+if __name__ == '__main__':
+    bench_profile()
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+#
+# (c) 2018 Alberto Planas <aplanas@gmail.com>
+#
+# This file is part of KManga.
+#
+# KManga is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# KManga is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with KManga.  If not, see <http://www.gnu.org/licenses/>.
+
+# Benchmark for the overhead of the VHost middleware.  Run it from
+# the root directory:
+#
+#   PYTHONPATH=.:scraper:kmanga DJANGO_SETTINGS_MODULE=kmanga.settings \
+#     python -m tests.bench_vhost
+#
+
+import re
+import timeit
+
+from scrapy.http import HtmlResponse
+from scrapy.http import Request
+
+from scraper.middlewares import VHost
+
+# Number of requests processed in every run
+REQUESTS = 10000
+
+# Number of runs, the best one is reported
+REPEAT = 5
+
+
+class Spider(object):
+    name = 'unionmangas'
+    allowed_domains = ['unionmangas.net', 'unionmangas.site']
+    vhost_ip = '85.93.89.57'
+
+
+class RegexVHost(object):
+    """Previous version, with a regular expression over the full URL."""
+
+    def process_request(self, request, spider):
+        if hasattr(spider, 'vhost_ip'):
+            for domain in spider.allowed_domains:
+                ip = spider.vhost_ip
+                url = re.sub(r'(www.)?%s' % domain, ip, request.url)
+                if request.url != url:
+                    request = request.replace(url=url,
+                                              headers={'Host': domain})
+                    return request
+
+    def process_response(self, request, response, spider):
+        if hasattr(spider, 'vhost_ip'):
+            headers = request.headers.to_unicode_dict()
+            domain = headers.get('Host', spider.allowed_domains[0])
+            ip = spider.vhost_ip
+            url = re.sub(ip, domain, response.url)
+            response = response.replace(url=url)
+        return response
+
+
+def bench_vhost():
+    spider = Spider()
+    requests = [
+        Request('http://unionmangas.site/leitor/Manga_%d/%02d' % (i, i % 50))
+        for i in range(REQUESTS)
+    ]
+
+    def baseline():
+        # Cost of the new request and response objects
+        for request in requests:
+            new_request = request.replace(url=request.url)
+            response = HtmlResponse(new_request.url, request=new_request)
+            response.replace(url=request.url)
+
+    def run(middleware):
+        for request in requests:
+            new_request = middleware.process_request(request, spider)
+            # Second pass of the rewritten request
+            middleware.process_request(new_request, spider)
+            response = HtmlResponse(new_request.url, request=new_request)
+            middleware.process_response(new_request, response, spider)
+
+    base = min(timeit.repeat(baseline, number=1, repeat=REPEAT))
+    vhost = VHost()
+    vhost.spider_opened(spider)
+    for name, middleware in (('regex', RegexVHost()), ('vhost', vhost)):
+        elapsed = min(timeit.repeat(lambda: run(middleware), number=1,
+                                    repeat=REPEAT))
+        print('%-6s %d requests: %6.3f s (overhead: %6.2f us/request)' % (
+            name, REQUESTS, elapsed, 1e6 * (elapsed - base) / REQUESTS))
+
+
+if __name__ == '__main__':
+    bench_vhost()
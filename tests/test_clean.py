@@ -23,7 +23,11 @@ from unittest.mock import Mock
 from unittest.mock import patch
 import unittest
 
+from scrapy.exceptions import DropItem
+
+import scraper.items
 from scraper.pipelines import CleanBasePipeline
+from scraper.pipelines import CleanPipeline
 from scraper.pipelines import convert_to_date
 from scraper.pipelines import convert_to_number
 
@@ -33,6 +37,11 @@ class MyItem(object):
     pass
 
 
+class Spider(object):
+    def __init__(self, name):
+        self.name = name
+
+
 class TestCleanBasePipeline(unittest.TestCase):
 
     def setUp(self):
@@ -84,6 +93,20 @@ class TestCleanBasePipeline(unittest.TestCase):
         self.assertEqual(convert_to_date('1 year ago'), one_year_ago)
         self.assertEqual(convert_to_date('2 years ago'), two_years_ago)
 
+    def test_convert_to_date_now(self):
+        now = datetime(year=2015, month=1, day=1, hour=1)
+        today = date(year=2015, month=1, day=1)
+        yesterday = date(year=2014, month=12, day=31)
+        self.assertEqual(convert_to_date('Today', now=now), today)
+        self.assertEqual(convert_to_date('Yesterday', now=now), yesterday)
+        self.assertEqual(convert_to_date('now', now=now), today)
+        self.assertEqual(convert_to_date('10 minutes ago', now=now), today)
+        self.assertEqual(convert_to_date('2 hours ago', now=now), yesterday)
+        self.assertEqual(convert_to_date('1 day ago', now=now), yesterday)
+        self.assertEqual(convert_to_date('2 weeks ago', now=now),
+                         date(year=2014, month=12, day=18))
+        self.assertEqual(convert_to_date('Dec 31, 2014', now=now), yesterday)
+
     def test_convert_to_date_absolute(self):
         today = date(year=2015, month=1, day=1)
         yesterday = date(year=2014, month=12, day=31)
@@ -103,6 +126,13 @@ class TestCleanBasePipeline(unittest.TestCase):
         self.assertEqual(convert_to_date('2015-01-01 00:00:00 UTC'), today)
         with self.assertRaises(ValueError):
             convert_to_date('Not valid date')
+        with self.assertRaises(ValueError):
+            convert_to_date('01 Jan 2015 - 10:00 AM')
+        # Memoized values are separated by the `dmy` parameter
+        self.assertEqual(convert_to_date('01/02/2015'),
+                         date(year=2015, month=1, day=2))
+        self.assertEqual(convert_to_date('01/02/2015', dmy=True),
+                         date(year=2015, month=2, day=1))
 
     def test_convert_to_number(self):
         value_flt = convert_to_number('10k')
@@ -202,3 +232,95 @@ class TestCleanBasePipeline(unittest.TestCase):
                                                        default='err'), 'err')
         # with self.assertRaises(ValueError):
         #     self.clean._clean_field_float('', default='err')
+
+    def test_clean_field_date(self):
+        self.clean.now = datetime(year=2015, month=1, day=1, hour=1)
+        self.assertEqual(self.clean._clean_field_date('2 days ago'),
+                         date(year=2014, month=12, day=30))
+        self.assertEqual(self.clean._clean_field_date(['31/12/2014'],
+                                                      dmy=True),
+                         date(year=2014, month=12, day=31))
+        with self.assertRaises(ValueError):
+            self.clean._clean_field_date('Not valid date')
+
+
+class TestCleanPipeline(unittest.TestCase):
+
+    def setUp(self):
+        self.clean = CleanPipeline()
+
+    def tearDown(self):
+        self.clean = None
+
+    def _issue(self, **kwargs):
+        issue = scraper.items.Issue(
+            name=[' Issue 1 '],
+            number=['1'],
+            order='1',
+            language='EN',
+            release=['Dec 31, 2014'],
+            url='http://example.com/manga/issue1/',
+        )
+        issue.update(kwargs)
+        return issue
+
+    def test_open_spider(self):
+        spider = Spider('spider')
+        self.clean.open_spider(spider)
+        self.assertTrue(self.clean.now)
+        for item_class in CleanPipeline.items:
+            self.assertIn(('spider', item_class), self.clean._plans)
+
+    def test_compile_plan(self):
+        spider = Spider('spider')
+        plan = self.clean.compile_plan(scraper.items.Issue, spider)
+        issue = plan(self._issue())
+        self.assertEqual(issue['name'], 'Issue 1')
+        self.assertEqual(issue['number'], '1')
+        self.assertEqual(issue['order'], 1)
+        self.assertEqual(issue['release'], date(year=2014, month=12, day=31))
+        self.assertEqual(issue['url'], 'http://example.com/manga/issue1/')
+
+        # Items without plan are not cleaned
+        plan = self.clean.compile_plan(MyItem, spider)
+        item = MyItem()
+        self.assertEqual(plan(item), item)
+
+    def test_compile_plan_spider_field(self):
+        spider = Spider('mangafox')
+        self.clean.open_spider(spider)
+        issue = self.clean.process_item(self._issue(), spider)
+        self.assertEqual(issue['url'],
+                         'http://example.com/manga/issue1/1.html')
+
+    def test_process_item_manga(self):
+        spider = Spider('spider')
+        self.clean.open_spider(spider)
+        manga = scraper.items.Manga(
+            name='Manga',
+            alt_name=['Alt 1', ''],
+            reading_direction='rl',
+            status='Ongoing',
+            genres=['Genre 1', 'Genre 2'],
+            rank='1,000th',
+            rank_order='asc',
+            description='<p>Description</p>',
+            issues=[self._issue(), self._issue(language='XX')],
+            url='http://example.com/manga/',
+        )
+        manga = self.clean.process_item(manga, spider)
+        self.assertEqual(manga['alt_name'], ['Alt 1'])
+        self.assertEqual(manga['reading_direction'], 'RL')
+        self.assertEqual(manga['status'], 'O')
+        self.assertEqual(manga['rank'], 1000)
+        self.assertEqual(manga['rank_order'], 'ASC')
+        self.assertEqual(manga['description'], 'Description')
+        # The issue with the invalid language is dropped
+        self.assertEqual(len(manga['issues']), 1)
+        self.assertEqual(manga['issues'][0]['order'], 1)
+
+    def test_process_item_drop(self):
+        spider = Spider('spider')
+        self.clean.open_spider(spider)
+        with self.assertRaises(DropItem):
+            self.clean.process_item(self._issue(language='XX'), spider)
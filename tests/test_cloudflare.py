@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+#
+# (c) 2018 Alberto Planas <aplanas@gmail.com>
+#
+# This file is part of KManga.
+#
+# KManga is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# KManga is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with KManga.  If not, see <http://www.gnu.org/licenses/>.
+
+import time
+import unittest
+from unittest.mock import patch
+
+from scrapy.http import HtmlResponse
+from scrapy.http import Request
+from twisted.internet import defer
+
+from scraper.middlewares import CloudFlare
+
+CHALLENGE = b'''
+<html>
+<body>
+<script>
+  var s,t,o,p,b,r,e,a,k,i,n,g,f, abc={"def":+((!+[]))};
+  t.length;abc.def+=+!![];a.value = abc.def
+</script>
+<form id="challenge-form" action="/cdn-cgi/l/chk_jschl" method="get">
+  <input type="hidden" name="jschl_vc" value="vc"/>
+  <input type="hidden" name="pass" value="pass"/>
+  <input type="hidden" id="jschl-answer" name="jschl_answer"/>
+</form>
+</body>
+</html>
+'''
+
+
+class Spider(object):
+    name = 'spider'
+    allowed_domains = ['example.com']
+    cloudflare = True
+
+
+class TestCloudFlare(unittest.TestCase):
+
+    def setUp(self):
+        self.cloudflare = CloudFlare()
+        self.spider = Spider()
+        CloudFlare.clearance = {}
+
+    def tearDown(self):
+        CloudFlare.clearance = {}
+
+    def test_clearance(self):
+        request = Request('http://example.com/manga')
+        self.cloudflare.process_request(request, self.spider)
+        self.assertEqual(request.cookies, {})
+
+        response = HtmlResponse('http://example.com/manga', headers={
+            'Set-Cookie': [
+                'cf_clearance=clearance; '
+                'expires=Fri, 01-Jan-2100 00:00:00 GMT; path=/',
+                'other=value; path=/',
+            ]})
+        self.cloudflare.process_response(request, response, self.spider)
+        cookies, expiration = CloudFlare.clearance['example.com']
+        self.assertEqual(cookies, {'cf_clearance': 'clearance'})
+        self.assertGreater(expiration, time.time())
+
+        # The cookies are shared by all the middlewares
+        request = Request('http://example.com/manga')
+        CloudFlare().process_request(request, self.spider)
+        self.assertEqual(request.cookies, {'cf_clearance': 'clearance'})
+
+        # Expired cookies are not used
+        CloudFlare.clearance['example.com'] = (cookies, time.time() - 1)
+        request = Request('http://example.com/manga')
+        self.cloudflare.process_request(request, self.spider)
+        self.assertEqual(request.cookies, {})
+
+    @patch('scraper.middlewares.task.deferLater')
+    @patch('scraper.middlewares.threads.deferToThread')
+    def test_challenge(self, deferToThread, deferLater):
+        deferToThread.side_effect = lambda f, *a: defer.maybeDeferred(f, *a)
+        deferLater.side_effect = lambda c, d, f: defer.succeed(f())
+        self.cloudflare._solve = lambda *args: '42.0000000000'
+
+        request = Request('http://example.com/manga')
+        response = HtmlResponse('http://example.com/manga', status=503,
+                                headers={'Server': 'cloudflare-nginx'},
+                                body=CHALLENGE, request=request)
+        d = self.cloudflare.process_response(request, response, self.spider)
+        self.assertIsInstance(d, defer.Deferred)
+        results = []
+        d.addCallback(results.append)
+        new_request = results[0]
+        self.assertTrue(new_request.meta['cloudflare'])
+        self.assertIn('jschl_answer=42.0000000000', new_request.url)
+        self.assertEqual(new_request.headers['Referer'],
+                         b'http://example.com/manga')
+        self.assertLessEqual(deferLater.call_args[0][1], CloudFlare.DELAY)
+
+        # The answer is not resolved again
+        response = response.replace(request=new_request)
+        self.assertIs(self.cloudflare.process_response(
+            new_request, response, self.spider), response)
+
+    @patch('scraper.middlewares.threads.deferToThread')
+    def test_challenge_error(self, deferToThread):
+        deferToThread.return_value = defer.fail(OSError('js not found'))
+
+        request = Request('http://example.com/manga')
+        response = HtmlResponse('http://example.com/manga', status=503,
+                                headers={'Server': 'cloudflare-nginx'},
+                                body=CHALLENGE, request=request)
+        d = self.cloudflare.process_response(request, response, self.spider)
+        results = []
+        d.addCallback(results.append)
+        self.assertIs(results[0], response)
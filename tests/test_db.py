@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+#
+# (c) 2018 Alberto Planas <aplanas@gmail.com>
+#
+# This file is part of KManga.
+#
+# KManga is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# KManga is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with KManga.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import subprocess
+import sys
+import unittest
+
+from scraper.db import LazyModel
+
+CHECK_SETUP = '''
+from django.apps import apps
+import scraper.middlewares
+import scraper.pipelines
+print(apps.ready)
+from scraper.db import Source
+Source.DoesNotExist
+print(apps.ready)
+'''
+
+
+class TestLazyModel(unittest.TestCase):
+
+    def test_lazy_setup(self):
+        env = dict(os.environ)
+        env.setdefault('DJANGO_SETTINGS_MODULE', 'kmanga.settings')
+        env['PYTHONPATH'] = os.pathsep.join(sys.path)
+        output = subprocess.check_output([sys.executable, '-c', CHECK_SETUP],
+                                         env=env, stderr=subprocess.DEVNULL)
+        self.assertEqual(output.split(), [b'False', b'True'])
+
+    def test_resolve(self):
+        model = LazyModel('collections', 'OrderedDict')
+        self.assertIsNone(model._model)
+        self.assertEqual(model(a=1), {'a': 1})
+        self.assertEqual(model.__name__, 'OrderedDict')
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+#
+# (c) 2018 Alberto Planas <aplanas@gmail.com>
+#
+# This file is part of KManga.
+#
+# KManga is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# KManga is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with KManga.  If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+
+from PIL import Image
+from scrapy.http import Request
+from scrapy.http import Response
+
+from mobi import Container
+from mobi.mobi import HEIGHT
+from mobi.mobi import WIDTH
+from scraper.pipelines import KMangaImagesPipeline
+
+
+class TestKMangaImagesPipeline(unittest.TestCase):
+
+    def _pipeline(self, kindle):
+        return KMangaImagesPipeline('tests/fixtures/images',
+                                    settings={'IMAGES_KINDLE': kindle})
+
+    def _response(self, name):
+        url = 'http://example.com/%s' % name
+        with open('tests/fixtures/images/%s' % name, 'rb') as f:
+            return Response(url, body=f.read(), request=Request(url))
+
+    def test_convert_image(self):
+        img = Image.open('tests/fixtures/images/width-large.jpg')
+        pipeline = self._pipeline(kindle=False)
+        image, _ = pipeline.convert_image(img)
+        self.assertEqual(image.mode, 'RGB')
+        self.assertEqual(image.size, img.size)
+
+        pipeline = self._pipeline(kindle=True)
+        image, buf = pipeline.convert_image(img)
+        self.assertEqual(image.mode, 'L')
+        self.assertLessEqual(image.size[0], WIDTH)
+        self.assertLessEqual(image.size[1], HEIGHT)
+        self.assertEqual(Image.open(buf).size, image.size)
+
+        # Double pages are reduced to the rotated page
+        img = Image.open('tests/fixtures/images/height-large-horizontal.jpg')
+        image, _ = pipeline.convert_image(img)
+        self.assertEqual(image.size[0], HEIGHT)
+
+        # Transparent images get a white background
+        img = Image.new('RGBA', (100, 100), (0, 0, 0, 0))
+        image, _ = pipeline.convert_image(img)
+        self.assertEqual(image.getextrema(), (255, 255))
+
+    def test_get_images(self):
+        pipeline = self._pipeline(kindle=True)
+        response = self._response('height-large.jpg')
+        images = list(pipeline.get_images(response, response.request, None))
+        self.assertEqual(len(images), 1)
+        path, image, _ = images[0]
+        metadata = pipeline.metadata[path]
+        self.assertEqual(metadata['size'], image.size)
+        self.assertEqual(metadata['bbox'], Container.margin_bbox(image))
+
+        # No metadata without the Kindle mode
+        pipeline = self._pipeline(kindle=False)
+        list(pipeline.get_images(response, response.request, None))
+        self.assertEqual(pipeline.metadata, {})
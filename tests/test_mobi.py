@@ -27,7 +27,7 @@ import xml.dom.minidom
 from PIL import Image
 from PIL import ImageOps
 
-from mobi import Container, MangaMobi
+from mobi import Container, DEVICES, MangaMobi, Profile
 from mobi.mobi import WIDTH, HEIGHT
 
 
@@ -105,6 +105,26 @@ class TestContainer(unittest.TestCase):
         self.assertEqual(self.container._npages, 13)
         self.assertEqual(self.container.npages(), 13)
 
+    def test_add_image_bbox(self):
+        image = 'tests/fixtures/images/height-large-horizontal.jpg'
+        img = Image.open(image)
+        bbox = self.container.margin_bbox(img)
+        self.container.add_image(image, adjust=Container.ROTATE,
+                                 _filter=Container.FILTER_MARGIN)
+        self.container.add_image(image, adjust=Container.ROTATE,
+                                 _filter=Container.FILTER_MARGIN, bbox=bbox)
+        img1 = Image.open('tests/fixtures/dummy/images/006_rotate.jpg')
+        img2 = Image.open('tests/fixtures/dummy/images/007_rotate.jpg')
+        self.assertEqual(img1.size, img2.size)
+
+        # A bounding box of the full image do not change the image
+        image = 'tests/fixtures/images/width-small.jpg'
+        bbox = (0, 0) + Image.open(image).size
+        self.container.add_image(image, _filter=Container.FILTER_MARGIN,
+                                 as_link=True, bbox=bbox)
+        self.assertTrue(os.path.samefile(
+            image, 'tests/fixtures/dummy/images/008.jpg'))
+
     def test_add_images(self):
         pass
 
@@ -354,6 +374,75 @@ class TestContainer(unittest.TestCase):
         self._test_container_split(has_cover=False)
 
 
+class TestProfile(unittest.TestCase):
+
+    def setUp(self):
+        shutil.copytree('tests/fixtures/container01', 'tests/fixtures/dummy')
+        self.profile = Profile()
+        self.container = Container('tests/fixtures/dummy',
+                                   profile=self.profile)
+        self.container.npages()
+
+    def tearDown(self):
+        self.container.clean()
+
+    def test_encode(self):
+        img = Image.open('tests/fixtures/images/width-large.jpg')
+        _img, changed = self.profile.encode(img)
+        self.assertTrue(changed)
+        self.assertEqual(_img.mode, 'L')
+        self.assertLessEqual(_img.size[0], WIDTH)
+        self.assertLessEqual(_img.size[1], HEIGHT)
+
+        # The encoded image do not change again
+        _, changed = self.profile.encode(_img)
+        self.assertFalse(changed)
+
+    def test_save(self):
+        img = Image.open('tests/fixtures/images/width-small-bw.png')
+        img, _ = self.profile.encode(img)
+        self.profile.save(img, 'tests/fixtures/dummy/test.png')
+        img = Image.open('tests/fixtures/dummy/test.png')
+        self.assertEqual(img.mode, 'P')
+        self.assertLessEqual(len(img.convert('L').getcolors()), 16)
+
+    def test_add_image(self):
+        image = 'tests/fixtures/images/width-small.jpg'
+        self.container.add_image(image)
+        img = Image.open('tests/fixtures/dummy/images/006.jpg')
+        self.assertEqual(img.mode, 'L')
+        self.assertLess(os.path.getsize('tests/fixtures/dummy/images/006.jpg'),
+                        os.path.getsize(image))
+
+        # An encoded image is linked
+        self.container.add_image('tests/fixtures/dummy/images/006.jpg',
+                                 as_link=True)
+        self.assertTrue(os.path.samefile(
+            'tests/fixtures/dummy/images/006.jpg',
+            'tests/fixtures/dummy/images/007.jpg'))
+
+    def test_device(self):
+        profile = DEVICES['kindle']
+        container = Container('tests/fixtures/dummy_kindle', profile=profile)
+        container.create(clean=True)
+        try:
+            container.add_image('tests/fixtures/images/width-large.jpg',
+                                adjust=Container.RESIZE_CROP)
+            img = Image.open(
+                'tests/fixtures/dummy_kindle/images/000_resize_crop.jpg')
+            self.assertEqual(img.size, (profile.width, profile.height))
+
+            # The volumes are created for the same device
+            for _container in container.split(container.get_size(), True):
+                self.assertIs(_container.profile, profile)
+                _container.clean()
+
+            mobi = MangaMobi(container, None)
+            self.assertEqual(mobi._img_scaled_size((300, 400)), (600, 800))
+        finally:
+            container.clean()
+
+
 class TestMangaMobi(unittest.TestCase):
 
     def setUp(self):
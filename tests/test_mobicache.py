@@ -295,6 +295,20 @@ class TestMobiCache(unittest.TestCase):
         self.assertTrue('url2' in self.cache)
         self.assertTrue('url3' in self.cache)
 
+    def test_remove(self):
+        key1 = MobiCache.key('url1', 'generic')
+        key2 = MobiCache.key('url1', 'kindle')
+        key3 = MobiCache.key('url10', 'generic')
+        self.cache[key1] = ['tests/fixtures/cache/mobi1.mobi']
+        self.cache[key2] = ['tests/fixtures/cache/mobi2.1.mobi']
+        self.cache[key3] = ['tests/fixtures/cache/mobi3.mobi']
+        self.assertTrue(len(self.cache) == 3)
+        self.cache.remove('url1')
+        self.assertTrue(len(self.cache) == 1)
+        self.assertTrue(key3 in self.cache)
+        self.assertEqual(os.listdir(self.cache.data), [
+            os.path.basename(self.cache[key3][0][0][1])])
+
     def test_free(self):
         self.cache.slots = 3
         self.cache.nclean = 2
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+#
+# (c) 2018 Alberto Planas <aplanas@gmail.com>
+#
+# This file is part of KManga.
+#
+# KManga is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# KManga is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with KManga.  If not, see <http://www.gnu.org/licenses/>.
+
+import shutil
+import tempfile
+import unittest
+from unittest.mock import Mock
+from unittest.mock import patch
+
+from scrapy.exceptions import IgnoreRequest
+from scrapy.http import HtmlResponse
+from scrapy.http import Request
+from scrapy.settings import Settings
+
+from scraper.middlewares import SmartCache
+
+
+class Spider(object):
+    name = 'spider'
+    _operation = 'latest'
+
+    def parse_catalog(self, response):
+        pass
+
+    def parse_collection(self, response):
+        pass
+
+    def parse_latest(self, response):
+        pass
+
+
+class TestSmartCache(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        settings = Settings({
+            'SMART_CACHE_DIR': self.path,
+            'SMART_CACHE_TTL': {'catalog': 3600, 'latest': 0},
+        })
+        self.cache = SmartCache(settings, Mock())
+        self.spider = Spider()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def _download(self, request, status=200, body=b'<html></html>',
+                  headers=None):
+        result = self.cache.process_request(request, self.spider)
+        if result:
+            return result
+        response = HtmlResponse(request.url, status=status, body=body,
+                                headers=headers, request=request)
+        return self.cache.process_response(request, response, self.spider)
+
+    def test_ignore_pages(self):
+        request = Request('http://example.com/latest',
+                          callback=self.spider.parse_latest)
+        self.assertIsNone(self.cache.process_request(request, self.spider))
+        self.assertNotIn('smart_cache', request.meta)
+
+        self.spider._operation = 'manga'
+        request = Request('http://example.com/manga',
+                          callback=self.spider.parse_collection)
+        self.cache.process_request(request, self.spider)
+        self.assertNotIn('smart_cache', request.meta)
+
+    @patch('scraper.middlewares.Manga')
+    def test_unchanged_collection(self, manga):
+        update = manga.objects.filter.return_value.update
+        update.return_value = 1
+        headers = {'ETag': '"v1"', 'Last-Modified': 'Mon, 01 Jan 2018'}
+        request = Request('http://example.com/manga',
+                          callback=self.spider.parse_collection)
+        response = self._download(request, headers=headers)
+        self.assertEqual(response.body, b'<html></html>')
+
+        # The item was not stored, so the page is parsed again
+        request = Request('http://example.com/manga',
+                          callback=self.spider.parse_collection)
+        response = self._download(request, status=304, body=b'')
+        self.assertEqual(response.body, b'<html></html>')
+        self.assertFalse(update.called)
+        item = {'url': 'http://example.com/manga', 'issues': []}
+        self.cache.item_scraped(item, response, self.spider)
+
+        # Conditional request, and the page did not change
+        request = Request('http://example.com/manga',
+                          callback=self.spider.parse_collection)
+        with self.assertRaises(IgnoreRequest):
+            self._download(request, status=304, body=b'')
+        self.assertEqual(request.headers['If-None-Match'], b'"v1"')
+        self.assertEqual(request.headers['If-Modified-Since'],
+                         b'Mon, 01 Jan 2018')
+        self.assertEqual(manga.objects.filter.call_args[1]['url'],
+                         'http://example.com/manga')
+
+        # Same body without cache headers
+        request = Request('http://example.com/manga',
+                          callback=self.spider.parse_collection)
+        with self.assertRaises(IgnoreRequest):
+            self._download(request)
+
+        # The manga is not in the database anymore
+        update.return_value = 0
+        request = Request('http://example.com/manga',
+                          callback=self.spider.parse_collection)
+        response = self._download(request)
+        self.assertEqual(response.body, b'<html></html>')
+        update.return_value = 1
+
+        # The page changed
+        request = Request('http://example.com/manga',
+                          callback=self.spider.parse_collection)
+        response = self._download(request, body=b'<html>new</html>')
+        self.assertEqual(response.body, b'<html>new</html>')
+
+        # The item pre-populated from the catalog changed
+        request = Request('http://example.com/manga',
+                          callback=self.spider.parse_collection,
+                          meta={'manga': {'rank': 1}})
+        response = self._download(request, body=b'<html>new</html>')
+        self.assertEqual(response.body, b'<html>new</html>')
+
+    def test_catalog(self):
+        self.spider._operation = 'catalog'
+        request = Request('http://example.com/catalog?b=2&a=1')
+        self._download(request, body=b'<html>catalog</html>')
+
+        # The page is used from the cache during the TTL
+        request = Request('http://example.com/catalog?a=1&b=2')
+        response = self.cache.process_request(request, self.spider)
+        self.assertIn('cached', response.flags)
+        self.assertEqual(response.body, b'<html>catalog</html>')
+        self.assertIs(
+            self.cache.process_response(request, response, self.spider),
+            response)
+
+        # Unchanged catalog pages are parsed anyway
+        self.cache.ttl['catalog'] = 0
+        request = Request('http://example.com/catalog?a=1&b=2')
+        response = self._download(request, status=304, body=b'')
+        self.assertEqual(response.status, 200)
+        self.assertEqual(response.body, b'<html>catalog</html>')
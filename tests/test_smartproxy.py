@@ -21,6 +21,7 @@ import unittest
 from unittest.mock import patch
 from unittest.mock import Mock
 
+from scraper.middlewares import ProxyPool
 from scraper.middlewares import SmartProxy
 from scraper.middlewares import RetryPartial
 
@@ -78,7 +79,10 @@ class TestSmartProxy(unittest.TestCase):
 
     def setUp(self):
         error_codes = [[500], [301]]
-        settings = Mock(**{'getlist.side_effect': error_codes})
+        settings = Mock(**{
+            'getlist.side_effect': error_codes,
+            'getfloat.return_value': 60,
+        })
         self.proxy = SmartProxy(settings)
 
     def tearDown(self):
@@ -123,8 +127,9 @@ class TestSmartProxy(unittest.TestCase):
         spider_mock.name = 'spider'
         needs_proxy.return_value = True
 
-        proxy_ = Mock(proxy='myproxy')
-        proxy.objects = Mock(**{'get_one.return_value': proxy_})
+        proxy.objects = Mock(**{
+            'filter.return_value.values_list.return_value': [('myproxy', 0)]
+        })
 
         self.proxy.process_request(request_mock, spider_mock)
 
@@ -142,8 +147,9 @@ class TestSmartProxy(unittest.TestCase):
         spider_mock.name = 'spider'
         needs_proxy.return_value = True
 
-        proxy_ = Mock(proxy='myproxy')
-        proxy.objects = Mock(**{'get_one.return_value': proxy_})
+        proxy.objects = Mock(**{
+            'filter.return_value.values_list.return_value': [('myproxy', 0)]
+        })
 
         self.proxy.process_request(request_mock, spider_mock)
 
@@ -161,7 +167,9 @@ class TestSmartProxy(unittest.TestCase):
         spider_mock.name = 'spider'
         needs_proxy.return_value = True
 
-        proxy.objects = Mock(**{'get_one.return_value': None})
+        proxy.objects = Mock(**{
+            'filter.return_value.values_list.return_value': []
+        })
 
         self.proxy.process_request(request_mock, spider_mock)
 
@@ -288,14 +296,31 @@ class TestSmartProxy(unittest.TestCase):
         spider_mock = Mock()
         request_mock.meta = {'proxy': 'http://myproxy'}
 
-        proxy.DoesNotExist = Exception
         proxy.objects = Mock(**{
-            'get.side_effect': proxy.DoesNotExist(),
-            'remainings.return_value': 0,
+            'filter.return_value.values_list.return_value': []
         })
         self.proxy.process_exception(request_mock, None, spider_mock)
 
         self.assertTrue('proxy' not in request_mock.meta)
+        self.assertEqual(self.proxy.pools[spider_mock.name].failures,
+                         {'myproxy': 1})
+
+    @patch('scraper.middlewares.Proxy')
+    def test_spider_closed(self, proxy):
+        spider_mock = Mock()
+        spider_mock.name = 'spider'
+        proxy.RETRY = 3
+        proxy.objects = Mock(**{
+            'filter.return_value.values_list.return_value': [('myproxy', 0)]
+        })
+        pool = self.proxy._pool(spider_mock)
+        pool.failure('myproxy')
+        proxy.objects.discard_many.assert_not_called()
+
+        self.proxy.spider_closed(spider_mock)
+        proxy.objects.discard_many.assert_called_once_with(
+            {'myproxy': 1}, 'spider')
+        self.assertFalse(self.proxy.pools)
 
     def test_map_status_error(self):
         response_mock = Mock()
@@ -330,3 +355,53 @@ class TestSmartProxy(unittest.TestCase):
         url_from = 'http://mangahere.cc/manga1.html'
         url_to = 'http://mangahere.cc/new/manga1.html'
         self.assertTrue(self.proxy._valid_redirect(status, url_from, url_to))
+
+
+@patch('scraper.middlewares.Proxy')
+class TestProxyPool(unittest.TestCase):
+
+    def _pool(self, proxy, proxies, flush_interval=60):
+        proxy.RETRY = 3
+        proxy.objects = Mock(**{
+            'filter.return_value.values_list.return_value': proxies
+        })
+        return ProxyPool('spider', flush_interval)
+
+    def test_get(self, proxy):
+        pool = self._pool(proxy, [('proxy1', 0), ('proxy2', 0)])
+        self.assertEqual(len(pool), 2)
+        self.assertIn(pool.get(), ('proxy1', 'proxy2'))
+        proxy.objects.filter.assert_called_once_with(source__spider='spider')
+
+        # Only the working proxy is selected
+        for _ in range(10):
+            pool.success('proxy1')
+        pool.proxies['proxy2'][1] = 10 ** 9
+        self.assertEqual(
+            {pool.get() for _ in range(20)}, {'proxy1'})
+
+    def test_get_empty(self, proxy):
+        pool = self._pool(proxy, [])
+        self.assertIsNone(pool.get())
+        # The pool is reloaded when it is empty
+        self.assertEqual(proxy.objects.filter.call_count, 2)
+
+    def test_failure(self, proxy):
+        pool = self._pool(proxy, [('proxy1', 2), ('proxy2', 0)])
+        pool.failure('proxy1')
+        self.assertEqual(len(pool), 2)
+        pool.failure('proxy1')
+        self.assertEqual(len(pool), 1)
+        self.assertEqual(pool.get(), 'proxy2')
+        proxy.objects.discard_many.assert_not_called()
+
+        pool.flush()
+        proxy.objects.discard_many.assert_called_once_with(
+            {'proxy1': 2}, 'spider')
+        self.assertEqual(pool.failures, {})
+
+    def test_failure_flush(self, proxy):
+        pool = self._pool(proxy, [('proxy1', 0)], flush_interval=0)
+        pool.failure('proxy1')
+        proxy.objects.discard_many.assert_called_once_with(
+            {'proxy1': 1}, 'spider')
@@ -19,6 +19,7 @@
 
 import datetime
 import unittest
+from unittest.mock import Mock
 
 import django
 from django.test.utils import setup_test_environment
@@ -26,13 +27,12 @@ from django.test.runner import DiscoverRunner
 import scraper.items
 from scraper.pipelines import UpdateDBPipeline
 
-from core.models import Source, SourceLanguage, Genre, Manga
-
-
 # Configure Django to run tests outside the manage.py tool
 django.setup()
 setup_test_environment()
 
+from core.models import Source, SourceLanguage, Genre, Manga
+
 
 class Spider(object):
     pass
@@ -156,6 +156,9 @@ class TestUpdateDBPipeline(unittest.TestCase):
         self.assertEqual(m.rank_order, 'ASC')
         self.assertEqual(m.description, 'Description')
 
+        # The full text search index is updated without refresh
+        self.assertEqual(list(Manga.objects.search('MangaA')), [m])
+
         self.assertEqual(len(m.issue_set.all()), 2)
 
         i = m.issue_set.get(name='issue1')
@@ -319,6 +322,112 @@ class TestUpdateDBPipeline(unittest.TestCase):
         # Remove the image
         m.cover.delete()
 
+    def test_update_collection_fingerprint(self):
+        self.updatedb.stats = Mock()
+        manga = scraper.items.Manga(
+            name='Manga1',
+            alt_name=['Manga1'],
+            author='Author',
+            artist='Artist',
+            reading_direction='LR',
+            status='O',
+            genres=[],
+            rank=1,
+            rank_order='ASC',
+            description='Description',
+            image_urls=[],
+            images=[],
+            issues=[
+                scraper.items.Issue(
+                    name='issue1',
+                    number='1',
+                    order=1,
+                    language='EN',
+                    release=datetime.date(year=2014, month=1, day=1),
+                    url='http://manga1.org/issue1'),
+            ],
+            url='http://manga1.org')
+        self.updatedb.update_collection(manga, self.spider)
+        m = Manga.objects.get(url='http://manga1.org')
+        self.assertEqual(len(m.fingerprint), 40)
+
+        # The same item only update the `modified` field
+        self.updatedb.update_collection(manga, self.spider)
+        m2 = Manga.objects.get(url='http://manga1.org')
+        self.assertEqual(m2.fingerprint, m.fingerprint)
+        self.assertGreater(m2.modified, m.modified)
+        self.updatedb.stats.inc_value.assert_called_with(
+            'updatedb/fingerprint/hit', spider=self.spider)
+
+        # A new issue change the fingerprint
+        manga['issues'].append(
+            scraper.items.Issue(
+                name='issue2',
+                number='2',
+                order=2,
+                language='EN',
+                release=datetime.date(year=2014, month=1, day=2),
+                url='http://manga1.org/issue2'))
+        self.updatedb.update_collection(manga, self.spider)
+        self.updatedb.stats.inc_value.assert_called_with(
+            'updatedb/fingerprint/miss', spider=self.spider)
+        m3 = Manga.objects.get(url='http://manga1.org')
+        self.assertNotEqual(m3.fingerprint, m.fingerprint)
+        self.assertEqual(m3.issue_set.count(), 2)
+
+    def test_update_latest_fingerprint(self):
+        self.updatedb.stats = Mock()
+        issue1 = scraper.items.Issue(
+            name='issue1',
+            number='1',
+            order=1,
+            language='EN',
+            release=datetime.date(year=2014, month=1, day=1),
+            url='http://manga1.org/issue1')
+        issue2 = scraper.items.Issue(
+            name='issue2',
+            number='2',
+            order=2,
+            language='EN',
+            release=datetime.date(year=2014, month=1, day=2),
+            url='http://manga1.org/issue2')
+        manga = scraper.items.Manga(
+            name='Manga1',
+            alt_name=['Manga1'],
+            author='Author',
+            artist='Artist',
+            reading_direction='LR',
+            status='O',
+            genres=[],
+            rank=1,
+            rank_order='ASC',
+            description='Description',
+            image_urls=[],
+            images=[],
+            issues=[issue1],
+            url='http://manga1.org')
+        self.updatedb.update_collection(manga, self.spider)
+
+        # A new issue from the latest update clear the fingerprint
+        latest = scraper.items.Manga(name='Manga1', issues=[issue2],
+                                     url='http://manga1.org')
+        self.updatedb.update_latest(latest, self.spider)
+        m = Manga.objects.get(url='http://manga1.org')
+        self.assertEqual(m.fingerprint, '')
+        self.assertEqual(m.issue_set.count(), 2)
+
+        # The issue was removed from the site before the next update
+        self.updatedb.update_collection(manga, self.spider)
+        self.updatedb.stats.inc_value.assert_called_with(
+            'updatedb/fingerprint/miss', spider=self.spider)
+        m = Manga.objects.get(url='http://manga1.org')
+        self.assertEqual(len(m.fingerprint), 40)
+        self.assertEqual([i.url for i in m.issue_set.all()],
+                         ['http://manga1.org/issue1'])
+        # The removal of an issue is also an activity of the manga
+        self.assertGreater(m.last_issue_modified,
+                           m.issue_set.get().modified)
+
     def test_update_latest(self):
         names = ['g1', 'g2', 'g3']
         genres = scraper.items.Genres(
@@ -433,5 +542,26 @@ class TestUpdateDBPipeline(unittest.TestCase):
         self.assertEqual(i.release, datetime.date(year=2014, month=1, day=4))
         self.assertEqual(i.url, 'http://manga1.org/issue4')
 
+        # The high-water mark only advance if the crawl finish
+        self.updatedb.spider_closed(self.spider, 'shutdown')
+        source = Source.objects.get(spider='spider')
+        self.assertIsNone(source.latest_release)
+        self.assertEqual(self.updatedb.latest['spider'], (
+            datetime.date(year=2014, month=1, day=4),
+            'http://manga1.org/issue4'))
+        self.updatedb.spider_closed(self.spider, 'finished')
+        source = Source.objects.get(spider='spider')
+        self.assertEqual(source.latest_release,
+                         datetime.date(year=2014, month=1, day=4))
+        self.assertEqual(source.latest_url, 'http://manga1.org/issue4')
+
+        # The mark never move backward
+        self.updatedb.latest['spider'] = (
+            datetime.date(year=2014, month=1, day=1),
+            'http://manga1.org/issue1')
+        self.updatedb.spider_closed(self.spider, 'finished')
+        source = Source.objects.get(spider='spider')
+        self.assertEqual(source.latest_url, 'http://manga1.org/issue4')
+
         # Remove the image
         m.cover.delete()
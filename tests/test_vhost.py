@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+#
+# (c) 2018 Alberto Planas <aplanas@gmail.com>
+#
+# This file is part of KManga.
+#
+# KManga is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# KManga is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with KManga.  If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+
+from scrapy.http import HtmlResponse
+from scrapy.http import Request
+
+from scraper.middlewares import VHost
+
+
+class Spider(object):
+    name = 'spider'
+    allowed_domains = ['example.com']
+    vhost_ip = '10.0.0.1'
+
+
+class TestVHost(unittest.TestCase):
+
+    def setUp(self):
+        self.vhost = VHost()
+        self.spider = Spider()
+        self.vhost.spider_opened(self.spider)
+
+    def test_process_request(self):
+        for url, expected in (
+                ('http://example.com/manga', 'http://10.0.0.1/manga'),
+                ('http://www.example.com/manga', 'http://10.0.0.1/manga'),
+                ('http://example.com:8080/manga?q=example.com',
+                 'http://10.0.0.1:8080/manga?q=example.com')):
+            request = Request(url)
+            new_request = self.vhost.process_request(request, self.spider)
+            self.assertEqual(new_request.url, expected)
+            self.assertEqual(new_request.headers['Host'], b'example.com')
+            self.assertEqual(new_request.meta['vhost'], 'example.com')
+
+            # The second pass do not rewrite the request
+            self.assertIsNone(
+                self.vhost.process_request(new_request, self.spider))
+
+    def test_process_request_redirect(self):
+        request = Request('http://example.com/manga')
+        request = self.vhost.process_request(request, self.spider)
+
+        # The redirections copy the meta of the original request
+        redirect = request.replace(url='http://www.example.com/other')
+        new_request = self.vhost.process_request(redirect, self.spider)
+        self.assertEqual(new_request.url, 'http://10.0.0.1/other')
+        self.assertEqual(new_request.meta['vhost'], 'example.com')
+
+    def test_process_request_skip(self):
+        # The dot is not a wildcard, and other domains are not changed
+        for url in ('http://exampleXcom/manga',
+                    'http://cdn.example.com/image.jpg',
+                    'http://other.com/example.com'):
+            request = Request(url)
+            self.assertIsNone(
+                self.vhost.process_request(request, self.spider))
+
+        spider = Spider()
+        spider.name = 'other'
+        del Spider.vhost_ip
+        try:
+            request = Request('http://example.com/manga')
+            self.assertIsNone(self.vhost.process_request(request, spider))
+        finally:
+            Spider.vhost_ip = '10.0.0.1'
+
+    def test_process_response(self):
+        request = Request('http://www.example.com/manga')
+        request = self.vhost.process_request(request, self.spider)
+        response = HtmlResponse(request.url, request=request)
+        response = self.vhost.process_response(request, response,
+                                               self.spider)
+        self.assertEqual(response.url, 'http://example.com/manga')
+
+        # Responses from other hosts are not changed
+        request = Request('http://cdn.example.com/image.jpg')
+        response = HtmlResponse(request.url, request=request)
+        response = self.vhost.process_response(request, response,
+                                               self.spider)
+        self.assertEqual(response.url, 'http://cdn.example.com/image.jpg')